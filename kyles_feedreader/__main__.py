@@ -1,35 +1,34 @@
-import gevent
-
-from asciimatics.screen import Screen
-from asciimatics.effects import Cycle, Stars
-from asciimatics.renderers import FigletText
-from asciimatics.exceptions import StopApplication
-
 import click
 
-from .controllers.main import MainController
 from . import db_interface, defaults
 
+# gevent and asciimatics are imported where they are used so "kfr --help" and option errors come back quickly.
+
 
-def main_loop(controller):
-    screen = None
-    while True:
-        if screen is None or screen.has_resized():
-            if screen is not None:
-                screen.close(False)
-            screen = Screen.open()
-            controller.build_ui(screen, None)
-            # effects = create_effect(screen)
-            # screen.set_scenes([Scene(effects, 500)])
-        try:
-            screen.draw_next_frame()
-        except StopApplication:
-            screen.close(True)
-            break
-        gevent.sleep(0.05)
+def main_loop(db):
+    import gevent
+    from .controllers.main import MainController
+    from .feed_model import FeedManager
+    from .redraw import RedrawLoop
+    from .state_journal import StateJournal
+
+    manager = FeedManager(db)
+    journal = StateJournal(db)
+    controller = MainController(db, manager, journal)
+    loop = RedrawLoop(controller)
+    manager.on_change = controller.detail.on_change = loop.notify
+    workers = [gevent.spawn(manager.worker), gevent.spawn(journal.worker)]
+    try:
+        loop.run()
+    finally:
+        gevent.killall(workers)
+        journal.flush()
 
 
 def create_effect(screen):
+    from asciimatics.effects import Cycle, Stars
+    from asciimatics.renderers import FigletText
+
     effects = [
         Cycle(
             screen,
@@ -48,9 +47,9 @@ def create_effect(screen):
 @click.command()
 @click.option("--db-path", default=defaults.db_path, type=click.Path(dir_okay=False, resolve_path=True))
 def main(db_path):
-    db_interface.initialize_sql(db_path)
-    controller = MainController()
-    loop = gevent.spawn(main_loop, controller)
+    import gevent
+
+    loop = gevent.spawn(main_loop, db_interface.DBInterface(db_path))
     loop.join()
 
 
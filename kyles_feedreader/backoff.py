@@ -0,0 +1,75 @@
+# By Kyle Monson
+
+import datetime
+import random
+from http import HTTPStatus
+from typing import Any
+
+from .db_interface import FeedData
+from .defaults import backoff_base, backoff_max, disable_after
+from .fetching import parse_http_date
+
+
+# Responses that mean the server is up but wants us to come back later. They back a feed off like any other
+# failure but never disable it.
+THROTTLE_STATUSES = (HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.SERVICE_UNAVAILABLE)
+
+
+def parse_retry_after(value: str | None, now: datetime.datetime) -> datetime.timedelta | None:
+    """Parse a Retry-After header, either a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return datetime.timedelta(seconds=int(value))
+    when = parse_http_date(value)
+    if when is None:
+        return None
+    return max(when - now, datetime.timedelta())
+
+
+def backoff_delay(failures: int, base: datetime.timedelta = backoff_base,
+                  maximum: datetime.timedelta = backoff_max) -> datetime.timedelta:
+    """
+    Exponential backoff for a feed that has failed failures times in a row, with jitter so feeds that broke together
+    don't all come back on the same update.
+    """
+    # Capping the exponent keeps feeds that fail for months from overflowing timedelta.
+    delay = min(base * 2 ** min(failures - 1, 20), maximum)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def is_due(feed: FeedData, now: datetime.datetime) -> bool:
+    return not feed.disabled and (feed.retry_at is None or feed.retry_at <= now)
+
+
+def failure_updates(feed: FeedData, error: str, now: datetime.datetime, status: int | None = None,
+                    retry_after: datetime.timedelta | None = None, limit: int = disable_after) -> dict[str, Any]:
+    """
+    The changes to make to feed after a failed update. A Retry-After the server sent is honored up to backoff_max,
+    otherwise the delay grows with every failure in a row. After limit failures that weren't throttling the feed is
+    disabled until it is reset.
+    """
+    failures = feed.failures + 1
+    if retry_after is not None:
+        delay = min(retry_after, backoff_max)
+    else:
+        delay = backoff_delay(failures)
+    throttled = status in THROTTLE_STATUSES
+    return {
+        "failures": failures,
+        "retry_at": now + delay,
+        "disabled": feed.disabled or (not throttled and failures >= limit),
+        "last_error": error,
+    }
+
+
+def success_updates(feed: FeedData) -> dict[str, Any]:
+    """The changes to make to feed after a successful update, if any."""
+    if feed.failures or feed.retry_at is not None or feed.last_error is not None:
+        return {"failures": 0, "retry_at": None, "last_error": None}
+    return {}
+
+
+def reset_updates() -> dict[str, Any]:
+    return {"failures": 0, "retry_at": None, "disabled": False, "last_error": None}
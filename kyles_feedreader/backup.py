@@ -0,0 +1,109 @@
+# By Kyle Monson
+
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import sqlite3
+import time
+from typing import Callable
+
+from .defaults import backup_pages
+
+
+# Seconds to wait after each step so writers get a turn, sqlite3's own sleep only applies when a step finds the
+# database busy or locked. It is used for that retry as well.
+BACKUP_SLEEP = 0.01
+COPY_CHUNK_SIZE = 1 << 20
+
+
+def _snapshot(connection: sqlite3.Connection) -> None:
+    # Credentials have no place in a dataset that gets passed around for benchmarks.
+    connection.execute('UPDATE "Feed" SET "user_name" = NULL, "password" = NULL')
+    connection.commit()
+    # Compact and gather statistics so every replay starts from the same file layout and query plans.
+    connection.execute("VACUUM")
+    connection.execute("ANALYZE")
+    connection.commit()
+
+
+def _manifest(connection: sqlite3.Connection, source: pathlib.Path) -> dict:
+    tables = [r[0] for r in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    row = connection.execute('SELECT max("version") FROM "SchemaMigration"').fetchone()
+    return {
+        "source": str(source),
+        "created": datetime.datetime.utcnow().isoformat(" "),
+        "schema_version": row[0],
+        "tables": {t: connection.execute(f'SELECT count(*) FROM "{t}"').fetchone()[0] for t in tables},
+    }
+
+
+def _sha256(path: pathlib.Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(COPY_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def backup(source: str | pathlib.Path, target: str | pathlib.Path, compress: bool = False, snapshot: bool = False,
+           pages: int = backup_pages, sleep: float = BACKUP_SLEEP,
+           progress: Callable[[int, int, int], None] | None = None) -> pathlib.Path:
+    """
+    Copy the database at source to target with SQLite's online backup API, a few pages at a time, so the reader
+    and updates keep running. The copy is written next to target and moved into place once complete.
+
+    compress gzips the copy and adds a .gz suffix to target if it is missing. snapshot strips credentials, vacuums
+    and analyzes the copy and writes a <target>.json manifest with row counts, schema version and checksum.
+    progress is called after every step as sqlite3.Connection.backup calls it. sleep is waited after each step but
+    the last, and before retrying a step that found the database busy. Returns the path written.
+    """
+    source = pathlib.Path(source)
+    target = pathlib.Path(target)
+    if compress and target.suffix != ".gz":
+        target = target.with_name(target.name + ".gz")
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    copy_path = target.with_name(target.name + ".part")
+    src = sqlite3.connect(f"{source.resolve().as_uri()}?mode=ro", uri=True)
+    dst = sqlite3.connect(copy_path)
+    def step(status: int, remaining: int, total: int) -> None:
+        if progress is not None:
+            progress(status, remaining, total)
+        # The source is only locked during a step, the wait gives writers the lock in between.
+        if remaining:
+            time.sleep(sleep)
+
+    try:
+        src.backup(dst, pages=pages, sleep=sleep, progress=step)
+        # The copy is a single self-contained file even if the source runs in WAL mode.
+        dst.execute("PRAGMA journal_mode=DELETE")
+        manifest = None
+        if snapshot:
+            _snapshot(dst)
+            manifest = _manifest(dst, source)
+    finally:
+        dst.close()
+        src.close()
+
+    try:
+        if compress:
+            compressed_path = target.with_name(target.name + ".part.gz")
+            with open(copy_path, "rb") as f_in, gzip.open(compressed_path, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out, COPY_CHUNK_SIZE)
+            os.replace(compressed_path, target)
+        else:
+            os.replace(copy_path, target)
+    finally:
+        copy_path.unlink(missing_ok=True)
+
+    if manifest is not None:
+        manifest["sha256"] = _sha256(target)
+        with open(target.with_name(target.name + ".json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    return target
@@ -1,12 +1,14 @@
 # By Kyle Monson
 
+import datetime
 import string
 
 import click
 import textwrap
-from lxml import etree, objectify
-from . import db_interface, defaults
-from .feed_parsing import parse_feed, ResultType
+from . import db_interface, defaults, instrumentation, migrations
+
+# Modules that only some commands need, feed_parsing above all, are imported inside those commands so the rest
+# start quickly.
 
 
 text_wrapper = textwrap.TextWrapper()
@@ -15,12 +17,43 @@ text_wrapper = textwrap.TextWrapper()
 @click.group()
 @click.option("--db-path", default=defaults.db_path, type=click.Path(dir_okay=False, resolve_path=True))
 # @click.option("--config-path", default=defaults.config_path)
-def cli(db_path, config_path=None):
-    db_interface.initialize_sql(db_path)
-    pass
+@click.option("--profile", is_flag=True,
+              help="Print how long fetching, parsing, text and date extraction and db writes took, overall and per feed.")
+@click.option("--profile-output", type=click.Path(dir_okay=False), help="Write cProfile statistics to this pstats file.")
+@click.pass_context
+def cli(ctx, db_path, profile, profile_output, config_path=None):
+    if profile or profile_output:
+        _start_profiling(ctx, profile, profile_output)
+    # The benchmarks bring their own dbs, there is no reason for them to create or migrate the user's.
+    if ctx.invoked_subcommand == "bench":
+        return
+    # Backfills are left to "db migrate" so it can report on them.
+    ctx.obj = db_interface.DBInterface(db_path, backfill=ctx.invoked_subcommand != "db")
+
+
+def _start_profiling(ctx: click.Context, breakdown: bool, output: str | None):
+    recorder = instrumentation.start() if breakdown else None
+    profiler = None
+    if output is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def finish():
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(output)
+        if recorder is not None:
+            instrumentation.stop()
+            for line in recorder.report():
+                click.echo(line, err=True)
+
+    ctx.call_on_close(finish)
+
 
+def _add_from_url(db: db_interface.DBInterface, url: str, group: db_interface.GroupData):
+    from .feed_parsing import parse_feed, ResultType
 
-def _add_from_url(url: str, group: db_interface.GroupData):
     r, f = parse_feed(url)
     if r & (ResultType.HTTP_ERROR | ResultType.AUTH_ERROR):
         click.echo(f"Error: {f['status'].phrase}, {f['status'].description}")
@@ -36,12 +69,12 @@ def _add_from_url(url: str, group: db_interface.GroupData):
 
     name = f["name"]
 
-    if db_interface.find_feed_from_url(url) is None:
-        db_f = db_interface.add_feed(name, url, f["home_page"], group_data=group)
+    if db.find_feed_from_url(url) is None:
+        db_f = db.add_feed(name, url, f["home_page"], group_data=group)
 
-        db_interface.update_feed(db_f, etag=f["etag"], last_modified=f["modified"])
+        db.update_feed(db_f, etag=f["etag"], last_modified=f["modified"])
 
-        db_interface.add_feed_items(db_f, f["entries"])
+        db.add_feed_items(db_f, f["entries"])
     else:
         click.echo(f"Skipping {name}: added previously.")
 
@@ -49,15 +82,17 @@ def _add_from_url(url: str, group: db_interface.GroupData):
 @cli.command()
 @click.option("-g", "--group")
 @click.argument("urls", nargs=-1)
-def add(urls, group=None):
+@click.pass_obj
+def add(db, urls, group=None):
     """Add feeds specified at URLS to feed db."""
-    group_data, _ = parse_path(group)
+    group_data, _ = parse_path(db, group)
     for url in urls:
-        _add_from_url(url, group_data)
+        _add_from_url(db, url, group_data)
 
 
-def parse_path(group_path: str | None, parse_all: bool = True) -> tuple[db_interface.GroupData, str | None]:
-    current = db_interface.root_group
+def parse_path(db: db_interface.DBInterface, group_path: str | None,
+               parse_all: bool = True) -> tuple[db_interface.GroupData, str | None]:
+    current = db.root_group
     parts = [] if group_path is None else group_path.strip(string.whitespace + "/").split("/")
     if not parts:
         return current, None
@@ -70,92 +105,228 @@ def parse_path(group_path: str | None, parse_all: bool = True) -> tuple[db_inter
         path = parts[:-1]
 
     for part in path:
-        current = db_interface.find_group_by_name(part, current)
+        current = db.find_group_by_name(part, current)
         if current is None:
             raise click.BadParameter(f"Group {part} does not exist")
 
     return current, name
 
 
-@cli.command()
+@cli.command(name="add-group")
 @click.argument("group_path")
-def add_group(group_path: str):
+@click.pass_obj
+def add_group(db, group_path: str):
     """Add group specified by '/' delimited PATH to feed db."""
-    parent, name = parse_path(group_path, parse_all=False)
-    group = db_interface.find_group_by_name(name, parent)
+    parent, name = parse_path(db, group_path, parse_all=False)
+    group = db.find_group_by_name(name, parent)
 
     if not group:
-        db_interface.add_find_group(name, parent)
+        db.add_find_group(name, parent)
     else:
         click.echo(f"Group {name} already exists")
 
 
-@cli.command()
+@cli.command(name="delete-group")
 @click.argument("group_path")
 @click.option('-r', '--recursive', is_flag=True, help="Delete all child groups and feeds. Otherwise all chidren are moved to the parent group.")
-def delete_group(group_path: str, recursive: bool):
+@click.pass_obj
+def delete_group(db, group_path: str, recursive: bool):
     """Delete group specified by PATH from feed db."""
-    group, _ = parse_path(group_path)
-    db_interface.delete_group(group, recursive)
+    group, _ = parse_path(db, group_path)
+    db.delete_group(group, recursive)
 
 
 @cli.command()
 @click.argument("urls", nargs=-1)
-def delete(urls):
+@click.pass_obj
+def delete(db, urls):
     """Delete feeds specified at URLS from feed db."""
     urls = set(urls)
     for url in urls:
-        feed = db_interface.find_feed_from_url(url)
+        feed = db.find_feed_from_url(url)
         if feed is None:
             click.echo(f"Cannot find {url}")
-        db_interface.delete_feed(feed)
+            continue
+        db.delete_feed(feed)
+
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+
+def _parse_duration(ctx, param, value):
+    if value is None:
+        return None
+    number, unit = (value[:-1], value[-1]) if value[-1:] in _DURATION_UNITS else (value, "s")
+    try:
+        seconds = float(number) * _DURATION_UNITS[unit]
+    except ValueError:
+        raise click.BadParameter("expected a duration like 90, 90s, 5m or 1h")
+    if seconds <= 0:
+        raise click.BadParameter("has to be more than nothing")
+    return seconds
 
 
 @cli.command()
-def update():
+@click.option("-j", "--concurrency", default=defaults.update_concurrency, show_default=True,
+              help="Number of feeds fetched at once.")
+@click.option("--per-host", default=defaults.host_concurrency, show_default=True,
+              help="Number of requests in flight to a single host.")
+@click.option("--host-interval", default=defaults.host_interval, show_default=True,
+              help="Seconds between the start of requests to the same host.")
+@click.option("--ignore-cache", is_flag=True, help="Fetch feeds even if the server said they are still fresh.")
+@click.option("-p", "--processes", default=1, show_default=True,
+              help="Worker processes to fetch and parse in, each with its own share of the hosts. 0 for one per core.")
+@click.option("--feed-buffer", "memory", default=defaults.update_memory // 2 ** 20, show_default=True,
+              help="MB of fetched feeds held at once, waiting to be parsed or written, shared by the processes. An "
+                   "estimate from the size of the responses, not a cap on the memory the update uses.")
+@click.option("--lean/--full-parse", default=defaults.lean_parse, show_default=True,
+              help="Skip feedparser's HTML sanitizing and relative links, which the text doesn't need. Item text can "
+                   "then differ from a full parse in whitespace.")
+@click.option("--deadline", callback=_parse_duration,
+              help="Stop after this long, like 90s, 5m or 1h, fetching the feeds most worth it first.")
+@click.pass_obj
+def update(db, concurrency, per_host, host_interval, ignore_cache, processes, memory, lean, deadline):
     """Update all feeds in feed db.."""
-    feeds = db_interface.get_feeds()
-    for feed in feeds:
-        url = feed.url
-        name = feed.name
+    from . import fetching, updater
 
-        click.echo(f"Getting {name}")
+    memory *= 2 ** 20
+    if processes == 1:
+        fetching.configure(per_host, host_interval)
+        report = updater.update_feeds(db, concurrency=concurrency, ignore_cache=ignore_cache, log=click.echo,
+                                      memory=memory, lean=lean, deadline=deadline)
+    else:
+        report = _update_sharded(db, processes or None, concurrency, per_host, host_interval, ignore_cache, memory,
+                                 lean, deadline)
+    click.echo(f"Fetched {report.fetched} feeds, skipped {report.fresh} still fresh in the cache "
+               f"and {report.suspended} suspended")
+    if report.suspended:
+        click.echo("See kfr-cli suspended list for the suspended feeds")
+    if report.unfinished:
+        click.echo(f"Out of time with {len(report.unfinished)} feeds not updated:")
+        for feed in report.unfinished:
+            click.echo(f"  {feed.name} ({feed.url})")
+
+
+def _update_sharded(db, processes, concurrency, per_host, host_interval, ignore_cache, memory, lean, deadline):
+    import time
+    from . import sharding
+
+    shown = 0.0
+
+    def progress(statuses: list[sharding.ShardStatus]):
+        nonlocal shown
+        now = time.monotonic()
+        if now - shown < 1.0 and not all(s.done for s in statuses):
+            return
+        shown = now
+        written = sum(s.written for s in statuses)
+        total = sum(s.feeds for s in statuses)
+        # Workers only wait on the queue when writing is what holds the update back.
+        blocked = max(s.blocked for s in statuses)
+        click.echo(f"Written {written} of {total} feeds, {sum(not s.done for s in statuses)} of {len(statuses)} "
+                   f"workers running, longest wait on the writer {blocked:.1f}s")
+
+    return sharding.update_feeds_sharded(db, workers=processes, concurrency=concurrency, per_host=per_host,
+                                         interval=host_interval, ignore_cache=ignore_cache, memory=memory,
+                                         lean=lean, progress=progress, deadline=deadline)
 
-        r, f = parse_feed(url, etag=feed.etag, modified=feed.last_modified)
 
-        if r & (ResultType.HTTP_ERROR | ResultType.AUTH_ERROR):
-            click.echo(f"Error getting {url}: {f['status'].phrase}, {f['status'].description}")
+@cli.command()
+@click.argument("level", type=int)
+@click.argument("urls", nargs=-1)
+@click.pass_obj
+def priority(db, level, urls):
+    """
+    Set the priority of the feeds at URLS to LEVEL, 0 by default. An update --deadline fetches feeds with higher ones
+    first, each level up counting as much as twice the staleness or new items.
+    """
+    for url in urls:
+        feed = db.find_feed_from_url(url)
+        if feed is None:
+            click.echo(f"Feed with URL '{url}' does not exist")
             continue
+        db.update_feed(feed, priority=level)
 
-        if ResultType.ERROR in r:
-            click.echo(f"Error getting {url}: {f['error']}")
-            continue
 
-        if ResultType.PERMANENT_REDIRECT in r:
-            new_url = f["new_url"]
-            click.echo(f"Updating {name} to new URL: {new_url}")
-            try:
-                db_interface.update_feed(feed, url=new_url)
-            except ValueError as e:
-                click.echo(f"Updating {name} URL failed: {str(e)}")
+@cli.group()
+def suspended():
+    """Feeds that are backing off or disabled after failed updates."""
+    pass
+
+
+@suspended.command(name="list")
+@click.pass_obj
+def list_suspended(db):
+    """List feeds that are backing off or disabled."""
+    now = datetime.datetime.utcnow()
+    feeds = db.get_suspended_feeds(now)
+    if not feeds:
+        click.echo("No feeds are suspended.")
+    for feed in feeds:
+        state = "disabled" if feed.disabled else f"retrying after {feed.retry_at:%Y-%m-%d %H:%M} UTC"
+        click.echo(f"{feed.name} ({feed.url}): {state}, {feed.failures} failures, last error: {feed.last_error}")
+
+
+@suspended.command()
+@click.argument("urls", nargs=-1)
+@click.option("-a", "--all", "reset_all", is_flag=True, help="Reset every suspended feed.")
+@click.pass_obj
+def reset(db, urls, reset_all):
+    """Clear the failures of feeds so the next update fetches them."""
+    from . import backoff
+
+    if reset_all:
+        feeds = db.get_suspended_feeds(datetime.datetime.utcnow())
+    else:
+        feeds = []
+        for url in urls:
+            feed = db.find_feed_from_url(url)
+            if feed is None:
+                click.echo(f"Feed with URL '{url}' does not exist")
                 continue
+            feeds.append(feed)
 
-        if ResultType.NOT_MODIFIED in r:
-            db_interface.update_feed_last_update(feed)
-            continue
+    for feed in feeds:
+        db.update_feed(feed, **backoff.reset_updates())
+        click.echo(f"Reset {feed.name}")
 
-        db_interface.update_feed(feed, etag=f["etag"], last_modified=f["modified"])
-        new_items = db_interface.add_feed_items(feed, f["entries"])
-        if new_items:
-            click.echo(f"Added {len(new_items)} items to {name}")
 
+def _format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
 
 
+@cli.command()
+@click.option("-s", "--sort", "sort_by", type=click.Choice(["time", "bytes", "errors", "wasted"]), default="time",
+              show_default=True, help="Rank feeds by total fetch time, bytes downloaded, error rate or wasted fetches.")
+@click.option("-n", "--limit", default=20, show_default=True, help="Number of feeds to show, 0 for all.")
+@click.option("--prometheus", type=click.Path(dir_okay=False),
+              help="Also write the stats of every feed to this file in the Prometheus text format.")
+@click.pass_obj
+def stats(db, sort_by, limit, prometheus):
+    """Show which feeds cost the most to update."""
+    from . import fetch_stats
+
+    feed_stats = fetch_stats.rank(db.get_fetch_stats(), sort_by)
+    if prometheus is not None:
+        fetch_stats.write_prometheus(feed_stats, prometheus)
+    if not feed_stats:
+        click.echo("No updates recorded yet.")
+        return
+
+    click.echo(f"{'fetches':>7} {'time':>9} {'mean':>7} {'bytes':>8} {'errors':>6} {'wasted':>6}  feed")
+    for s in feed_stats[:limit or None]:
+        click.echo(f"{s.fetches:>7} {s.latency:>8.2f}s {s.mean_latency:>6.2f}s {_format_size(s.size):>8} "
+                   f"{s.error_rate:>6.0%} {s.wasted:>6}  {s.name} ({s.url})")
 
 
 @cli.command()
 @click.option("-v", "--verbose", count=True)
-def view(verbose):
+@click.pass_obj
+def view(db, verbose):
     """Print information about groups and feeds."""
     def print_feed(feed: db_interface.FeedData, indent: int):
         lead = ' ' * indent
@@ -166,7 +337,7 @@ def view(verbose):
             if verbose > 1:
                 if feed.description:
                     yield f"{lead} Description: {feed.description}\n"
-                for item in db_interface.get_feed_items(feed):
+                for item in db.get_feed_items(feed):
                     yield from print_feed_item(item, indent+1)
 
     def print_feed_item(item: db_interface.FeedItemData, indent: int):
@@ -185,40 +356,395 @@ def view(verbose):
 
     def print_group(group_data: db_interface.GroupData, indent=0):
         yield f"{' '*indent}{group_data.name if group_data.name is not None else ''}\n"
-        children = db_interface.get_groups(group_data)
+        children = db.get_groups(group_data)
         for child in children:
             yield from print_group(child, indent+1)
-        for feed_data in db_interface.get_feeds(group_data):
+        for feed_data in db.get_feeds(group_data):
             yield from print_feed(feed_data, indent+1)
 
-    click.echo_via_pager(print_group(db_interface.root_group))
+    click.echo_via_pager(print_group(db.root_group))
 
 
 @cli.command(name="import")
 @click.argument("files", nargs=-1, type=click.Path(dir_okay=False, resolve_path=True, exists=True))
-def import_(files):
+@click.option("-j", "--concurrency", default=defaults.import_concurrency, show_default=True,
+              help="Number of feeds fetched at once.")
+@click.option("--per-host", default=defaults.host_concurrency, show_default=True,
+              help="Number of requests in flight to a single host.")
+@click.option("--host-interval", default=defaults.host_interval, show_default=True,
+              help="Seconds between the start of requests to the same host.")
+@click.pass_obj
+def import_(db, files, concurrency, per_host, host_interval):
     """Import OPML file."""
-    def add_element(element, path, group: db_interface.GroupData):
-        children = element.iterfind("outline")
-        for c in children:
-            child_name = c.attrib.get("text")
-            if c.attrib.get("type") == "rss":
-                url = c.attrib.get("xmlUrl")
-                click.echo(f"Adding feed {'/'.join(path)}/{child_name} at {url}")
-                _add_from_url(url, group)
-            else:
-                new_path = path + (child_name,)
-                click.echo(f"Creating group {'/'.join(new_path)}")
-                new_group = db_interface.add_find_group(child_name, group)
-                add_element(c, new_path, new_group)
+    from . import fetching, opml
+
+    fetching.configure(per_host, host_interval)
+
+    def progress(done: int, total: int, outline: opml.OutlineFeed, error: str | None):
+        name = "/".join(outline.path + (outline.name or outline.url,))
+        if error is None:
+            click.echo(f"[{done}/{total}] Adding feed {name}")
+        else:
+            click.echo(f"[{done}/{total}] Error adding {name} at {outline.url}: {error}")
 
     for file_path in files:
-        tree = etree.parse(file_path)
-        root = tree.getroot()
-        root_elements = root.iterfind("./body")
-        for root_element in root_elements:
-            click.echo(f"Processing root element")
-            add_element(root_element, (), db_interface.root_group)
+        click.echo(f"Importing {file_path}")
+        report = opml.import_opml(db, file_path, concurrency=concurrency, progress=progress)
+        click.echo(f"Created {report.groups} groups, added {len(report.added)} feeds, "
+                   f"skipped {len(report.existing)} added previously, {len(report.failed)} failed")
+        for url, error in report.failed:
+            click.echo(f"Failed {url}: {error}")
+
+
+@cli.command()
+@click.argument("output", default="-", type=click.Path(dir_okay=False, allow_dash=True))
+@click.option("-g", "--group", help="Only export the '/' delimited group path.")
+@click.pass_obj
+def export(db, output, group=None):
+    """Export groups and feeds to OPML file OUTPUT, stdout by default."""
+    from . import opml
+
+    group_data, _ = parse_path(db, group)
+    with click.open_file(output, "wb") as f:
+        count = opml.export_opml(db, f, group_data)
+    if output != "-":
+        click.echo(f"Exported {count} feeds")
+
+
+def _parse_since(ctx, param, value):
+    if value is None or value.isdigit():
+        return value
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise click.BadParameter("expected an ISO timestamp or an item ID")
+
+
+@cli.command(name="export-items")
+@click.argument("output", default="-", type=click.Path(dir_okay=False, allow_dash=True))
+@click.option("-f", "--format", "format_", type=click.Choice(["csv", "ndjson"]), default="ndjson",
+              show_default=True)
+@click.option("--feed", "feed_url", help="Only export items of the feed at this URL.")
+@click.option("-g", "--group", help="Only export items of feeds in the '/' delimited group path and its subgroups.")
+@click.option("--read/--unread", default=None, help="Only export read or unread items.")
+@click.option("--since", callback=_parse_since,
+              help="Only export items timestamped at or after an ISO timestamp, or added after an item ID.")
+@click.pass_obj
+def export_items(db, output, format_, feed_url, group, read, since):
+    """Stream feed items to OUTPUT, stdout by default, as NDJSON or CSV.
+
+    The ID of the last item written is printed to stderr so the next run can pick up from it with --since.
+    """
+    from . import item_export
+
+    feed = None
+    if feed_url is not None:
+        feed = db.find_feed_from_url(feed_url)
+        if feed is None:
+            raise click.BadParameter(f"Cannot find {feed_url}", param_hint="--feed")
+    group_data = None if group is None else parse_path(db, group)[0]
+
+    filters = {"feed": feed, "group": group_data, "read": read}
+    if isinstance(since, datetime.datetime):
+        filters["since"] = since
+    elif since is not None:
+        filters["after_id"] = int(since)
+
+    with click.open_file(output, "w", encoding="utf-8") as f:
+        last_id = item_export.EXPORTERS[format_](db, f, **filters)
+    if last_id is not None:
+        click.echo(f"Last item ID: {last_id}", err=True)
+
+
+@cli.group(name="enclosures")
+def enclosures_group():
+    """Download the enclosures of feed items, such as podcast episodes."""
+    pass
+
+
+@enclosures_group.command(name="fetch")
+@click.option("--feed", "feed_url", help="Only download enclosures of the feed at this URL.")
+@click.option("-a", "--all", "include_read", is_flag=True, help="Download enclosures of read items as well.")
+@click.option("-n", "--limit", type=int, help="Download at most this many enclosures, oldest first.")
+@click.option("-d", "--directory", default=defaults.enclosure_dir, show_default=True,
+              type=click.Path(file_okay=False, resolve_path=True))
+@click.option("-j", "--concurrency", default=defaults.enclosure_concurrency, show_default=True,
+              help="Number of enclosures downloaded at once.")
+@click.option("--per-host", default=defaults.host_concurrency, show_default=True,
+              help="Number of downloads in flight from a single host.")
+@click.option("--quota", default=defaults.enclosure_quota, show_default=True,
+              help="Bytes of enclosures to keep. Past it the enclosures of read items are removed, oldest first.")
+@click.pass_obj
+def fetch_enclosures(db, feed_url, include_read, limit, directory, concurrency, per_host, quota):
+    """Download pending enclosures, resuming interrupted downloads, then clean up."""
+    from . import enclosures, fetching
+
+    feed = None
+    if feed_url is not None:
+        feed = db.find_feed_from_url(feed_url)
+        if feed is None:
+            raise click.ClickException(f"Feed with URL '{feed_url}' does not exist")
+
+    def progress(result: enclosures.Download):
+        if result.error is not None:
+            click.echo(f"Error downloading {result.item.enclosure_url}: {result.error}")
+        elif result.resumed_from:
+            click.echo(f"Resumed {result.item.title} at {_format_size(result.resumed_from)}, "
+                       f"{_format_size(result.size)} in all")
+        else:
+            click.echo(f"Downloaded {result.item.title}, {_format_size(result.size)}")
+
+    fetching.configure(per_host, defaults.host_interval)
+    items = db.get_pending_enclosures(feed, unread_only=not include_read, limit=limit)
+    report = enclosures.fetch_enclosures(db, items, directory, concurrency, progress)
+    click.echo(f"Downloaded {len(report.downloaded)} enclosures, {_format_size(report.size)}, "
+               f"{len(report.failed)} failed")
+
+    cleaned = enclosures.cleanup(db, directory, quota)
+    if cleaned.removed or cleaned.evicted:
+        click.echo(f"Removed {cleaned.removed} stale files and {len(cleaned.evicted)} enclosures of read items, "
+                   f"freeing {_format_size(cleaned.freed)}")
+    if cleaned.size > quota:
+        click.echo(f"Enclosures of unread items take {_format_size(cleaned.size)}, "
+                   f"over the quota of {_format_size(quota)}")
+
+
+@enclosures_group.command(name="status")
+@click.option("-d", "--directory", default=defaults.enclosure_dir, show_default=True,
+              type=click.Path(file_okay=False, resolve_path=True))
+@click.pass_obj
+def enclosure_status(db, directory):
+    """Show how many enclosures are downloaded and how much space they take."""
+    from . import enclosures
+
+    s = enclosures.status(db, directory)
+    click.echo(f"{s.downloaded} of {s.items} enclosures downloaded, {_format_size(s.size)} in {directory}")
+    if s.partial:
+        click.echo(f"{s.partial} partial downloads, {_format_size(s.partial_size)}")
+    if s.missing:
+        click.echo(f"{s.missing} downloaded enclosures are missing from disk")
+
+
+@cli.group()
+def bench():
+    """Offline benchmarks. They use a database of their own and leave the feed db alone."""
+    pass
+
+
+@bench.command(name="update")
+@click.option("-n", "--feeds", default=100, show_default=True, help="Number of feeds served.")
+@click.option("--items", default=20, show_default=True, help="Items per feed.")
+@click.option("--item-size", default=500, show_default=True, help="Characters of text per item.")
+@click.option("--latency", default=0.0, show_default=True, help="Seconds the server waits before each response.")
+@click.option("--jitter", default=0.0, show_default=True, help="Up to this many more seconds of latency, at random.")
+@click.option("--etag-rate", default=1.0, show_default=True, help="Share of feeds that send ETags and 304s.")
+@click.option("--redirect-rate", default=0.0, show_default=True, help="Share of feeds that moved permanently.")
+@click.option("--auth-rate", default=0.0, show_default=True, help="Share of feeds that answer 401.")
+@click.option("--error-rate", default=0.0, show_default=True, help="Share of requests that fail with a 500.")
+@click.option("--html-rate", default=0.0, show_default=True, help="Share of items whose text is HTML.")
+@click.option("--passes", default=2, show_default=True, help="Number of updates to time.")
+@click.option("--churn", is_flag=True, help="Add an item to every feed before each pass after the first.")
+@click.option("--recorded", type=click.Path(file_okay=False, exists=True),
+              help="Serve the feed files in this directory instead of synthetic feeds.")
+@click.option("-j", "--concurrency", default=defaults.update_concurrency, show_default=True,
+              help="Number of feeds fetched at once, by each process.")
+@click.option("-p", "--processes", default=1, show_default=True,
+              help="Worker processes to fetch and parse in, as update -p does. 0 for one per core.")
+@click.option("--hosts", default=1, show_default=True,
+              help="Loopback addresses to spread the synthetic feeds over, each standing in for a host.")
+@click.option("--feed-buffer", "memory", default=defaults.update_memory // 2 ** 20, show_default=True,
+              help="MB of fetched feeds the update holds at once, as update --feed-buffer.")
+@click.option("--lean/--full-parse", default=defaults.lean_parse, show_default=True,
+              help="Parse as update --lean does.")
+@click.option("--seed", default=0, show_default=True)
+def bench_update(feeds, items, item_size, latency, jitter, etag_rate, redirect_rate, auth_rate, error_rate,
+                 html_rate, passes, churn, recorded, concurrency, processes, hosts, memory, lean, seed):
+    """Time end to end updates against a local stand-in for the feed servers."""
+    from . import load_test
+    from .feed_server import FeedProfile
+
+    profile = FeedProfile(items=items, item_size=item_size, latency=latency, latency_jitter=jitter,
+                          etag_rate=etag_rate, redirect_rate=redirect_rate, auth_rate=auth_rate, error_rate=error_rate,
+                          html_rate=html_rate, seed=seed)
+
+    def progress(result: load_test.PassResult):
+        r = result.report
+        click.echo(f"pass {result.number}: {r.fetched} feeds in {result.seconds:.2f}s, "
+                   f"{result.feeds_per_second:.1f} feeds/s, {r.new_items} items, {result.items_per_second:.1f} items/s, "
+                   f"{r.not_modified} not modified, {r.failed} failed, {r.suspended} suspended")
+        if r.peak_memory:
+            click.echo(f"  at most {r.peak_memory / 2 ** 20:.1f}MB estimated for fetched feeds at once")
+
+    load_test.run_update_benchmark(feeds, profile, passes, concurrency, churn, recorded, progress=progress,
+                                   processes=processes, hosts=hosts, memory=memory * 2 ** 20, lean=lean)
+
+
+@bench.command(name="parse")
+@click.option("-n", "--feeds", default=100, show_default=True, help="Number of feeds parsed.")
+@click.option("--items", default=20, show_default=True, help="Items per feed.")
+@click.option("--item-size", default=500, show_default=True, help="Characters of text per item.")
+@click.option("--html-rate", default=0.5, show_default=True, help="Share of items whose text is HTML.")
+@click.option("--recorded", type=click.Path(file_okay=False, exists=True),
+              help="Parse the feed files in this directory instead of synthetic feeds.")
+@click.option("-r", "--repeat", default=3, show_default=True, help="Runs of each mode, the best one counts.")
+@click.option("--seed", default=0, show_default=True)
+def bench_parse(feeds, items, item_size, html_rate, recorded, repeat, seed):
+    """Time parsing feeds the full way and the lean way update --lean uses, without fetching them."""
+    from . import load_test
+    from .feed_server import FeedProfile
+
+    profile = FeedProfile(items=items, item_size=item_size, html_rate=html_rate, seed=seed)
+    full, lean = load_test.run_parse_benchmark(feeds, profile, recorded, repeat)
+    for name, result in (("full", full), ("lean", lean)):
+        click.echo(f"{name}: {result.feeds} feeds in {result.seconds:.2f}s, {result.feeds_per_second:.1f} feeds/s")
+    if lean.seconds:
+        click.echo(f"lean is {full.seconds / lean.seconds:.2f}x as fast")
+
+
+_SCALES = ("small", "medium", "large")
+
+
+@bench.command(name="db")
+@click.option("-s", "--scale", type=click.Choice(_SCALES), default="small", show_default=True,
+              help="Size of the synthetic dataset, generated and cached on first use.")
+@click.option("-r", "--repeat", default=3, show_default=True, help="Runs of each case, the best one counts.")
+@click.option("-k", "--case", "select", help="Only run cases whose name matches this glob.")
+@click.option("--directory", default=defaults.bench_dir, show_default=True, type=click.Path(file_okay=False),
+              help="Where datasets and baselines are kept.")
+@click.option("--save", is_flag=True, help="Store the results as the new baselines for this scale.")
+@click.option("--tolerance", default=0.25, show_default=True,
+              help="Slowdown over the baseline, as a fraction, that counts as a regression.")
+@click.pass_context
+def bench_db(ctx, scale, repeat, select, directory, save, tolerance):
+    """
+    Time the feed db interface against a synthetic dataset and compare with the stored baselines.
+    Exits with status 1 if any case regressed.
+    """
+    import pathlib
+    from . import dataset, db_bench
+
+    spec = dataset.SCALES[scale]
+    if not dataset.dataset_path(directory, scale, spec).exists():
+        click.echo(f"Generating the {scale} dataset, {spec.feeds} feeds and {spec.items} items")
+    dbi = dataset.open_dataset(directory, scale)
+    baseline_path = pathlib.Path(directory) / "baselines.json"
+    baselines = db_bench.load_baselines(baseline_path, scale)
+
+    def progress(timing: db_bench.Timing):
+        c, = db_bench.compare([timing], baselines, tolerance)
+        change = "" if c.change is None else f"{c.change:+7.1%}"
+        flag = "!" if c.regressed else " "
+        click.echo(f"{flag} {timing.case:<32}{timing.best * 1000:>10.1f} ms{timing.median * 1000:>10.1f} ms {change}")
+
+    click.echo(f"  {'case':<32}{'best':>13}{'median':>13}")
+    try:
+        timings = db_bench.run(dbi, repeat, select, progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    regressed = [c for c in db_bench.compare(timings, baselines, tolerance) if c.regressed]
+    if save:
+        db_bench.save_baselines(baseline_path, scale, timings)
+        click.echo(f"Saved baselines to {baseline_path}")
+    if regressed:
+        click.echo(f"{len(regressed)} of {len(timings)} cases regressed")
+        ctx.exit(1)
+
+
+@bench.command(name="dataset")
+@click.argument("target", type=click.Path(dir_okay=False, resolve_path=True))
+@click.option("-s", "--scale", type=click.Choice(_SCALES), default="small", show_default=True,
+              help="Start from this scale's shape.")
+@click.option("--depth", type=int, help="Levels of groups.")
+@click.option("--fanout", type=int, help="Child groups per group.")
+@click.option("--feeds", type=int, help="Number of feeds.")
+@click.option("--items", type=int, help="Number of items, spread over the feeds by a Zipf distribution.")
+@click.option("--seed", type=int)
+def bench_dataset(target, scale, **overrides):
+    """Write a synthetic feed db to TARGET, for trying the reader or benchmarks out at scale."""
+    import dataclasses
+    import os
+    from . import dataset
+
+    if os.path.exists(target):
+        raise click.ClickException(f"{target} already exists")
+    spec = dataclasses.replace(dataset.SCALES[scale], **{k: v for k, v in overrides.items() if v is not None})
+    dbi = db_interface.DBInterface(target)
+    with click.progressbar(length=spec.items, label="Writing items") as bar:
+        summary = dataset.generate(dbi, spec, bar.update)
+    click.echo(f"{summary.groups} groups, {summary.feeds} feeds and {summary.items} items, "
+               f"{summary.read} read and {summary.viewed} viewed")
+
+
+@cli.group(name="db")
+def db_group():
+    """Database maintenance commands."""
+    pass
+
+
+@db_group.command()
+@click.option("-a", "--all", "show_all", is_flag=True, help="Show plans for queries that were not flagged as well.")
+@click.pass_obj
+def audit(db, show_all):
+    """Flag full table scans and temporary B-trees in the query plans of feed db queries."""
+    from . import query_audit
+
+    try:
+        plans = query_audit.audit(db)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    flagged = 0
+    for plan in plans:
+        if not plan.flagged and not show_all:
+            continue
+        flagged += plan.flagged
+        click.echo(f"{'!' if plan.flagged else ' '} {plan.method}")
+        click.echo(f"    {' '.join(plan.sql.split())}")
+        for step in plan.steps:
+            click.echo(f"      {step}")
+    click.echo(f"{flagged} of {len(plans)} queries flagged")
+
+
+@db_group.command()
+@click.option("--status", is_flag=True, help="Only show which migrations and backfills have been applied.")
+@click.option("--batch-size", default=migrations.BACKFILL_BATCH_SIZE, show_default=True,
+              help="Rows per backfill transaction.")
+@click.pass_obj
+def migrate(db, status, batch_size):
+    """Finish pending schema migration backfills."""
+    if not status:
+        def progress(migration: migrations.Migration, position: int | None):
+            if position is None:
+                click.echo(f"Backfill for {migration.version} {migration.name} complete")
+            else:
+                click.echo(f"Backfill for {migration.version} {migration.name} at row {position}")
+
+        migrations.run_backfills(db.db, batch_size=batch_size, progress=progress)
+
+    for s in migrations.migration_status(db.db):
+        if not s.applied:
+            state = "pending"
+        elif s.backfill_position is not None:
+            state = f"applied {s.applied_at:%Y-%m-%d %H:%M:%S}, backfill pending after row {s.backfill_position}"
+        else:
+            state = f"applied {s.applied_at:%Y-%m-%d %H:%M:%S}"
+        click.echo(f"{s.version:>4} {s.name}: {state}")
+
+
+@db_group.command(name="backup")
+@click.argument("target", type=click.Path(dir_okay=False, resolve_path=True))
+@click.option("-z", "--compress", is_flag=True, help="Gzip the backup.")
+@click.option("--snapshot", is_flag=True,
+              help="Strip credentials, vacuum and write a manifest so the copy can seed replay benchmarks.")
+@click.option("--pages", default=defaults.backup_pages, show_default=True, help="Pages copied per backup step.")
+@click.pass_context
+def backup_(ctx, target, compress, snapshot, pages):
+    """Copy the feed db to TARGET without stopping readers or updates."""
+    from . import backup
+
+    db_path = ctx.find_root().params["db_path"]
+    path = backup.backup(db_path, target, compress=compress, snapshot=snapshot, pages=pages)
+    click.echo(f"Backed up {db_path} to {path}")
 
 
 if __name__ == "__main__":
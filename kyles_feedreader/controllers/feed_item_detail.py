@@ -1,5 +1,90 @@
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional, Tuple
 
+import gevent
 
-class FeedItemDetailController:
-    pass
+from kyles_feedreader.db_interface import DBInterface, FeedItemHandle, ItemSummary
+from kyles_feedreader.view.feed_item_detail import FeedItemDetailView, RENDER_CACHE_SIZE, RenderCache, wrap_text
+from . import BaseController, Scenes
 
+
+PREFETCH_ITEMS = 5  # Items either side of the selected one whose text is loaded ahead of time.
+TEXT_CACHE_SIZE = 512  # Item texts kept, a good deal more than are prefetched so scrolling back is free too.
+LOADING = ["Loading..."]
+
+
+class FeedItemDetailController(BaseController):
+    """
+    Shows the text of the item selected in the item list. The texts of the items around it are loaded in the
+    background as the selection moves and wrapped to the pane's width ahead of time, so moving to one of them is
+    only a cache lookup. on_change is called when the text of the shown item comes in, to have it drawn.
+    """
+    def __init__(self, db: DBInterface, prefetch: int = PREFETCH_ITEMS, cache_size: int = RENDER_CACHE_SIZE,
+                 on_change: Optional[Callable[[], None]] = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db = db
+        self.prefetch = prefetch
+        self.on_change = on_change
+        self.item: Optional[ItemSummary] = None
+        self.view: Optional[FeedItemDetailView] = None
+        self.rendered = RenderCache(cache_size)  # Wrapped lines by (item id, width).
+        self.texts: OrderedDict[FeedItemHandle, str | None] = OrderedDict()
+        self._pending: set[FeedItemHandle] = set()
+
+    def _remember(self, item: FeedItemHandle, text: str | None):
+        self.texts[item] = text
+        self.texts.move_to_end(item)
+        if len(self.texts) > TEXT_CACHE_SIZE:
+            self.texts.popitem(last=False)
+
+    def lines(self, item: FeedItemHandle, width: int) -> list[str]:
+        """item's text wrapped to width, or a placeholder while it is still being loaded."""
+        if (item, width) not in self.rendered and item not in self.texts:
+            return LOADING
+        return self.rendered.get((item, width), lambda: wrap_text(self.texts[item], width))
+
+    def show(self, item: Optional[ItemSummary], nearby: Iterable[ItemSummary] = ()):
+        """Show item, loading its text and that of the items nearby if they aren't already."""
+        self.item = item
+        self._show()
+        wanted = [i.id for i in ([] if item is None else [item]) + list(nearby)]
+        for i in wanted:
+            if i in self.texts:
+                self.texts.move_to_end(i)
+        missing = [i for i in wanted if i not in self.texts and i not in self._pending]
+        if missing:
+            self._pending.update(missing)
+            gevent.spawn(self._load, missing)
+
+    def _show(self):
+        if self.view is None:
+            return
+        if self.item is None:
+            self.view.show(lambda width: [], title="Item")
+        else:
+            item = self.item.id
+            self.view.show(lambda width: self.lines(item, width), title=self.item.title)
+
+    def _load(self, items: list[FeedItemHandle]):
+        # The query runs on the hub's thread pool so a slow disk doesn't hold up the UI.
+        try:
+            texts = gevent.get_hub().threadpool.apply(self.db.get_item_texts, (items,))
+        finally:
+            self._pending.difference_update(items)
+        for i in items:
+            self._remember(i, texts.get(i))
+        # Wrap them for the pane now rather than when they are moved to.
+        if self.view is not None:
+            width = self.view.lines_box.text_width
+            for i in items:
+                self.lines(i, width)
+        if self.on_change is not None and self.item is not None and self.item.id in items:
+            self.on_change()
+
+    def refresh(self):
+        pass
+
+    def build_view(self, screen) -> Tuple[str, FeedItemDetailView]:
+        self.view = FeedItemDetailView(screen)
+        self._show()
+        return Scenes.FEED_BROWSER.value, self.view
@@ -1,7 +1,101 @@
+from typing import Callable, Optional, Tuple
+
+from kyles_feedreader.db_interface import DBInterface, GroupData, ItemSummary, ITEM_LIST_END
+from kyles_feedreader.state_journal import StateJournal
+from kyles_feedreader.view.feed_browser import FeedItemView
+from kyles_feedreader.view.item_list import LIST_END
+from . import BaseController, Scenes
 
 
 class FeedItemControler:
     pass
 
-class FeedItemsListController:
-    pass
\ No newline at end of file
+
+class FeedItemsListController(BaseController):
+    def __init__(self, db: DBInterface, on_change: Optional[Callable[[], None]] = None,
+                 journal: Optional[StateJournal] = None, on_move: Optional[Callable[[], None]] = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db = db
+        self.on_change = on_change
+        self.on_move = on_move
+        self.journal = journal
+        self.source = ("all",)
+        self.unread_only = True
+        self.view: Optional[FeedItemView] = None
+        self.count_title: Optional[str] = None  # The last title counted, reused when the view is rebuilt.
+
+    def _filters(self) -> dict:
+        kind = self.source[0]
+        if kind == "starred":
+            return {"starred_only": True, "unread_only": False}
+        if kind == "group":
+            return {"group": GroupData(self.source[1]), "unread_only": self.unread_only}
+        if kind == "feed":
+            return {"feed": self.db.get_feed(self.source[1]), "unread_only": self.unread_only}
+        return {"unread_only": self.unread_only}
+
+    def fetch(self, after, before, limit) -> list[ItemSummary]:
+        if before is LIST_END:
+            before = ITEM_LIST_END
+        items = self.db.get_item_page(after=after, before=before, limit=limit, **self._filters())
+        if self.journal is not None:
+            items = [self.journal.apply(item) for item in items]
+        return items
+
+    @property
+    def selected(self) -> Optional[ItemSummary]:
+        return None if self.view is None else self.view.list_box.value
+
+    def nearby(self, count: int) -> list[ItemSummary]:
+        """Up to count of the loaded items either side of the selected one, nearest first."""
+        if self.view is None:
+            return []
+        window = self.view.list_box.window
+        after = window.rows[window.line + 1:window.line + 1 + count]
+        before = window.rows[max(window.line - count, 0):window.line][::-1]
+        return [item for pair in zip(after, before) for item in pair] + after[len(before):] + before[len(after):]
+
+    def mark_selected(self, **flags: bool) -> Optional[Tuple[ItemSummary, ItemSummary]]:
+        """Set flags of the selected item through the journal, returning it from before and after."""
+        item = self.selected
+        if item is None or self.journal is None:
+            return None
+        window = self.view.list_box.window
+        window.rows[window.line] = self.journal.mark(item, **flags)
+        return item, window.rows[window.line]
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def _moved(self):
+        if self.on_move is not None:
+            self.on_move()
+
+    def title(self) -> str:
+        self.count_title = f"Items ({self.db.count_items(**self._filters())})"
+        return self.count_title
+
+    def show(self, source: tuple):
+        """Switch the list to the items of source, a value of the feed list."""
+        self.source = source
+        if self.view is not None:
+            self.view.list_box.value = None
+            self.view.title = self.title()
+
+    def refresh(self):
+        if self.view is not None:
+            self.view.refresh(self.title())
+
+    def items_added(self, shown: bool):
+        """New items came in, shown says whether any are in the current source, otherwise nothing on screen changed."""
+        if shown:
+            self.refresh()
+
+    def build_view(self, screen) -> Tuple[str, FeedItemView]:
+        # A rebuild keeps the loaded rows and selection, the new view only lays them out again.
+        window = self.view.list_box.window if self.view is not None else None
+        title = self.count_title if self.count_title is not None else self.title()
+        self.view = FeedItemView(screen, self.fetch, lambda item: item.cursor, title=title, on_change=self._changed,
+                                 window=window, on_move=self._moved)
+        return Scenes.FEED_BROWSER.value, self.view
@@ -1,26 +1,100 @@
 from kyles_feedreader.view.feed_browser import FeedListView
-from kyles_feedreader.db_interface import get_feeds_by_group
-from typing import Optional, Tuple
+from kyles_feedreader.db_interface import DBInterface, FeedHandle, GroupHandle
+from kyles_feedreader.state_journal import StateJournal
+from typing import Callable, Iterable, Optional, Tuple
 from . import BaseController, Scenes
 
 
 class FeedListController(BaseController):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, db: DBInterface, on_select: Optional[Callable[[tuple], None]] = None,
+                 journal: Optional[StateJournal] = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.state = get_feeds_by_group()
+        self.db = db
+        self.on_select = on_select
+        self.journal = journal
         self.view: Optional[FeedListView] = None
+        self._load()
+
+    def _load(self):
+        self.state = list(self.db.iter_tree())
+        # The groups each feed sits in, innermost first, for adding its counts up.
+        self.groups: dict[FeedHandle, list[GroupHandle]] = {}
+        path = []
+        for entry in self.state:
+            del path[entry.depth - 1:]
+            if entry.url is None:
+                path.append(entry.id)
+            else:
+                self.groups[entry.id] = path[::-1]
+        self.feed_counts = self._unread_counts()
+        self.counts = self._counts()
+
+    def _unread_counts(self, feeds: Optional[list[FeedHandle]] = None) -> dict[FeedHandle, int]:
+        # What the db has, with the marks the journal has yet to write.
+        counts = self.db.get_unread_counts(feeds)
+        if self.journal is not None:
+            for feed, delta in self.journal.unread_delta(feeds).items():
+                counts[feed] = counts.get(feed, 0) + delta
+        return counts
+
+    def _counts(self) -> dict[tuple, int]:
+        counts = {("all",): sum(self.feed_counts.values())}
+        for feed, count in self.feed_counts.items():
+            counts[("feed", feed)] = count
+            for group in self.groups.get(feed, ()):
+                counts[("group", group)] = counts.get(("group", group), 0) + count
+        return counts
 
     def refresh(self):
-        self.state = get_feeds_by_group()
+        self._load()
         if self.view is not None:
-            self.view.update_feed_list(self.state.copy())
+            self.view.update_feed_list(self.state, self.counts)
 
-    def build_view(self, screen) -> Tuple[str, FeedListView]:
-        data = self.view.data if self.view is not None else None
-        self.view = FeedListView(screen)
-        self.view.update_feed_list(self.state.copy())
-        self.view.data = data
-        return Scenes.FEED_BROWSER.value, self.view
+    def update_counts(self, feeds: Iterable[FeedHandle]):
+        """Fetch the unread counts of just feeds and relabel them and the groups they are in."""
+        feeds = list(feeds)
+        fresh = self._unread_counts(feeds)
+        for feed in feeds:
+            self.feed_counts[feed] = fresh.get(feed, 0)
+        self._relabel()
 
+    def add_unread(self, deltas: dict[FeedHandle, int]):
+        """Change the unread counts of feeds by deltas, for items marked in the TUI."""
+        for feed, delta in deltas.items():
+            self.feed_counts[feed] = self.feed_counts.get(feed, 0) + delta
+        self._relabel()
 
+    def _relabel(self):
+        counts = self._counts()
+        changed = {value: counts.get(value, 0) for value in set(counts) | set(self.counts)
+                   if counts.get(value, 0) != self.counts.get(value, 0)}
+        self.counts = counts
+        if self.view is not None and changed:
+            self.view.update_counts(changed)
 
+    def in_source(self, feed: FeedHandle, source: tuple) -> bool:
+        """Whether items of feed show up in the item list of source, a value of the feed list."""
+        kind = source[0]
+        if kind == "all":
+            return True
+        if kind == "feed":
+            return source[1] == feed
+        if kind == "group":
+            return source[1] in self.groups.get(feed, ())
+        return False
+
+    def _selected(self):
+        if self.on_select is not None and self.view.list_box.value is not None:
+            self.on_select(self.view.list_box.value)
+
+    def build_view(self, screen) -> Tuple[str, FeedListView]:
+        # A rebuild reuses the tree and counts already loaded and puts the selection and scroll back.
+        data = start_line = None
+        if self.view is not None:
+            data, start_line = self.view.data, self.view.list_box.start_line
+        self.view = FeedListView(screen, on_select=self._selected)
+        self.view.update_feed_list(self.state, self.counts)
+        if data is not None:
+            self.view.data = data
+            self.view.list_box.start_line = start_line
+        return Scenes.FEED_BROWSER.value, self.view
@@ -1,19 +1,43 @@
 from collections import defaultdict
-from typing import List
+from typing import List, Optional
 
 from asciimatics.screen import Screen
 from asciimatics.scene import Scene
 
+from kyles_feedreader.db_interface import DBInterface
+from kyles_feedreader.feed_model import FeedManager
+from kyles_feedreader.state_journal import StateJournal
+from .feed_item_detail import FeedItemDetailController
+from .feed_items import FeedItemsListController
 from .feed_list import FeedListController
 from . import BaseController
 
 
 class MainController:
-    def __init__(self):
-        self.feed_list = FeedListController()
-        self.browser_controllers: List[BaseController] = [self.feed_list]
+    def __init__(self, db: DBInterface, manager: Optional[FeedManager] = None,
+                 journal: Optional[StateJournal] = None):
+        self.db = db
+        self.manager = manager
+        self.journal = journal
+        self.detail = FeedItemDetailController(db)
+        self.feed_items = FeedItemsListController(db, on_change=self._item_changed, journal=journal,
+                                                  on_move=self._item_moved)
+        self.feed_list = FeedListController(db, on_select=self.feed_items.show, journal=journal)
+        # The item list comes last so its frame is on top and gets the keys.
+        self.browser_controllers: List[BaseController] = [self.feed_list, self.detail, self.feed_items]
         self.all_controllers: List[BaseController] = self.browser_controllers
 
+    def _item_moved(self):
+        # Moving to an item reads it. Only the user's moves do, not the first item of a list that was just loaded.
+        marked = self.feed_items.mark_selected(read=True, viewed=True)
+        if marked is not None:
+            before, after = marked
+            if before.read != after.read:
+                self.feed_list.add_unread({after.feed: int(before.read) - int(after.read)})
+
+    def _item_changed(self):
+        self.detail.show(self.feed_items.selected, self.feed_items.nearby(self.detail.prefetch))
+
     def build_ui(self, screen: Screen, current_scene: str):
         view_dict = defaultdict(list)
         for con in self.browser_controllers:
@@ -23,5 +47,14 @@ class MainController:
         screen.set_scenes(scenes, start_scene=current_scene)
 
     def refresh(self):
-        for con in self.all_controllers:
-            con.refresh()
+        if self.manager is None:
+            for con in self.all_controllers:
+                con.refresh()
+            return
+        # Only the manager reports changes, and all it reports are feeds with new items, so just their counts
+        # and the item list if it shows any of them need looking at again.
+        changes = self.manager.take_changes()
+        if changes:
+            self.feed_list.update_counts(changes)
+            source = self.feed_items.source
+            self.feed_items.items_added(any(self.feed_list.in_source(feed, source) for feed in changes))
@@ -0,0 +1,206 @@
+# By Kyle Monson
+
+import datetime
+import hashlib
+import pathlib
+import random
+from dataclasses import dataclass, astuple
+from typing import Callable, Iterable, Iterator
+
+from pony import orm
+
+from .db_interface import DBInterface
+from .defaults import update_rate
+
+
+INSERT_BATCH_SIZE = 10000
+_END = datetime.datetime(2024, 1, 1)  # The newest synthetic items are dated just before this.
+_WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do", "eiusmod",
+          "tempor", "incididunt", "ut", "labore", "et", "dolore", "magna", "aliqua")
+_TEXTS = 64  # Distinct item texts, generating one per item would dominate the run time.
+
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    """
+    The shape of a synthetic database. Groups form a tree depth levels deep with fanout children per group, and feeds
+    are spread over every group including the root. Items are shared out by a Zipf distribution with exponent
+    item_skew, so a few feeds hold most of them. Each feed's oldest items are read, the share drawn from a
+    beta(read_alpha, read_beta) distribution, which with the defaults leaves most feeds nearly caught up and a few
+    far behind.
+    """
+    depth: int = 3
+    fanout: int = 3
+    feeds: int = 100
+    items: int = 10000
+    item_skew: float = 1.0
+    read_alpha: float = 4.0
+    read_beta: float = 1.0
+    viewed_rate: float = 0.5  # Share of the unread items that have been seen in the item list.
+    starred_rate: float = 0.01
+    enclosure_rate: float = 0.1
+    text_size: int = 500
+    seed: int = 0
+
+    @property
+    def key(self) -> str:
+        """Changes whenever the spec does, for naming cached datasets."""
+        return hashlib.sha1(repr(astuple(self)).encode()).hexdigest()[:10]
+
+
+SCALES = {
+    "small": DatasetSpec(depth=2, feeds=50, items=5000),
+    "medium": DatasetSpec(depth=4, feeds=1000, items=200000),
+    "large": DatasetSpec(depth=6, feeds=5000, items=2000000),
+}
+
+
+@dataclass
+class DatasetSummary:
+    groups: int
+    feeds: int
+    items: int
+    read: int
+    viewed: int
+
+
+def _timestamp(value: datetime.datetime) -> str:
+    # The layout Pony stores datetimes in.
+    return value.isoformat(" ", timespec="microseconds")
+
+
+def _group_rows(spec: DatasetSpec, root_id: int, first_id: int) -> tuple[list[tuple], list[int]]:
+    rows = []
+    group_ids = [root_id]
+    level = [root_id]
+    next_id = first_id
+    for _ in range(spec.depth):
+        children = []
+        for parent in level:
+            for _ in range(spec.fanout):
+                rows.append((next_id, "Group", f"Group {next_id - first_id + 1}", parent))
+                children.append(next_id)
+                next_id += 1
+        group_ids.extend(children)
+        level = children
+    return rows, group_ids
+
+
+def _item_counts(spec: DatasetSpec, rng: random.Random) -> list[int]:
+    weights = [1 / (rank ** spec.item_skew) for rank in range(1, spec.feeds + 1)]
+    total = sum(weights)
+    counts = [int(spec.items * w / total) for w in weights]
+    for n in range(spec.items - sum(counts)):
+        counts[n % spec.feeds] += 1
+    rng.shuffle(counts)
+    return counts
+
+
+def _texts(spec: DatasetSpec, rng: random.Random) -> list[str]:
+    texts = []
+    for _ in range(_TEXTS):
+        words = []
+        length = 0
+        while length < spec.text_size:
+            word = rng.choice(_WORDS)
+            words.append(word)
+            length += len(word) + 1
+        texts.append(" ".join(words)[:spec.text_size])
+    return texts
+
+
+def _item_rows(spec: DatasetSpec, rng: random.Random, feed_ids: list[int], counts: list[int],
+               first_id: int) -> Iterator[tuple]:
+    texts = _texts(spec, rng)
+    item_id = first_id
+    for feed_id, count in zip(feed_ids, counts):
+        read_count = round(count * rng.betavariate(spec.read_alpha, spec.read_beta))
+        interval = datetime.timedelta(minutes=rng.randint(10, 60 * 24 * 7))
+        for n in range(count):
+            # Oldest first, so IDs grow with timestamps the way updates add them.
+            timestamp = _END - interval * (count - n) - datetime.timedelta(seconds=rng.randint(0, 59))
+            read = n < read_count
+            viewed = read or rng.random() < spec.viewed_rate
+            starred = rng.random() < spec.starred_rate
+            url = f"https://feed{feed_id}.example.com/items/{item_id}"
+            enclosure = f"{url}.mp3" if rng.random() < spec.enclosure_rate else None
+            yield (item_id, feed_id, enclosure, _timestamp(timestamp), read, viewed, starred, f"Item {item_id}",
+                   texts[item_id % _TEXTS], url)
+            item_id += 1
+
+
+def _insert(connection, sql: str, rows: Iterable[tuple], progress: Callable[[int], None] | None) -> None:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH_SIZE:
+            connection.executemany(sql, batch)
+            if progress is not None:
+                progress(len(batch))
+            batch = []
+    if batch:
+        connection.executemany(sql, batch)
+        if progress is not None:
+            progress(len(batch))
+
+
+def generate(dbi: DBInterface, spec: DatasetSpec = SCALES["small"],
+             progress: Callable[[int], None] | None = None) -> DatasetSummary:
+    """
+    Fill the empty database behind dbi with groups, feeds and items shaped by spec. Rows go straight to SQLite in
+    large batches rather than through Pony, so millions of items take seconds rather than hours, and the same spec
+    always produces the same database. progress is called with the number of items written after each batch.
+    """
+    db = dbi.db
+    rng = random.Random(spec.seed)
+    with orm.db_session:
+        connection = db.get_connection()
+        if connection.execute('SELECT 1 FROM "Feed" LIMIT 1').fetchone() is not None:
+            raise ValueError("Synthetic datasets can only be generated into an empty database")
+        first_group = connection.execute('SELECT max("id") FROM "RootGroup"').fetchone()[0] + 1
+        group_rows, group_ids = _group_rows(spec, dbi.root_group.id, first_group)
+        connection.executemany('INSERT INTO "RootGroup" ("id", "classtype", "name", "parent") VALUES (?, ?, ?, ?)',
+                               group_rows)
+
+        last_update = _timestamp(_END)
+        rate = update_rate / datetime.timedelta(days=1)  # Pony stores intervals in days.
+        feed_ids = list(range(1, spec.feeds + 1))
+        connection.executemany(
+            'INSERT INTO "Feed" ("id", "name", "url", "home_page", "description", "last_update", "update_rate", '
+            '"failures", "disabled", "priority", "group") VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0, 0, ?)',
+            [(n, f"Feed {n}", f"https://feed{n}.example.com/rss", f"https://feed{n}.example.com/", "", last_update,
+              rate, rng.choice(group_ids)) for n in feed_ids])
+
+        counts = _item_counts(spec, rng)
+        _insert(connection,
+                'INSERT INTO "FeedItem" ("id", "feed", "enclosure_url", "timestamp", "read", "viewed", "starred", '
+                '"title", "text", "url") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                _item_rows(spec, rng, feed_ids, counts, 1), progress)
+        connection.execute("ANALYZE")
+        read, viewed = connection.execute('SELECT total("read"), total("viewed") FROM "FeedItem"').fetchone()
+    return DatasetSummary(len(group_rows), spec.feeds, spec.items, int(read), int(viewed))
+
+
+def dataset_path(directory: str | pathlib.Path, name: str, spec: DatasetSpec) -> pathlib.Path:
+    return pathlib.Path(directory) / f"{name}-{spec.key}.sqlite"
+
+
+def open_dataset(directory: str | pathlib.Path, name: str, spec: DatasetSpec | None = None,
+                 progress: Callable[[int], None] | None = None) -> DBInterface:
+    """
+    Open the dataset for spec, the named scale by default, cached in directory and generated on first use.
+    A dataset is written under a temporary name and renamed once complete, so an interrupted run never leaves a
+    partial one behind.
+    """
+    spec = SCALES[name] if spec is None else spec
+    path = dataset_path(directory, name, spec)
+    if not path.exists():
+        partial = path.with_name(path.name + ".part")
+        partial.unlink(missing_ok=True)
+        dbi = DBInterface(partial)
+        try:
+            generate(dbi, spec, progress)
+        finally:
+            dbi.db.disconnect()
+        partial.rename(path)
+    return DBInterface(path)
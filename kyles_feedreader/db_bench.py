@@ -0,0 +1,170 @@
+# By Kyle Monson
+
+import fnmatch
+import json
+import pathlib
+import statistics
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Any, Callable
+
+from pony import orm
+
+from .db_interface import DBInterface, db_to_feed, db_to_feed_item, db_to_group
+
+
+REGRESSION_TOLERANCE = 0.25  # Slowdown, as a share of the baseline, before a case counts as regressed.
+NOISE_FLOOR = 0.002  # Seconds. Differences smaller than this are timer and scheduler noise.
+ADDED_ITEMS = 100
+
+
+@dataclass
+class Case:
+    name: str
+    call: Callable[[], Any]
+    writes: bool = False  # Run in a session that is rolled back, so every run starts from the same data.
+
+
+@dataclass
+class Timing:
+    case: str
+    runs: list[float]
+
+    @property
+    def best(self) -> float:
+        return min(self.runs)
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.runs)
+
+
+@dataclass
+class Comparison:
+    case: str
+    baseline: float | None
+    current: float
+    tolerance: float = REGRESSION_TOLERANCE
+
+    @property
+    def change(self) -> float | None:
+        """current as a share of baseline, minus one."""
+        if not self.baseline:
+            return None
+        return self.current / self.baseline - 1
+
+    @property
+    def regressed(self) -> bool:
+        if self.baseline is None:
+            return False
+        return self.current > self.baseline * (1 + self.tolerance) and self.current - self.baseline > NOISE_FLOOR
+
+
+def _largest_feed(dbi: DBInterface):
+    ids = dbi.db.select('SELECT "feed" FROM "FeedItem" GROUP BY "feed" ORDER BY count(*) DESC LIMIT 1')
+    return dbi.db.Feed[ids[0]] if ids else dbi.db.Feed.select().first()
+
+
+def _largest_group(dbi: DBInterface):
+    ids = dbi.db.select('SELECT f."group" FROM "Feed" f JOIN "RootGroup" g ON g."id" = f."group" '
+                        'WHERE g."parent" IS NOT NULL GROUP BY f."group" ORDER BY count(*) DESC LIMIT 1')
+    return dbi.db.RootGroup[ids[0]] if ids else None
+
+
+def cases(dbi: DBInterface) -> list[Case]:
+    """
+    The DBInterface calls the suite times, aimed at the feed with the most items and the group with the most feeds,
+    which is where the interface is slowest.
+    """
+    with orm.db_session:
+        feed_obj = _largest_feed(dbi)
+        if feed_obj is None:
+            raise ValueError("Database has no feeds to benchmark")
+        group_obj = _largest_group(dbi)
+        latest = feed_obj.items.select().sort_by(orm.desc(dbi.db.FeedItem.id))[:ADDED_ITEMS // 2]
+        feed = db_to_feed(feed_obj)
+        group = dbi.root_group if group_obj is None else db_to_group(group_obj)
+        item = db_to_feed_item(latest[0]) if latest else None
+        # Half new and half already in the db, which is what most updates look like.
+        items = [{"title": f"Benchmark item {n}", "url": f"{feed.url}#benchmark{n}"}
+                 for n in range(ADDED_ITEMS - len(latest))]
+        items += [{"title": i.title, "url": i.url} for i in latest]
+
+    result = [
+        Case("add_feed_items", lambda: dbi.add_feed_items(feed, items), writes=True),
+        Case("get_all_feed_items", lambda: dbi.get_all_feed_items()),
+        Case("get_all_feed_items(all)", lambda: dbi.get_all_feed_items(unread_only=False)),
+        Case("get_group_feed_items", lambda: dbi.get_group_feed_items(group)),
+        Case("get_feed_items", lambda: dbi.get_feed_items(feed)),
+        Case("get_feed_items(all)", lambda: dbi.get_feed_items(feed, unread_only=False)),
+        Case("get_feeds", lambda: dbi.get_feeds()),
+        Case("get_feeds(group)", lambda: dbi.get_feeds(group)),
+        Case("any_has_unviewed_feed_items", lambda: dbi.any_has_unviewed_feed_items()),
+        Case("group_has_unviewed_feed_items", lambda: dbi.group_has_unviewed_feed_items(group)),
+        Case("feed_has_unviewed_feed_items", lambda: dbi.feed_has_unviewed_feed_items(feed)),
+        Case("mark_feed_items_viewed", lambda: dbi.mark_feed_items_viewed(feed), writes=True),
+        Case("mark_group_items_viewed", lambda: dbi.mark_group_items_viewed(group), writes=True),
+        Case("mark_all_items_viewed", lambda: dbi.mark_all_items_viewed(), writes=True),
+        Case("mark_feed_items_read", lambda: dbi.mark_feed_items_read(feed), writes=True),
+        Case("mark_group_items_read", lambda: dbi.mark_group_items_read(group), writes=True),
+        Case("mark_all_items_read", lambda: dbi.mark_all_items_read(), writes=True),
+    ]
+    if item is not None:
+        result.append(Case("mark_feed_item_read", lambda: dbi.mark_feed_item_read(item), writes=True))
+    return result
+
+
+def _time(dbi: DBInterface, case: Case) -> float:
+    if not case.writes:
+        started = perf_counter()
+        case.call()
+        return perf_counter() - started
+    # The calls' own sessions join this one, so their changes are flushed, timed and then thrown away.
+    with orm.db_session:
+        started = perf_counter()
+        case.call()
+        orm.flush()
+        elapsed = perf_counter() - started
+        orm.rollback()
+    return elapsed
+
+
+def run(dbi: DBInterface, repeat: int = 3, select: str | None = None,
+        progress: Callable[[Timing], None] | None = None) -> list[Timing]:
+    """
+    Time each case repeat times against the database behind dbi, leaving it as it was. select is a glob over case
+    names. Writes are timed up to the flush, commits are not included.
+    """
+    result = []
+    for case in cases(dbi):
+        if select is not None and not fnmatch.fnmatchcase(case.name, select):
+            continue
+        timing = Timing(case.name, [_time(dbi, case) for _ in range(repeat)])
+        result.append(timing)
+        if progress is not None:
+            progress(timing)
+    return result
+
+
+def load_baselines(path: str | pathlib.Path, scale: str) -> dict[str, float]:
+    """The best times stored for scale at path, case by case."""
+    path = pathlib.Path(path)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text()).get(scale, {})
+
+
+def save_baselines(path: str | pathlib.Path, scale: str, timings: list[Timing]) -> None:
+    """Store the best times of timings as the baselines for scale, keeping those of other scales and cases."""
+    path = pathlib.Path(path)
+    baselines = json.loads(path.read_text()) if path.exists() else {}
+    baselines.setdefault(scale, {}).update({t.case: t.best for t in timings})
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(path.name + ".tmp")
+    temp.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+    temp.replace(path)
+
+
+def compare(timings: list[Timing], baselines: dict[str, float],
+            tolerance: float = REGRESSION_TOLERANCE) -> list[Comparison]:
+    return [Comparison(t.case, baselines.get(t.case), t.best, tolerance) for t in timings]
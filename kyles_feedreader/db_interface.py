@@ -1,19 +1,22 @@
 # By Kyle Monson
 
 from collections import defaultdict
+import contextlib
 import datetime
 from functools import singledispatch
 import pathlib
 from dataclasses import dataclass, fields, field
-import pytz
-from dateutil.tz import tzlocal
 from pony import orm
-from typing import TypeAlias, Type, TypeVar, Any
+from typing import TypeAlias, Type, TypeVar, Any, Iterable, Iterator
 from .db_model import define_entities
-from .defaults import update_rate
+from .migrations import apply_migrations, run_backfills
+from .defaults import fetch_history, update_rate
+from .instrumentation import DB, timed
 
 
 ALL = object()
+ITEM_FLAGS = ("read", "viewed", "starred")  # The flags of an item the reader sets.
+FEED_BATCH = 256  # Feeds iter_feeds reads at a time.
 
 
 GroupHandle: TypeAlias = int
@@ -63,6 +66,12 @@ class FeedData(Updatable):
     update_rate: datetime.timedelta
     etag: str | None
     last_modified: str | None  # Stored as a string to send right back to server on request.
+    failures: int
+    retry_at: datetime.datetime | None
+    disabled: bool
+    last_error: str | None
+    fresh_until: datetime.datetime | None
+    priority: int
     group: GroupHandle
     unreads: bool
     # items is intentionally omitted to allow us to do a recursive to_dict call without scooping them all up.
@@ -83,6 +92,188 @@ class FeedItemData(Updatable):
     enclosure_path: str | None
 
 
+@dataclass
+class TreeEntry:
+    depth: int
+    name: str
+    url: str | None = None  # None for groups.
+    home_page: str | None = None
+    description: str | None = None
+    id: GroupHandle | FeedHandle | None = None
+
+
+@dataclass
+class ItemSummary:
+    """What the item list shows of an item, without the text."""
+    id: FeedItemHandle
+    feed: FeedHandle
+    feed_name: str
+    title: str
+    timestamp: datetime.datetime | None
+    read: bool
+    viewed: bool
+    starred: bool
+
+    @property
+    def cursor(self) -> "ItemCursor":
+        return self.timestamp, self.id
+
+
+# An item's place in the item list, which is newest first with undated items last. Pages are fetched relative to
+# one, so scrolling costs the same anywhere in the list.
+ItemCursor: TypeAlias = tuple[datetime.datetime | None, FeedItemHandle]
+ITEM_LIST_END = object()  # Passed as before to get the last page of the item list.
+
+
+@dataclass
+class FeedStats:
+    """A feed's refreshes summed over the ones still kept in the db."""
+    feed: FeedHandle
+    name: str
+    url: str
+    fetches: int
+    latency: float  # Seconds.
+    size: int  # Bytes.
+    errors: int
+    not_modified: int
+    wasted: int  # Full downloads that brought no new items.
+    new_items: int
+    last_status: int | None
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.fetches
+
+    @property
+    def mean_latency(self) -> float:
+        return self.latency / self.fetches
+
+
+_FEED_STATS_SQL = """
+SELECT f."id", f."name", f."url", count(*), total(s."latency"), sum(s."size"), sum(s."error"), sum(s."not_modified"),
+    sum(NOT s."error" AND NOT s."not_modified" AND s."new_items" = 0), sum(s."new_items"),
+    (SELECT l."status" FROM "FeedFetch" l WHERE l."feed" = f."id" ORDER BY l."id" DESC LIMIT 1)
+FROM "FeedFetch" s JOIN "Feed" f ON f."id" = s."feed"
+GROUP BY f."id"
+"""
+
+_FEED_YIELDS_SQL = """
+SELECT "feed", count(*), sum("new_items") FROM "FeedFetch" WHERE NOT "error" GROUP BY "feed"
+"""
+
+
+ITEM_ROW_COLUMNS = ("id", "feed", "feed_name", "feed_url", "title", "url", "timestamp", "read", "viewed", "starred",
+                    "enclosure_url", "text")
+
+
+_ITEM_ROW_SQL = ('i."id"', 'i."feed"', 'f."name"', 'f."url"', 'i."title"', 'i."url"', 'i."timestamp"', 'i."read"',
+                 'i."viewed"', 'i."starred"', 'i."enclosure_url"', 'i."text"')
+
+
+def _item_json_value(name: str, expr: str) -> str:
+    if name in ("read", "viewed", "starred"):
+        # Booleans are stored as integers; json() turns the text into a JSON true or false.
+        return f"json(CASE WHEN {expr} THEN 'true' ELSE 'false' END)"
+    return expr
+
+
+def _sql_timestamp(value: datetime.datetime) -> str:
+    return value.isoformat(" ", timespec="microseconds")
+
+
+def _item_filters(feed: FeedData | None, group: GroupData | None, read: bool | None
+                  ) -> tuple[str, list[str], list[Any]]:
+    clauses = []
+    arguments = []
+    prefix = ""
+    if group is not None:
+        prefix = ('WITH RECURSIVE tree("id") AS '
+                  '(SELECT ? UNION ALL SELECT g."id" FROM "RootGroup" g JOIN tree t ON g."parent" = t."id") ')
+        arguments.append(group.id)
+        clauses.append('f."group" IN tree')
+    if feed is not None:
+        clauses.append('i."feed" = ?')
+        arguments.append(feed.id)
+    if read is not None:
+        clauses.append('i."read" = ?')
+        arguments.append(int(read))
+    return prefix, clauses, arguments
+
+
+def _item_query(select: str, feed: FeedData | None, group: GroupData | None, read: bool | None,
+                since: datetime.datetime | None, after_id: FeedItemHandle | None) -> tuple[str, tuple]:
+    prefix, clauses, arguments = _item_filters(feed, group, read)
+    if since is not None:
+        clauses.append('i."timestamp" >= ?')
+        arguments.append(_sql_timestamp(since))
+    if after_id is not None:
+        clauses.append('i."id" > ?')
+        arguments.append(after_id)
+
+    sql = f'{prefix}SELECT {select} FROM "FeedItem" i JOIN "Feed" f ON f."id" = i."feed"'
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += ' ORDER BY i."id"'
+    return sql, tuple(arguments)
+
+
+# Walks the group tree in one statement. Each row gets a key that sorts a group before its child groups, child
+# groups by name and a group's feeds after its child groups, so the rows come back in document order.
+_TREE_SQL = """
+WITH RECURSIVE ranked AS (
+    SELECT "id", "name", "parent", row_number() OVER (PARTITION BY "parent" ORDER BY "name") AS "rank"
+    FROM "RootGroup" WHERE "parent" IS NOT NULL
+), tree("id", "name", "depth", "sort_key") AS (
+    SELECT ?, NULL, 0, ''
+    UNION ALL
+    SELECT r."id", r."name", t."depth" + 1, t."sort_key" || printf('%08d.', r."rank")
+    FROM ranked r JOIN tree t ON r."parent" = t."id"
+)
+SELECT t."depth", t."name", NULL, NULL, NULL, t."id", t."sort_key" AS "key" FROM tree t
+UNION ALL
+SELECT t."depth" + 1, f."name", f."url", f."home_page", f."description", f."id", t."sort_key" || '~' AS "key"
+FROM "Feed" f JOIN tree t ON f."group" = t."id"
+ORDER BY "key", 2
+"""
+
+
+_ITEM_SUMMARY_SQL = ('i."id", i."feed", f."name", i."title", i."timestamp", i."read", i."viewed", i."starred"')
+
+
+def _page_segments(after: ItemCursor | None, before: ItemCursor | object | None
+                   ) -> list[tuple[str | None, list[Any], str]]:
+    """
+    The conditions and orderings that walk the item list from a cursor, as (clause, arguments, order by).
+    Dated and undated items are walked separately, so each part is a plain range over the timestamp indexes.
+    """
+    dated = 'i."timestamp" IS NOT NULL'
+    undated = 'i."timestamp" IS NULL'
+    newest_first = 'i."timestamp" DESC, i."id" DESC'
+    oldest_first = 'i."timestamp", i."id"'
+    if before is ITEM_LIST_END:
+        return [(undated, [], 'i."id"'), (dated, [], oldest_first)]
+    if before is not None:
+        timestamp, item_id = before
+        if timestamp is None:
+            return [(f'{undated} AND i."id" > ?', [item_id], 'i."id"'), (dated, [], oldest_first)]
+        t = _sql_timestamp(timestamp)
+        return [('i."timestamp" >= ? AND (i."timestamp" > ? OR i."id" > ?)', [t, t, item_id], oldest_first)]
+    if after is not None:
+        timestamp, item_id = after
+        if timestamp is None:
+            return [(f'{undated} AND i."id" < ?', [item_id], 'i."id" DESC')]
+        t = _sql_timestamp(timestamp)
+        return [('i."timestamp" <= ? AND (i."timestamp" < ? OR i."id" < ?)', [t, t, item_id], newest_first),
+                (undated, [], 'i."id" DESC')]
+    return [(dated, [], newest_first), (undated, [], 'i."id" DESC')]
+
+
+def _chunks(values: list[T], size: int = 500) -> Iterable[list[T]]:
+    # Keeps "IN" lists well under SQLite's bound parameter limit.
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
 def _get_interface_params(klass) -> list[str]:
     return [f.name for f in fields(klass)]
 
@@ -116,20 +307,25 @@ def db_to_feed(db_obj, recursive: bool = False):
 
 
 class DBInterface:
-    def __init__(self, filename: str | pathlib.Path) -> None:
+    def __init__(self, filename: str | pathlib.Path, backfill: bool = True) -> None:
         self.db = orm.Database()
         define_entities(self.db)
-        self.root_group: GroupData = self.initialize_sqlite(filename)
+        self.root_group: GroupData = self.initialize_sqlite(filename, backfill)
 
-    def initialize_sqlite(self, filename: str | pathlib.Path) -> GroupData:
-        if not isinstance(filename, str) or not filename.startswith(":"):
+    def initialize_sqlite(self, filename: str | pathlib.Path, backfill: bool = True) -> GroupData:
+        filename = str(filename)
+        if not filename.startswith(":"):
             pathlib.Path(filename).parent.mkdir(parents=True, exist_ok=True)
-        return self.initialize_db(provider='sqlite', filename=filename, create_db=True)
+        return self.initialize_db(provider='sqlite', backfill=backfill, filename=filename, create_db=True)
 
-    def initialize_db(self, provider: str = 'sqlite', **kwargs: Any) -> GroupData:
+    def initialize_db(self, provider: str = 'sqlite', backfill: bool = True, **kwargs: Any) -> GroupData:
         db = self.db
         db.bind(provider=provider, **kwargs)
+        # Existing databases have to match the model before Pony checks the tables.
+        apply_migrations(db)
         db.generate_mapping(create_tables=True)
+        if backfill:
+            run_backfills(db)
 
         with orm.db_session:
             # Ensure the root group exists.
@@ -140,6 +336,7 @@ class DBInterface:
                 root_group = db_to_root_group(root_object)
         return root_group
 
+    @timed(DB)
     @orm.db_session
     def add_feed(self, name, url, home_page, group_data: GroupData, rate=update_rate) -> FeedData:
         db = self.db
@@ -165,6 +362,54 @@ class DBInterface:
             return db_to_feed(f)
         return None
 
+    @orm.db_session
+    def find_feed_urls(self, urls: Iterable[str]) -> set[str]:
+        """Return which of urls already belong to a feed."""
+        result = set()
+        for chunk in _chunks(list(urls)):
+            result.update(orm.select(f.url for f in self.db.Feed if f.url in chunk))
+        return result
+
+    @timed(DB)
+    @orm.db_session
+    def add_feeds(self, feeds: Iterable[dict[str, Any]]) -> list[FeedData]:
+        """
+        Add several feeds and their first items in a single transaction.
+        Each dict holds add_feed's name, url, home_page and group_data plus optional etag, last_modified and entries.
+        Feeds whose URL is already in the db are skipped, as are items whose URL is already taken.
+        """
+        db = self.db
+        feeds = list(feeds)
+        existing = self.find_feed_urls(f["url"] for f in feeds)
+        item_urls = [item["url"] for f in feeds for item in f.get("entries", ())]
+        taken = set()
+        for chunk in _chunks(item_urls):
+            taken.update(orm.select(i.url for i in db.FeedItem if i.url in chunk))
+
+        last_update = datetime.datetime.utcnow()
+        result = []
+        for feed in feeds:
+            url = feed["url"]
+            if url in existing:
+                continue
+            existing.add(url)
+            f = db.Feed(name=feed["name"],
+                        url=url,
+                        home_page=feed["home_page"],
+                        update_rate=feed.get("rate", update_rate),
+                        group=feed["group_data"].id,
+                        etag=feed.get("etag"),
+                        last_modified=feed.get("last_modified"),
+                        last_update=last_update)
+            for item in feed.get("entries", ()):
+                if item["url"] not in taken:
+                    taken.add(item["url"])
+                    f.items.create(**item)
+            result.append(f)
+        orm.flush()
+        return [db_to_feed(f) for f in result]
+
+    @timed(DB)
     @orm.db_session
     def add_find_group(self, group_name: str, parent_data: GroupData) -> GroupData:
         db = self.db
@@ -174,11 +419,34 @@ class DBInterface:
             g = db.Group(name=group_name, parent=parent_id)
         return db_to_group(g)
 
+    @timed(DB)
+    @orm.db_session
+    def add_find_group_paths(self, paths: Iterable[tuple[str, ...]]) -> dict[tuple[str, ...], GroupData]:
+        """
+        Find or create every group along each path of group names in a single transaction.
+        The result maps each path and its prefixes to its group, with the empty path mapping to the root group.
+        """
+        db = self.db
+        objects = {(): db.RootGroup[self.root_group.id]}
+        for path in paths:
+            for i in range(1, len(path) + 1):
+                sub_path = path[:i]
+                if sub_path in objects:
+                    continue
+                parent = objects[sub_path[:-1]]
+                g = db.Group.get(name=sub_path[-1], parent=parent)
+                if g is None:
+                    g = db.Group(name=sub_path[-1], parent=parent)
+                objects[sub_path] = g
+        orm.flush()
+        return {p: self.root_group if not p else db_to_group(g) for p, g in objects.items()}
+
     @orm.db_session
     def find_group_by_name(self, group_name: str, parent_data: GroupData) -> GroupData | None:
         g = self.db.Group.get(name=group_name, parent=parent_data.id)
-        return None if g is None else db_to_feed(g)
+        return None if g is None else db_to_group(g)
 
+    @timed(DB)
     @orm.db_session
     def delete_group(self, group: GroupData | GroupHandle, recursive: bool = True) -> None:
         if isinstance(group, GroupData):
@@ -221,6 +489,131 @@ class DBInterface:
             fq = feed.select(lambda f: f.group is group).order_by(feed.name)
         return [db_to_feed(f) for f in fq]
 
+    def iter_feeds(self, batch_size: int = FEED_BATCH) -> Iterator[FeedData]:
+        """
+        Every feed in id order, read batch_size at a time in a session of their own, so only a batch is held and
+        the caller can write to the db between them.
+        """
+        after = 0
+        while True:
+            batch = self._feed_batch(after, batch_size)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            after = batch[-1].id
+
+    @orm.db_session
+    def _feed_batch(self, after: FeedHandle, batch_size: int) -> list[FeedData]:
+        feed = self.db.Feed
+        return [db_to_feed(f) for f in feed.select(lambda f: f.id > after).order_by(feed.id).limit(batch_size)]
+
+    def iter_tree(self, group_data: GroupData | None = None) -> Iterator[TreeEntry]:
+        """
+        Yield the groups and feeds below group_data, the root group by default, depth first with each group's
+        child groups before its feeds. Everything comes from a single query streamed from the cursor.
+        """
+        group_id = self.root_group.id if group_data is None else group_data.id
+        with orm.db_session:
+            cursor = self._stream(_TREE_SQL, (group_id,))
+            for depth, name, url, home_page, description, entry_id, _ in cursor:
+                if depth > 0:
+                    yield TreeEntry(depth, name, url, home_page, description, entry_id)
+
+    def iter_item_rows(self, feed: FeedData | None = None, group: GroupData | None = None, read: bool | None = None,
+                       since: datetime.datetime | None = None, after_id: FeedItemHandle | None = None
+                       ) -> Iterator[tuple]:
+        """
+        Yield feed items as tuples laid out as ITEM_ROW_COLUMNS in ID order, streamed from the cursor.
+        group includes the feeds of its subgroups. since keeps items with a timestamp at or after it and after_id
+        keeps items added after that one, as item IDs only ever increase.
+        """
+        select = ", ".join(_ITEM_ROW_SQL)
+        with orm.db_session:
+            for row in self._stream(*_item_query(select, feed, group, read, since, after_id)):
+                yield row[:7] + (bool(row[7]), bool(row[8]), bool(row[9])) + row[10:]
+
+    def iter_item_json(self, feed: FeedData | None = None, group: GroupData | None = None, read: bool | None = None,
+                       since: datetime.datetime | None = None, after_id: FeedItemHandle | None = None
+                       ) -> Iterator[tuple[FeedItemHandle, str]]:
+        """
+        Like iter_item_rows but yields each item's ID and the item as a JSON object keyed by ITEM_ROW_COLUMNS.
+        SQLite does the encoding, which is several times faster than json.dumps on large exports.
+        """
+        pairs = ", ".join(f"'{name}', {_item_json_value(name, expr)}"
+                          for name, expr in zip(ITEM_ROW_COLUMNS, _ITEM_ROW_SQL))
+        select = f'i."id", json_object({pairs})'
+        with orm.db_session:
+            yield from self._stream(*_item_query(select, feed, group, read, since, after_id))
+
+    def get_item_page(self, feed: FeedData | None = None, group: GroupData | None = None, unread_only: bool = True,
+                      starred_only: bool = False, after: ItemCursor | None = None,
+                      before: ItemCursor | object | None = None, limit: int = 100) -> list[ItemSummary]:
+        """
+        Up to limit items of the item list, newest first, with group including the feeds of its subgroups.
+        The page starts right after the item at after, or ends right before the one at before, or at the end of
+        the list if before is ITEM_LIST_END, and is the start of the list otherwise. Seeking uses the indexes
+        rather than an offset, so a page deep into millions of items costs the same as the first.
+        """
+        prefix, filters, filter_arguments = _item_filters(feed, group, False if unread_only else None)
+        if starred_only:
+            filters.append('i."starred" = 1')
+        backwards = before is not None
+        result = []
+        with orm.db_session:
+            for clause, arguments, order in _page_segments(after, before):
+                if len(result) == limit:
+                    break
+                where = " AND ".join(filters + [clause])
+                sql = (f'{prefix}SELECT {_ITEM_SUMMARY_SQL} FROM "FeedItem" i JOIN "Feed" f ON f."id" = i."feed" '
+                       f'WHERE {where} ORDER BY {order} LIMIT ?')
+                rows = self._stream(sql, tuple(filter_arguments + arguments + [limit - len(result)]))
+                for item_id, feed_id, feed_name, title, timestamp, read, viewed, starred in rows:
+                    if timestamp is not None:
+                        timestamp = datetime.datetime.fromisoformat(timestamp)
+                    result.append(ItemSummary(item_id, feed_id, feed_name, title, timestamp, bool(read),
+                                              bool(viewed), bool(starred)))
+        if backwards:
+            result.reverse()
+        return result
+
+    def count_items(self, feed: FeedData | None = None, group: GroupData | None = None, unread_only: bool = True,
+                    starred_only: bool = False) -> int:
+        prefix, filters, arguments = _item_filters(feed, group, False if unread_only else None)
+        if starred_only:
+            filters.append('i."starred" = 1')
+        sql = f'{prefix}SELECT count(*) FROM "FeedItem" i JOIN "Feed" f ON f."id" = i."feed"'
+        if filters:
+            sql += " WHERE " + " AND ".join(filters)
+        with orm.db_session:
+            return self._stream(sql, tuple(arguments)).fetchone()[0]
+
+    def get_unread_counts(self, feeds: Iterable[FeedHandle] | None = None) -> dict[FeedHandle, int]:
+        """Unread items per feed, of every feed or just feeds, leaving out feeds with none."""
+        sql = 'SELECT "feed", count(*) FROM "FeedItem" WHERE "read" = 0'
+        result = {}
+        with orm.db_session:
+            if feeds is None:
+                result.update(self._stream(sql + ' GROUP BY "feed"'))
+            else:
+                for chunk in _chunks(list(feeds)):
+                    in_list = ", ".join("?" * len(chunk))
+                    result.update(self._stream(f'{sql} AND "feed" IN ({in_list}) GROUP BY "feed"', tuple(chunk)))
+        return result
+
+    def get_item_texts(self, items: Iterable[FeedItemHandle]) -> dict[FeedItemHandle, str | None]:
+        """The text of each of items, which a summary leaves out, leaving out items that are gone."""
+        result = {}
+        with orm.db_session:
+            for chunk in _chunks(list(items)):
+                in_list = ", ".join("?" * len(chunk))
+                result.update(self._stream(f'SELECT "id", "text" FROM "FeedItem" WHERE "id" IN ({in_list})',
+                                           tuple(chunk)))
+        return result
+
+    def _stream(self, sql: str, arguments: Any = ()):
+        # Unlike get_connection this doesn't open a write transaction, so long reads don't hold up updates.
+        return self.db._exec_sql(sql, arguments)
+
     @orm.db_session
     def get_feed(self, feed_id: FeedHandle) -> FeedData | None:
         feed = self.db.Feed.get(id=feed_id)
@@ -228,10 +621,12 @@ class DBInterface:
             return None
         return db_to_feed(feed)
 
+    @timed(DB)
     @orm.db_session
     def delete_feed(self, feed: FeedData):
         self.db.Feed[feed.id].delete()
 
+    @timed(DB)
     @orm.db_session
     def update_feed(self, feed: FeedData, **kwargs):
         db = self.db
@@ -258,6 +653,7 @@ class DBInterface:
         f.set(**kwargs)
         feed.update(**kwargs)
 
+    @timed(DB)
     @orm.db_session
     def add_feed_items(self, feed: FeedData, items: list[dict[str, Any]]) -> list[FeedItemData]:
         result = []
@@ -273,6 +669,7 @@ class DBInterface:
         self.update_feed_last_update(feed)
         return result
 
+    @timed(DB)
     @orm.db_session
     def update_feed_last_update(self, feed: FeedData) -> None:
         f = self.db.Feed[feed.id]
@@ -282,6 +679,88 @@ class DBInterface:
         # last_update = last_update.replace(tzinfo=pytz.utc)
         f.last_update = last_update
 
+    @timed(DB)
+    @orm.db_session
+    def record_fetch(self, feed: FeedData, latency: float, size: int, status: int | None, not_modified: bool = False,
+                     error: bool = False, new_items: int = 0, history: int = fetch_history) -> None:
+        """Record a refresh of feed, dropping all but its latest history refreshes."""
+        db = self.db
+        db.FeedFetch(feed=feed.id, timestamp=datetime.datetime.utcnow(), latency=latency, size=size, status=status,
+                     not_modified=not_modified, error=error, new_items=new_items)
+        orm.flush()
+        db.execute('DELETE FROM "FeedFetch" WHERE "feed" = $feed_id AND "id" <= '
+                   '(SELECT "id" FROM "FeedFetch" WHERE "feed" = $feed_id ORDER BY "id" DESC LIMIT 1 OFFSET $history)',
+                   {"feed_id": feed.id, "history": history})
+
+    @orm.db_session
+    def get_suspended_feeds(self, now: datetime.datetime) -> list[FeedData]:
+        """Feeds that are disabled or backing off at now."""
+        feed = self.db.Feed
+        q = feed.select(lambda f: f.disabled or f.retry_at > now).sort_by(feed.name)
+        return [db_to_feed(f) for f in q]
+
+    def get_fetch_stats(self) -> list[FeedStats]:
+        """Sum up the recorded refreshes of every feed that has any."""
+        with orm.db_session:
+            return [FeedStats(*row) for row in self._stream(_FEED_STATS_SQL)]
+
+    def get_feed_yields(self) -> dict[FeedHandle, tuple[int, int]]:
+        """How many of the recorded refreshes of each feed got through and the new items they found between them."""
+        with orm.db_session:
+            return {feed: (fetches, new_items) for feed, fetches, new_items in self._stream(_FEED_YIELDS_SQL)}
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Make the writes of the calls inside one transaction, committed at the end or rolled back on an exception."""
+        with orm.db_session:
+            yield
+
+    @orm.db_session
+    def get_pending_enclosures(self, feed: FeedData | None = None, unread_only: bool = True,
+                               limit: int | None = None) -> list[FeedItemData]:
+        """Items with an enclosure that hasn't been downloaded, oldest first."""
+        feed_item = self.db.FeedItem
+        q = orm.select(i for i in feed_item if i.enclosure_url is not None and i.enclosure_path is None)
+        if unread_only:
+            q = q.filter(lambda i: not i.read)
+        if feed is not None:
+            f = self.db.Feed[feed.id]
+            q = q.filter(lambda i: i.feed == f)
+        q = q.sort_by(feed_item.timestamp, feed_item.id)
+        if limit is not None:
+            q = q.limit(limit)
+        return [db_to_feed_item(i) for i in q]
+
+    def iter_enclosures(self) -> Iterator[tuple[FeedItemHandle, str | None, bool]]:
+        """
+        Yield the ID, enclosure path and read flag of every item with an enclosure, read items first and oldest
+        first within those, which is the order downloads are removed in when over quota.
+        """
+        with orm.db_session:
+            cursor = self._stream('SELECT "id", "enclosure_path", "read" FROM "FeedItem" '
+                                  'WHERE "enclosure_url" IS NOT NULL ORDER BY "read" DESC, "timestamp", "id"')
+            for item_id, path, read in cursor:
+                yield item_id, path, bool(read)
+
+    @timed(DB)
+    @orm.db_session
+    def set_enclosure_path(self, feed_item: FeedItemData, path: str | None) -> bool:
+        """Point feed_item at its downloaded enclosure. Returns False if the item has been deleted meanwhile."""
+        fi = self.db.FeedItem.get(id=feed_item.id)
+        if fi is None:
+            return False
+        fi.enclosure_path = path
+        feed_item.update(enclosure_path=path)
+        return True
+
+    @timed(DB)
+    @orm.db_session
+    def clear_enclosure_paths(self, item_ids: Iterable[FeedItemHandle]) -> None:
+        feed_item = self.db.FeedItem
+        for chunk in _chunks(list(item_ids)):
+            for i in orm.select(i for i in feed_item if i.id in chunk):
+                i.enclosure_path = None
+
     def _get_feed_item_query(self, unread_only: bool):
         feed_item = self.db.FeedItem
         if not unread_only:
@@ -327,6 +806,24 @@ class DBInterface:
         r = orm.select(i for i in self.db.FeedItem if not i.viewed and i.feed == feed).exists()
         return r
 
+    @timed(DB)
+    def set_item_states(self, states: dict[FeedItemHandle, dict[str, bool]]) -> None:
+        """Set flags of many items in a single transaction, states maps each item to flags like {"read": True}."""
+        updates = defaultdict(list)
+        for item, flags in states.items():
+            for flag, value in flags.items():
+                if flag not in ITEM_FLAGS:
+                    raise ValueError(f"{flag} is not an item flag")
+                updates[flag, bool(value)].append(item)
+        with orm.db_session:
+            connection = self.db.get_connection()
+            for (flag, value), items in updates.items():
+                for chunk in _chunks(items):
+                    in_list = ", ".join("?" * len(chunk))
+                    connection.execute(f'UPDATE "FeedItem" SET "{flag}" = ? WHERE "id" IN ({in_list})',
+                                       (int(value), *chunk))
+
+    @timed(DB)
     @orm.db_session
     def mark_all_items_viewed(self) -> None:
         # ponyorm does not yet support bulk update, so we do it in a loop.
@@ -334,6 +831,7 @@ class DBInterface:
         for i in q:
             i.set(viewed=True)
 
+    @timed(DB)
     @orm.db_session
     def mark_group_items_viewed(self, group: GroupData):
         group = self.db.RootGroup[group.id]
@@ -341,6 +839,7 @@ class DBInterface:
         for i in q:
             i.set(viewed=True)
 
+    @timed(DB)
     @orm.db_session
     def mark_feed_items_viewed(self, feed: FeedData):
         feed = self.db.Feed[feed.id]
@@ -348,6 +847,7 @@ class DBInterface:
         for i in q:
             i.set(viewed=True)
 
+    @timed(DB)
     @orm.db_session
     def mark_all_items_read(self) -> None:
         # ponyorm does not yet support bulk update, so we do it in a loop.
@@ -355,6 +855,7 @@ class DBInterface:
         for i in q:
             i.set(read=True)
 
+    @timed(DB)
     @orm.db_session
     def mark_group_items_read(self, group: GroupData):
         group = self.db.RootGroup[group.id]
@@ -362,6 +863,7 @@ class DBInterface:
         for i in q:
             i.set(read=True)
 
+    @timed(DB)
     @orm.db_session
     def mark_feed_items_read(self, feed: FeedData):
         feed = self.db.Feed[feed.id]
@@ -369,6 +871,7 @@ class DBInterface:
         for i in q:
             i.set(read=True)
 
+    @timed(DB)
     @orm.db_session
     def mark_feed_item_read(self, feed_item: FeedItemData):
         fi = self.db.FeedItem[feed_item.id]
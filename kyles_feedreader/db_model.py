@@ -17,6 +17,7 @@ def define_entities(db: orm.Database):
         name = orm.Required(str, index=True)
         parent = orm.Required("RootGroup", reverse="children")
         orm.composite_key(name, parent)
+        orm.composite_index(parent, name)
 
     class Feed(db.Entity):
         id = orm.PrimaryKey(int, auto=True)
@@ -30,8 +31,16 @@ def define_entities(db: orm.Database):
         update_rate = orm.Required(timedelta)
         etag = orm.Optional(str, nullable=True)
         last_modified = orm.Optional(str, nullable=True)  # Stored as a string to send right back to server on request.
+        failures = orm.Required(int, default=0)  # Failed updates in a row.
+        retry_at = orm.Optional(datetime)  # Backing off until then.
+        disabled = orm.Required(bool, default=bool)  # Failed too often, skipped until reset.
+        last_error = orm.Optional(str, nullable=True)
+        fresh_until = orm.Optional(datetime)  # The server's caching headers say there is no need to fetch before.
+        priority = orm.Required(int, default=0)  # Set by the user, higher goes first when an update is short of time.
         group = orm.Required(RootGroup)
         items = orm.Set('FeedItem')
+        fetches = orm.Set('FeedFetch')
+        orm.composite_index(group, name)
 
         @property
         def unreads(self):
@@ -50,3 +59,18 @@ def define_entities(db: orm.Database):
         text = orm.Optional(str)
         url = orm.Required(str, unique=True)
         orm.composite_index(read, timestamp)
+        orm.composite_index(feed, read, timestamp)
+        orm.composite_index(feed, viewed)
+
+    class FeedFetch(db.Entity):
+        # One row per refresh, only the latest few are kept for each feed.
+        id = orm.PrimaryKey(int, auto=True)
+        feed = orm.Required(Feed)
+        timestamp = orm.Required(datetime)
+        latency = orm.Required(float)
+        size = orm.Required(int)
+        status = orm.Optional(int, nullable=True)
+        not_modified = orm.Required(bool, default=bool)
+        error = orm.Required(bool, default=bool)
+        new_items = orm.Required(int, default=0)
+        orm.composite_index(feed, id)
@@ -8,6 +8,27 @@ import click
 _app_dir_path = Path(click.get_app_dir("kyles_feedreader", roaming=False))
 
 db_path = str(_app_dir_path / "db.sqlite")
+enclosure_dir = str(_app_dir_path / "enclosures")
 config_path = str(_app_dir_path / "config.yaml")
+bench_dir = str(_app_dir_path / "bench")  # Synthetic datasets and stored benchmark baselines.
 
 update_rate = timedelta(hours=1)
+
+import_concurrency = 16  # Feeds fetched at once by an OPML import.
+backup_pages = 256  # Pages copied per step of an online backup.
+fetch_history = 100  # Refreshes of each feed kept for kfr-cli stats.
+backoff_base = timedelta(hours=1)  # Wait after a feed's first failed update, doubling with each one after.
+backoff_max = timedelta(days=7)
+disable_after = 10  # Failed updates in a row before a feed is disabled.
+update_concurrency = 8  # Feeds fetched at once by an update.
+update_memory = 256 * 1024 ** 2  # Estimated bytes of fetched feeds an update holds at once, until written.
+lean_parse = False  # Parse updates without feedparser's HTML sanitizing, see update --lean.
+max_feed_size = 16 * 1024 ** 2  # Bytes of a feed response, after decompression, beyond which it isn't parsed.
+check_interval = 300.0  # Longest the TUI goes between looking for feeds due an update.
+state_flush_interval = 2.0  # Longest items marked in the TUI wait to be written, and so the most a crash can lose.
+host_concurrency = 2  # Requests in flight to a single host.
+host_interval = 1.0  # Seconds between the start of requests to the same host.
+dns_cache_ttl = 300.0  # Seconds a host's addresses are reused.
+max_freshness = timedelta(days=1)  # Longest a server's caching headers can put off a feed's next fetch.
+enclosure_concurrency = 4  # Enclosures downloaded at once.
+enclosure_quota = 10 * 1024 ** 3  # Bytes of enclosures kept before the ones of read items are removed.
@@ -0,0 +1,225 @@
+# By Kyle Monson
+
+import http.client
+import os
+import pathlib
+import posixpath
+import re
+import urllib.error
+import urllib.request
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Callable, Iterable
+from urllib.parse import urlsplit
+
+from . import fetching
+from .db_interface import DBInterface, FeedItemData, FeedItemHandle
+from .defaults import enclosure_concurrency, enclosure_dir, enclosure_quota
+
+
+CHUNK_SIZE = 1 << 16  # Bytes read and written at a time, all a download holds in memory.
+DOWNLOAD_TIMEOUT = 60  # Seconds without data before a download is given up on.
+PART_SUFFIX = ".part"
+USER_AGENT = "kyles_feedreader"
+
+
+@dataclass
+class Download:
+    item: FeedItemData
+    path: pathlib.Path | None = None  # None if the download failed.
+    size: int = 0
+    resumed_from: int = 0
+    error: str | None = None
+
+
+@dataclass
+class FetchReport:
+    downloaded: list[Download] = field(default_factory=list)
+    failed: list[Download] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return sum(d.size - d.resumed_from for d in self.downloaded)
+
+
+@dataclass
+class CleanupReport:
+    removed: int = 0  # Files of deleted items and abandoned partial downloads.
+    evicted: list[FeedItemHandle] = field(default_factory=list)  # Read items whose enclosure went over the quota.
+    freed: int = 0
+    size: int = 0  # Bytes left on disk.
+
+
+@dataclass
+class EnclosureStatus:
+    items: int = 0
+    downloaded: int = 0
+    missing: int = 0  # Downloaded, but the file is gone.
+    partial: int = 0
+    size: int = 0
+    partial_size: int = 0
+
+
+def enclosure_path(item: FeedItemData, directory: str | pathlib.Path = enclosure_dir) -> pathlib.Path:
+    """Where the enclosure of item goes: a directory per feed and a file named after the item."""
+    suffix = posixpath.splitext(urlsplit(item.enclosure_url).path)[1]
+    if not re.fullmatch(r"\.\w{1,8}", suffix):
+        suffix = ""
+    return pathlib.Path(directory) / str(item.feed) / f"{item.id}{suffix}"
+
+
+def _part_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name(path.name + PART_SUFFIX)
+
+
+def _range_total(headers) -> int | None:
+    # The size a 416 response says the whole file has, from a Content-Range of "bytes */<size>".
+    match = re.fullmatch(r"bytes \*/(\d+)", headers.get("Content-Range", "") if headers else "")
+    return int(match.group(1)) if match else None
+
+
+def download(item: FeedItemData, directory: str | pathlib.Path = enclosure_dir, chunk_size: int = CHUNK_SIZE,
+             timeout: float = DOWNLOAD_TIMEOUT) -> Download:
+    """
+    Download the enclosure of item into directory a chunk at a time.
+
+    The file is written with a .part suffix and renamed once complete. A .part file left by an interrupted download
+    is resumed with a Range request, or started over if the server doesn't do ranges.
+    """
+    result = Download(item)
+    target = enclosure_path(item, directory)
+    if target.exists():
+        # Finished before, but the db never heard about it.
+        result.path = target
+        result.size = target.stat().st_size
+        return result
+
+    part = _part_path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    offset = part.stat().st_size if part.exists() else 0
+    request = urllib.request.Request(item.enclosure_url, headers={"User-Agent": USER_AGENT})
+    if offset:
+        request.add_header("Range", f"bytes={offset}-")
+    opener = urllib.request.build_opener(*fetching.connection_handlers())
+
+    try:
+        with fetching.limiter.slot(fetching.host_of(item.enclosure_url)), \
+                opener.open(request, timeout=timeout) as response:
+            if response.status != HTTPStatus.PARTIAL_CONTENT:
+                offset = 0
+            with open(part, "ab" if offset else "wb") as f:
+                while chunk := response.read(chunk_size):
+                    f.write(chunk)
+    except urllib.error.HTTPError as e:
+        # The range starts at the end of the file, so the last attempt got everything but the rename.
+        if not (e.code == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE and offset and _range_total(e.headers) == offset):
+            result.error = f"{e.code} {e.reason}"
+            return result
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        result.error = f"{e.__class__.__name__}: {str(e)}"
+        return result
+
+    os.replace(part, target)
+    result.path = target
+    result.size = target.stat().st_size
+    result.resumed_from = offset
+    return result
+
+
+def fetch_enclosures(db: DBInterface, items: Iterable[FeedItemData], directory: str | pathlib.Path = enclosure_dir,
+                     concurrency: int = enclosure_concurrency,
+                     progress: Callable[[Download], None] | None = None) -> FetchReport:
+    """
+    Download the enclosures of items concurrency at a time, interleaving hosts, and record each path as its file
+    lands. Files are only ever moved into place complete, so a path in the db always points at a whole file.
+    """
+    report = FetchReport()
+    fetched = fetching.fetch_all(items, lambda i: i.enclosure_url, lambda i: download(i, directory), concurrency)
+    for item, result in fetched:
+        if result.path is not None and not db.set_enclosure_path(item, str(result.path)):
+            result.path.unlink(missing_ok=True)
+            result.path = None
+            result.error = "Item was deleted while downloading"
+        if result.path is None:
+            report.failed.append(result)
+        else:
+            report.downloaded.append(result)
+        if progress is not None:
+            progress(result)
+    return report
+
+
+_FILE_NAME = re.compile(r"\d+(\.\w{1,8})?(" + re.escape(PART_SUFFIX) + ")?")
+
+
+def _files(directory: pathlib.Path) -> list[pathlib.Path]:
+    # Only what enclosure_path lays out, <feed id>/<item id>[.ext][.part], so anything else kept in the directory is
+    # left alone.
+    if not directory.is_dir():
+        return []
+    return [p for feed_dir in directory.iterdir() if feed_dir.is_dir() and feed_dir.name.isdigit()
+            for p in feed_dir.iterdir() if p.is_file() and _FILE_NAME.fullmatch(p.name)]
+
+
+def _item_id(path: pathlib.Path) -> int | None:
+    stem = path.name.split(".", 1)[0]
+    return int(stem) if stem.isdigit() else None
+
+
+def cleanup(db: DBInterface, directory: str | pathlib.Path = enclosure_dir, quota: int = enclosure_quota
+            ) -> CleanupReport:
+    """
+    Remove enclosure files no item points at, partial downloads of items that are gone or already downloaded, and,
+    while over quota bytes, the enclosures of read items oldest first. Enclosures of unread items are never removed.
+    """
+    directory = pathlib.Path(directory)
+    report = CleanupReport()
+    enclosures = list(db.iter_enclosures())
+    pending = {item_id for item_id, path, _ in enclosures if path is None}
+    referenced = {os.path.normpath(path) for _, path, _ in enclosures if path is not None}
+
+    for p in _files(directory):
+        size = p.stat().st_size
+        if p.name.endswith(PART_SUFFIX):
+            keep = _item_id(p) in pending
+        else:
+            keep = os.path.normpath(p) in referenced
+        if keep:
+            report.size += size
+        else:
+            p.unlink()
+            report.removed += 1
+            report.freed += size
+
+    for item_id, path, read in enclosures:
+        if report.size <= quota or not read:
+            break
+        if path is None:
+            continue
+        p = pathlib.Path(path)
+        size = p.stat().st_size if p.exists() else 0
+        p.unlink(missing_ok=True)
+        report.evicted.append(item_id)
+        report.size -= size
+        report.freed += size
+    db.clear_enclosure_paths(report.evicted)
+    return report
+
+
+def status(db: DBInterface, directory: str | pathlib.Path = enclosure_dir) -> EnclosureStatus:
+    result = EnclosureStatus()
+    for _, path, _ in db.iter_enclosures():
+        result.items += 1
+        if path is None:
+            continue
+        result.downloaded += 1
+        p = pathlib.Path(path)
+        if p.exists():
+            result.size += p.stat().st_size
+        else:
+            result.missing += 1
+    for p in _files(pathlib.Path(directory)):
+        if p.name.endswith(PART_SUFFIX):
+            result.partial += 1
+            result.partial_size += p.stat().st_size
+    return result
@@ -1,20 +1,107 @@
+import datetime
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+
+import gevent
 from gevent.event import Event
-from dataclasses import dataclass
-from datetime import datetime
+
+from . import updater
+from .db_interface import DBInterface, FeedData, FeedHandle
+from .defaults import check_interval, update_concurrency
+
+
+MIN_WAIT = 1.0  # Seconds, so a feed that keeps coming due can't make the worker spin.
+
+
+def due_feeds(feeds: Iterable[FeedData], now: datetime.datetime) -> list[FeedData]:
+    """The feeds whose update rate says it's time for another look."""
+    return [f for f in feeds if not f.disabled and (f.last_update is None or f.last_update + f.update_rate <= now)]
+
+
+def next_check(feeds: Iterable[FeedData], now: datetime.datetime, longest: float = check_interval) -> float:
+    """Seconds until the first of feeds is due, which none of them can be before their backoff or cache allow."""
+    wait = longest
+    for f in feeds:
+        if f.disabled:
+            continue
+        due = max(t for t in (f.last_update and f.last_update + f.update_rate, f.retry_at, f.fresh_until, now)
+                  if t is not None)
+        wait = min(wait, (due - now).total_seconds())
+    return max(wait, MIN_WAIT)
 
 
 @dataclass
 class FeedManager:
-    new_feed_item_event: Event
-    name: str
-    url: str
-    home_page: str
-    update_rate: int
-    description: str = ""
-    last_update: datetime = None
-    etag: str = None
-    last_modified: str = None
-    unviewed_feeds: bool = False
+    """
+    Keeps feeds up to date while the TUI runs. worker runs in a greenlet and hands each round of updates to a thread
+    from the hub's pool, so fetching, parsing and db writes never hold up the UI.
+
+    Feeds that got new items are counted up for take_changes as they are written and announced by setting
+    new_feed_item_event and calling on_change on the hub, whichever thread found them.
+    """
+    db: DBInterface
+    new_feed_item_event: Event = field(default_factory=Event)
+    on_change: Callable[[], None] | None = None
+    concurrency: int = update_concurrency
+    check_interval: float = check_interval
+    rounds: int = 0
+    last_error: Exception | None = None
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._changes: Counter[FeedHandle] = Counter()
+        self._wake = Event()
+        self._async = None
+
+    def check_now(self) -> None:
+        """Look for due feeds now rather than at the next check."""
+        self._wake.set()
+
+    def take_changes(self) -> dict[FeedHandle, int]:
+        """New items per feed since the last call."""
+        with self._lock:
+            changes = dict(self._changes)
+            self._changes.clear()
+        self.new_feed_item_event.clear()
+        return changes
+
+    def _found(self, feed: FeedData, count: int) -> None:
+        # Called on the update thread.
+        with self._lock:
+            self._changes[feed.id] += count
+        self._async.send()
+
+    def _announce(self) -> None:
+        self.new_feed_item_event.set()
+        if self.on_change is not None:
+            self.on_change()
+
+    def update_round(self) -> float:
+        """Update the feeds that are due, returning the seconds until the next one is. Runs off the hub."""
+        now = datetime.datetime.utcnow()
+        feeds = self.db.get_feeds()
+        due = due_feeds(feeds, now)
+        if due:
+            updater.update_feeds(self.db, due, concurrency=self.concurrency, on_new_items=self._found)
+            feeds = self.db.get_feeds()
+        self.rounds += 1
+        return next_check(feeds, datetime.datetime.utcnow(), self.check_interval)
 
     def worker(self):
-        pass
+        hub = gevent.get_hub()
+        self._async = hub.loop.async_()
+        self._async.start(self._announce)
+        try:
+            while True:
+                try:
+                    wait = hub.threadpool.apply(self.update_round)
+                except Exception as e:
+                    # The next round gets another go, the TUI has nowhere to show a traceback.
+                    self.last_error = e
+                    wait = self.check_interval
+                self._wake.wait(wait)
+                self._wake.clear()
+        finally:
+            self._async.stop()
@@ -1,18 +1,28 @@
 import feedparser as fp
-import dateparser
-from datetime import datetime
+import feedparser.http
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 from enum import Flag, auto
+from html.parser import HTMLParser
 from http import HTTPStatus
+import threading
+from time import monotonic, perf_counter
 import warnings
 
 from bs4 import BeautifulSoup
 
+from . import fetching, instrumentation
+from .instrumentation import phase
+
 # BeautifulSoup complains about some possible inputs so I have to suppress it's whiny butt.
 warnings.filterwarnings("ignore", category=UserWarning, module='bs4')
 
 
 def handler(date_string):
-    d = dateparser.parse(date_string)
+    # dateparser loads a large amount of locale data, so it is only imported once a date needs parsing.
+    import dateparser
+    with phase(instrumentation.DATE):
+        d = dateparser.parse(date_string)
     if d is not None:
         return d.timetuple()
     return None
@@ -21,10 +31,119 @@ def handler(date_string):
 # We add our own handler for all the weird stuff you see in feeds.
 fp.datetimes.registerDateHandler(handler)
 
+_http_get = fp.http.get
+_last_request = threading.local()
+
+
+def _polite_http_get(url, etag=None, modified=None, agent=None, referrer=None, handlers=None, request_headers=None,
+                     result=None):
+    if handlers is None:
+        handlers = []
+    elif not isinstance(handlers, list):
+        handlers = [handlers]
+    until = getattr(_last_request, "until", None)
+
+    # Phases are exclusive, so only the time spent waiting for the host counts as waiting.
+    with phase(instrumentation.WAIT), fetching.limiter.slot(fetching.host_of(url)):
+        timeout = None
+        if until is not None:
+            # Don't start a request there is no time left for, or let one outlast the time by much.
+            timeout = until - monotonic()
+            if timeout <= 0:
+                raise TimeoutError("Out of time before the request was sent")
+        handlers = fetching.connection_handlers(timeout) + handlers
+        started = perf_counter()
+        data = b""
+        try:
+            with phase(instrumentation.FETCH):
+                data = _http_get(url, etag, modified, agent, referrer, handlers, request_headers, result)
+            # The handlers only see the response as sent, this catches compressed ones that inflate past the limit.
+            if len(data) > fetching.max_size:
+                raise ValueError(f"Response is over {fetching.max_size} bytes")
+        finally:
+            _last_request.measured = perf_counter() - started, len(data)
+
+    # Wait for room outside the host's slot, so other feeds from it can be fetched meanwhile.
+    budget = getattr(_last_request, "budget", None)
+    if budget is not None and data:
+        reserved = fetching.parsed_size(len(data))
+        with phase(instrumentation.MEMORY):
+            budget.acquire(reserved)
+        _last_request.reserved = reserved
+    return data
+
+
+# feedparser does its own fetching, so we wrap the function it fetches with to keep to the per host limits, resolve
+# through the DNS cache, time the request and measure the response.
+fp.http.get = _polite_http_get
+
+
+def _get_text(html: str) -> str:
+    with phase(instrumentation.TEXT):
+        return BeautifulSoup(html, features="lxml").get_text()
+
+
+class _TextExtractor(HTMLParser):
+    # feedparser's sanitizer drops these along with everything in them, the rest only lose their tags.
+    SKIPPED = frozenset(("script", "style", "applet"))
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED:
+            self.skipping += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED and self.skipping:
+            self.skipping -= 1
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+
+def _get_plain_text(html: str) -> str:
+    """
+    The text _get_text gets from sanitized HTML, up to whitespace, out of HTML feedparser didn't sanitize. Plain text
+    is most of what feeds have and is passed straight through.
+    """
+    with phase(instrumentation.TEXT):
+        if "<" not in html and "&" not in html:
+            return html.strip()
+        extractor = _TextExtractor()
+        extractor.feed(html)
+        extractor.close()
+        return "".join(extractor.parts).strip()
+
+
+# The content types feedparser sanitizes, with sanitizing off they're done here for titles, which are kept as markup.
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+
+
+def _sanitized_title(element) -> str:
+    # feedparser has no public way in to its sanitizer, requirements.txt holds it to the releases this was checked on.
+    detail = element.get("title_detail", {})
+    if detail.get("type") in HTML_TYPES:
+        return fp.sanitizer._sanitize_html(element.get("title", ""), "utf-8", detail["type"])
+    return element.get("title", "")
+
+
 REQUIRED_FEED_ELEMENTS = ("title", "link")
 REQUIRED_ENTRY_ELEMENTS = ()
 
 
+@dataclass
+class FetchInfo:
+    latency: float = 0.0  # Seconds, the whole parse when the feed didn't come over HTTP.
+    size: int = 0  # Bytes of the response body after decompression.
+    reserved: int = 0  # Bytes of the budget passed to parse_feed held for this feed, for the caller to release.
+    status: int | None = None
+    fresh_for: timedelta | None = None  # How long the caching headers say the response stays fresh.
+
+
 class ResultType(Flag):
     NONE = 0
     PERMANENT_REDIRECT = auto()
@@ -34,7 +153,45 @@ class ResultType(Flag):
     AUTH_ERROR = auto()
 
 
-def parse_feed(feed_url: str, etag=None, modified=None):
+def error_result(e: Exception) -> tuple[ResultType, dict]:
+    """A parse_feed result for an exception, for the callers that run it to report rather than raise."""
+    return ResultType.ERROR, {"error": f"{e.__class__.__name__}: {str(e)}"}
+
+
+def describe_error(result_type: ResultType, results: dict) -> str | None:
+    """Return a message for a failed parse_feed result or None if it succeeded."""
+    if result_type & (ResultType.HTTP_ERROR | ResultType.AUTH_ERROR):
+        return f"{results['status'].phrase}, {results['status'].description}"
+    if ResultType.ERROR in result_type:
+        return results["error"]
+    return None
+
+
+def _fill_fetch_info(fetch_info: FetchInfo | None, started: float, feed: fp.FeedParserDict | None) -> None:
+    if fetch_info is None:
+        return
+    measured = _last_request.measured
+    if measured is None:
+        measured = perf_counter() - started, 0
+    fetch_info.latency, fetch_info.size = measured
+    fetch_info.reserved = _last_request.reserved
+    if feed is not None:
+        fetch_info.status = feed.get("status")
+        fetch_info.fresh_for = fetching.freshness_lifetime(feed.get("headers", {}))
+
+
+@instrumentation.timed(instrumentation.PARSE)
+def parse_feed(feed_url: str, etag=None, modified=None, fetch_info: FetchInfo | None = None,
+               budget: fetching.MemoryBudget | None = None, lean: bool = False, until: float | None = None):
+    """
+    Fetch and parse the feed at feed_url, which may also be a path or the feed itself.
+    fetch_info, if given, is filled in with how long the request took, its size and HTTP status.
+    budget, if given, is waited on for room to parse a fetched response in, fetch_info.reserved says how much.
+    lean skips feedparser's HTML sanitizing and relative URI resolution, which only change markup the results don't
+    keep, and gets the text out with _get_plain_text. HTML titles are still sanitized, as they keep their markup.
+    Texts can then differ in whitespace, nothing else.
+    until, a time.monotonic() value, is when the request has to be done by.
+    """
     # Make sure we aren't passing empty strings to fp.parse.
     if not etag:
         etag = None
@@ -44,11 +201,21 @@ def parse_feed(feed_url: str, etag=None, modified=None):
     results = dict()
     result_type = ResultType.NONE
 
+    _last_request.measured = None
+    _last_request.budget = budget
+    _last_request.until = until
+    _last_request.reserved = 0
+    started = perf_counter()
     try:
-        feed = fp.parse(feed_url, etag=etag, modified=modified)
+        if lean:
+            feed = fp.parse(feed_url, etag=etag, modified=modified, sanitize_html=False, resolve_relative_uris=False)
+        else:
+            feed = fp.parse(feed_url, etag=etag, modified=modified)
     except Exception as e:
+        _fill_fetch_info(fetch_info, started, None)
         results["error"] = f"{e.__class__.__name__}: {str(e)}"
         return ResultType.ERROR, results
+    _fill_fetch_info(fetch_info, started, feed)
 
     # we can not be modified and still have a HTTPStatus.FOUND or HTTPStatus.MOVED_PERMANENTLY
     # which will cause us to try to parse feed.feed anyway and fail.
@@ -66,6 +233,7 @@ def parse_feed(feed_url: str, etag=None, modified=None):
             return ResultType.AUTH_ERROR, results
         elif feed.status not in (HTTPStatus.OK, HTTPStatus.FOUND):
             results["status"] = HTTPStatus(feed.status)
+            results["retry_after"] = feed.get("headers", {}).get("retry-after")
             return ResultType.HTTP_ERROR, results
 
     # If we detected no modification had some other status besides HTTPStatus.NOT_MODIFIED
@@ -83,26 +251,34 @@ def parse_feed(feed_url: str, etag=None, modified=None):
         results["error"] = f"Required elements missing from feed data: {', '.join(x for x in REQUIRED_FEED_ELEMENTS if x not in f)}"
         return ResultType.ERROR, results
 
-    results["name"] = f.title
-    results["description"] = BeautifulSoup(f.get("description", ""), features="lxml").get_text()
+    get_title = _sanitized_title if lean else (lambda element: element.get("title", ""))
+    get_text = _get_plain_text if lean else _get_text
+    results["name"] = get_title(f)
+    results["description"] = get_text(f.get("description", ""))
     results["home_page"] = f.link
 
     results["url"] = feed_url if feed_url.startswith("http") else None
 
     results["entries"] = entry_results = []
     for e in entries:
+        # The link is what tells items apart, there is nothing to keep of one without it.
+        url = e.get("link")
+        if not url:
+            continue
         e_map = dict()
         timestamp = None
         if "published_parsed" in e:
             timestamp = datetime(*e.published_parsed[:6])
         e_map["timestamp"] = timestamp
-        e_map["title"] = e.title
+        # Titles are optional in RSS, the link stands in for a missing one.
+        e_map["title"] = get_title(e) or url
         if "summary" in e:
-            e_map["text"] = BeautifulSoup(e.summary, features="lxml").get_text()
-        e_map["url"] = e.link
+            e_map["text"] = get_text(e.summary)
+        e_map["url"] = url
 
-        if len(e.enclosures) > 0:
-            e_map["enclosure_url"] = e.enclosures[0].href
+        enclosures = e.get("enclosures", [])
+        if enclosures and enclosures[0].get("href"):
+            e_map["enclosure_url"] = enclosures[0].href
 
         entry_results.append(e_map)
     return result_type, results
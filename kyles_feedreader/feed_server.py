@@ -0,0 +1,228 @@
+# By Kyle Monson
+
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from email.utils import formatdate
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable
+from xml.sax.saxutils import escape
+
+
+_EPOCH = 1577836800  # 2020-01-01 UTC, synthetic item k is dated k hours later.
+_WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do", "eiusmod",
+          "tempor", "incididunt", "ut", "labore", "et", "dolore", "magna", "aliqua")
+
+
+@dataclass
+class FeedProfile:
+    """
+    How the synthetic feeds of a FeedServer behave. The rates are the share of feeds that redirect, fail
+    authentication or support ETags, except for error_rate, which is the share of requests answered with a 500.
+    """
+    items: int = 20
+    item_size: int = 500  # Characters of text per item.
+    latency: float = 0.0  # Seconds before each response.
+    latency_jitter: float = 0.0  # Up to this many more seconds, at random.
+    etag_rate: float = 1.0
+    redirect_rate: float = 0.0
+    auth_rate: float = 0.0
+    error_rate: float = 0.0
+    max_age: int | None = None  # Sent as Cache-Control max-age if set.
+    html_rate: float = 0.0  # Share of items whose text is HTML rather than plain text.
+    seed: int = 0
+
+
+@dataclass(frozen=True)
+class _Traits:
+    etag: bool
+    redirect: bool
+    auth: bool
+
+
+def _text(rng: random.Random, size: int) -> str:
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def _html(rng: random.Random, size: int) -> str:
+    # Paragraphs with the odd bold word and link, about size characters of text in all.
+    words = _text(rng, size).split(" ")
+    paragraphs = []
+    for start in range(0, len(words), 40):
+        marked = [f"<b>{word}</b>" if i % 9 == 4 else f'<a href="/{word}">{word}</a>' if i % 13 == 7 else word
+                  for i, word in enumerate(words[start:start + 40])]
+        paragraphs.append(f"<p>{' '.join(marked)} &amp;</p>")
+    return "\n".join(paragraphs)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.feed_server._handle(self)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    feed_server: "FeedServer"
+
+
+class FeedServer:
+    """
+    An HTTP server on localhost standing in for the feeds out on the internet, so updates can be tested and timed
+    offline. /feeds/<n> serves synthetic feed n shaped by profile and /files/<name> serves the recorded feed
+    directory/name. Bumping generation adds a new item to every synthetic feed and changes its ETag.
+    hosts above one spreads the synthetic feeds over that many loopback addresses, 127.0.0.1 and up, each standing
+    in for a host of its own. Linux routes all of 127/8 to the loopback interface, other systems may not.
+    Use it as a context manager or call start and stop.
+    """
+    def __init__(self, profile: FeedProfile | None = None, directory: str | Path | None = None,
+                 host: str = "127.0.0.1", port: int = 0, hosts: int = 1) -> None:
+        self.profile = profile or FeedProfile()
+        self.directory = None if directory is None else Path(directory)
+        self.generation = 0
+        self.statuses: Counter[int] = Counter()
+        self._lock = threading.Lock()
+        self._servers = [_Server((host, port), _Handler)]
+        port = self._servers[0].server_address[1]
+        self._servers.extend(_Server((f"127.0.0.{n}", port), _Handler) for n in range(2, hosts + 1))
+        for server in self._servers:
+            server.feed_server = self
+        self._threads: list[threading.Thread] = []
+
+    @staticmethod
+    def _url_of(server: _Server) -> str:
+        host, port = server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self) -> str:
+        return self._url_of(self._servers[0])
+
+    def url(self, n: int) -> str:
+        return f"{self._url_of(self._servers[n % len(self._servers)])}/feeds/{n}"
+
+    def file_url(self, name: str) -> str:
+        return f"{self.base_url}/files/{name}"
+
+    def start(self) -> "FeedServer":
+        for server in self._servers:
+            thread = threading.Thread(target=server.serve_forever, name="feed-server", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self) -> None:
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self) -> "FeedServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def traits(self, n: int) -> _Traits:
+        profile = self.profile
+        rng = random.Random(f"{profile.seed}:{n}")
+        return _Traits(etag=rng.random() < profile.etag_rate,
+                       redirect=rng.random() < profile.redirect_rate,
+                       auth=rng.random() < profile.auth_rate)
+
+    def feed_document(self, n: int, generation: int | None = None) -> bytes:
+        """The RSS document feed n serves at generation, the current one by default."""
+        profile = self.profile
+        if generation is None:
+            generation = self.generation
+        rng = random.Random(f"{profile.seed}:{n}:text")
+        base = self.url(n)
+        parts = [f'<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0"><channel>'
+                 f"<title>Feed {n}</title><link>{base}/home</link><description>Synthetic feed {n}</description>"]
+        for k in range(generation + profile.items - 1, generation - 1, -1):
+            parts.append(f"<item><title>Item {k} of feed {n}</title><link>{base}/items/{k}</link>"
+                         f"<guid>{base}/items/{k}</guid><pubDate>{formatdate(_EPOCH + k * 3600, usegmt=True)}"
+                         f"</pubDate><description>{escape(self._item_text(rng))}</description></item>")
+        parts.append("</channel></rss>")
+        return "".join(parts).encode()
+
+    def _item_text(self, rng: random.Random) -> str:
+        profile = self.profile
+        if profile.html_rate and rng.random() < profile.html_rate:
+            return _html(rng, profile.item_size)
+        return _text(rng, profile.item_size)
+
+    def _respond(self, handler: _Handler, status: HTTPStatus, headers: dict[str, str] | None = None,
+                 body: bytes = b"") -> None:
+        with self._lock:
+            self.statuses[status] += 1
+        handler.send_response(status)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        if body:
+            handler.wfile.write(body)
+
+    def _handle(self, handler: _Handler) -> None:
+        profile = self.profile
+        delay = profile.latency + random.uniform(0, profile.latency_jitter)
+        if delay:
+            time.sleep(delay)
+        if profile.error_rate and random.random() < profile.error_rate:
+            self._respond(handler, HTTPStatus.INTERNAL_SERVER_ERROR)
+            return
+
+        match = re.fullmatch(r"/(feeds|moved)/(\d+)", handler.path)
+        if match is not None:
+            kind, n = match.group(1), int(match.group(2))
+            traits = self.traits(n)
+            if traits.auth:
+                self._respond(handler, HTTPStatus.UNAUTHORIZED, {"WWW-Authenticate": 'Basic realm="feeds"'})
+            elif traits.redirect and kind == "feeds":
+                self._respond(handler, HTTPStatus.MOVED_PERMANENTLY,
+                              {"Location": f"{self._url_of(handler.server)}/moved/{n}"})
+            else:
+                generation = self.generation
+                etag = f'"{n}-{generation}"' if traits.etag else None
+                self._serve(handler, etag, lambda: self.feed_document(n, generation))
+            return
+
+        match = re.fullmatch(r"/files/([^/]+)", handler.path)
+        if match is not None and self.directory is not None and (self.directory / match.group(1)).is_file():
+            body = (self.directory / match.group(1)).read_bytes()
+            self._serve(handler, f'"{hashlib.sha1(body).hexdigest()}"', lambda: body)
+            return
+
+        self._respond(handler, HTTPStatus.NOT_FOUND)
+
+    def _serve(self, handler: _Handler, etag: str | None, body: Callable[[], bytes]) -> None:
+        headers = {}
+        if etag is not None:
+            headers["ETag"] = etag
+            if handler.headers.get("If-None-Match") == etag:
+                self._respond(handler, HTTPStatus.NOT_MODIFIED, headers)
+                return
+        if self.profile.max_age is not None:
+            headers["Cache-Control"] = f"max-age={self.profile.max_age}"
+        headers["Content-Type"] = "application/rss+xml; charset=utf-8"
+        self._respond(handler, HTTPStatus.OK, headers, body())
@@ -0,0 +1,54 @@
+# By Kyle Monson
+
+import os
+import pathlib
+from typing import Callable, Iterable
+
+from .db_interface import FeedStats
+
+
+RANKINGS: dict[str, Callable[[FeedStats], float]] = {
+    "time": lambda s: s.latency,
+    "bytes": lambda s: s.size,
+    "errors": lambda s: s.error_rate,
+    "wasted": lambda s: s.wasted,
+}
+
+# Name, type, help and value of every metric written for each feed.
+_METRICS: tuple[tuple[str, str, str, Callable[[FeedStats], float]], ...] = (
+    ("kfr_feed_fetches", "gauge", "Refreshes of the feed kept in the stats table.", lambda s: s.fetches),
+    ("kfr_feed_fetch_seconds", "gauge", "Time spent fetching the feed over the kept refreshes.", lambda s: s.latency),
+    ("kfr_feed_fetch_bytes", "gauge", "Bytes downloaded for the feed over the kept refreshes.", lambda s: s.size),
+    ("kfr_feed_fetch_errors", "gauge", "Kept refreshes of the feed that failed.", lambda s: s.errors),
+    ("kfr_feed_fetch_not_modified", "gauge", "Kept refreshes of the feed the server answered with not modified.",
+     lambda s: s.not_modified),
+    ("kfr_feed_fetch_wasted", "gauge", "Kept refreshes of the feed that downloaded it without finding new items.",
+     lambda s: s.wasted),
+    ("kfr_feed_new_items", "gauge", "Items the kept refreshes of the feed added.", lambda s: s.new_items),
+)
+
+
+def rank(stats: Iterable[FeedStats], by: str) -> list[FeedStats]:
+    """Sort stats worst first by one of RANKINGS."""
+    return sorted(stats, key=RANKINGS[by], reverse=True)
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def write_prometheus(stats: Iterable[FeedStats], path: str | pathlib.Path) -> None:
+    """
+    Write stats in the Prometheus text format for the node exporter's textfile collector. The file is written next
+    to path and moved into place so the collector never reads a partial file.
+    """
+    stats = list(stats)
+    path = pathlib.Path(path)
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, "w") as f:
+        for name, kind, help_text, value in _METRICS:
+            f.write(f"# HELP {name} {help_text}\n")
+            f.write(f"# TYPE {name} {kind}\n")
+            for s in stats:
+                f.write(f'{name}{{feed="{_label(s.name)}",url="{_label(s.url)}"}} {value(s)}\n')
+    os.replace(temp_path, path)
@@ -0,0 +1,332 @@
+# By Kyle Monson
+
+import contextlib
+import datetime
+import email.utils
+import http.client
+import itertools
+import socket
+import threading
+import urllib.request
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from time import monotonic, sleep
+from typing import Callable, Iterable, Iterator, TypeVar
+from urllib.parse import urlsplit
+
+from .defaults import dns_cache_ttl, host_concurrency, host_interval, max_feed_size, max_freshness, update_memory
+
+
+FETCH_LOOKAHEAD = 1024  # Items read ahead of the ones being fetched, to find other hosts when the first ones are busy.
+PARSE_OVERHEAD = 5  # Memory parsing a feed takes at its peak, as a multiple of the feed's size.
+FEED_OVERHEAD = 256 * 1024  # Bytes a parsed feed takes whatever its size.
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def host_of(url: str) -> str | None:
+    """The host a feed URL points at, None for paths and feed documents passed in directly."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        return None
+    return parts.hostname
+
+
+def parse_http_date(value: str | None) -> datetime.datetime | None:
+    """Parse an HTTP date header into a naive UTC datetime, None if it isn't one."""
+    if not value:
+        return None
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is not None:
+        when = when.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return when
+
+
+def freshness_lifetime(headers: dict[str, str], maximum: datetime.timedelta = max_freshness
+                       ) -> datetime.timedelta | None:
+    """
+    How much longer a response with these lowercased headers stays fresh according to Cache-Control max-age, less
+    its Age, or Expires, the way a private cache reads them. None if it has to be revalidated right away. Capped at
+    maximum so a misconfigured server can't stop a feed from updating for months.
+    """
+    directives = {}
+    for directive in headers.get("cache-control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name.lower()] = value.strip('"')
+    if "no-store" in directives or "no-cache" in directives:
+        return None
+
+    if directives.get("max-age", "").isdigit():
+        lifetime = datetime.timedelta(seconds=int(directives["max-age"]))
+        age = headers.get("age", "")
+        if age.isdigit():
+            lifetime -= datetime.timedelta(seconds=int(age))
+    else:
+        expires = parse_http_date(headers.get("expires"))
+        if expires is None:
+            # Expires values that aren't a date, like 0, mean already expired.
+            return None
+        date = parse_http_date(headers.get("date")) or datetime.datetime.utcnow()
+        lifetime = expires - date
+
+    if lifetime <= datetime.timedelta():
+        return None
+    return min(lifetime, maximum)
+
+
+class DNSCache:
+    """Remembers what each host resolved to for ttl seconds so feeds on the same host share one lookup."""
+    def __init__(self, ttl: float = dns_cache_ttl) -> None:
+        self.ttl = ttl
+        self._entries: dict[tuple[str, int], tuple[float, list]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int) -> list:
+        key = (host, port)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > monotonic():
+            return entry[1]
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, infos)
+        return infos
+
+    def create_connection(self, address: tuple[str, int], timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                          source_address=None) -> socket.socket:
+        """Drop in for socket.create_connection that resolves through the cache."""
+        host, port = address
+        error = None
+        for *_, sockaddr in self.resolve(host, port):
+            try:
+                return socket.create_connection(sockaddr[:2], timeout, source_address)
+            except OSError as e:
+                error = e
+        raise error if error is not None else OSError(f"No addresses for {host}")
+
+
+class HostLimiter:
+    """Caps the requests in flight to each host and spaces out the start of requests to the same host."""
+    def __init__(self, max_in_flight: int = host_concurrency, min_interval: float = host_interval) -> None:
+        self.max_in_flight = max_in_flight
+        self.min_interval = min_interval
+        self._slots: dict[str, threading.BoundedSemaphore] = {}
+        self._next_start: dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def slot(self, host: str | None) -> Iterator[None]:
+        """Wait for a turn to send a request to host."""
+        if host is None:
+            yield
+            return
+        with self._lock:
+            semaphore = self._slots.get(host)
+            if semaphore is None:
+                semaphore = self._slots[host] = threading.BoundedSemaphore(self.max_in_flight)
+        with semaphore:
+            with self._lock:
+                now = monotonic()
+                start = max(now, self._next_start[host])
+                self._next_start[host] = start + self.min_interval
+            if start > now:
+                sleep(start - now)
+            yield
+
+
+def parsed_size(size: int) -> int:
+    """Bytes to set aside for a feed response of size bytes until what was parsed from it is written."""
+    return FEED_OVERHEAD + PARSE_OVERHEAD * size if size else 0
+
+
+class MemoryBudget:
+    """
+    Bytes of fetched feeds an update allows in memory at once, as parsed_size estimates them from the size of the
+    responses, which bounds what the update buffers rather than the memory of the whole process. Fetches acquire
+    room for a response once it is downloaded and before it is parsed, and the writer releases it once the feed is
+    written, so fetches wait while the writer catches up. Room is always given when nothing is held, so a feed
+    bigger than the whole budget still goes through, on its own. Once closed nothing waits, for fetches left
+    running by a writer that stopped early.
+    """
+    def __init__(self, limit: int = update_memory) -> None:
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self.waits = 0
+        self.closed = False
+        self._room = threading.Condition()
+
+    def acquire(self, size: int) -> None:
+        with self._room:
+            if self.used and self.used + size > self.limit and not self.closed:
+                self.waits += 1
+                self._room.wait_for(lambda: not self.used or self.used + size <= self.limit or self.closed)
+            self.used += size
+            self.peak = max(self.peak, self.used)
+
+    def release(self, size: int) -> None:
+        with self._room:
+            self.used -= size
+            self._room.notify_all()
+
+    def close(self) -> None:
+        with self._room:
+            self.closed = True
+            self._room.notify_all()
+
+
+dns_cache = DNSCache()
+limiter = HostLimiter()
+max_size = max_feed_size
+
+
+def configure(max_in_flight: int = host_concurrency, min_interval: float = host_interval,
+              max_response: int = max_feed_size) -> None:
+    """Replace the limiter every fetch goes through and set the largest response a fetch reads."""
+    global limiter, max_size
+    limiter = HostLimiter(max_in_flight, min_interval)
+    max_size = max_response
+
+
+class _CachedHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = dns_cache.create_connection
+
+
+class _CachedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = dns_cache.create_connection
+
+
+class _CachedHTTPHandler(urllib.request.HTTPHandler):
+    timeout: float | None = None
+
+    def http_open(self, req):
+        if self.timeout is not None:
+            req.timeout = self.timeout
+        return self.do_open(_CachedHTTPConnection, req)
+
+
+class _CachedHTTPSHandler(urllib.request.HTTPSHandler):
+    timeout: float | None = None
+
+    def https_open(self, req):
+        if self.timeout is not None:
+            req.timeout = self.timeout
+        return self.do_open(_CachedHTTPSConnection, req, context=self._context)
+
+
+class _SizeLimitHandler(urllib.request.BaseHandler):
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+
+    def http_response(self, request, response):
+        read = response.read
+        limit = self.limit
+
+        def limited_read(amount=None):
+            # Reading one byte past the limit tells a response that is too big without holding any more of it.
+            if amount is not None:
+                return read(amount)
+            data = read(limit + 1)
+            if len(data) > limit:
+                raise ValueError(f"Response is over {limit} bytes")
+            return data
+
+        response.read = limited_read
+        return response
+
+    https_response = http_response
+
+
+def connection_handlers(timeout: float | None = None) -> list[urllib.request.BaseHandler]:
+    """
+    urllib handlers that take the place of the default HTTP and HTTPS ones to resolve through dns_cache, and stop
+    reading a response at max_size. timeout, if given, is the requests' socket timeout instead of none at all.
+    """
+    http_handler, https_handler = _CachedHTTPHandler(), _CachedHTTPSHandler()
+    http_handler.timeout = https_handler.timeout = timeout
+    return [http_handler, https_handler, _SizeLimitHandler(max_size)]
+
+
+def fetch_all(items: Iterable[T], url_of: Callable[[T], str], fetch: Callable[[T], R], concurrency: int,
+              per_host: int | None = None, lookahead: int = FETCH_LOOKAHEAD,
+              until: float | None = None) -> Iterator[tuple[T, R]]:
+    """
+    Run fetch on each item in a pool of concurrency threads and yield the items with their results as they finish.
+
+    Items are handed out round robin across hosts and no host gets more than per_host, the limiter's cap by default,
+    at once. A big host then can't tie up every worker waiting for a turn while other hosts sit idle.
+
+    items is read as it goes, no more than lookahead of them ahead of the ones started, so it can be a generator
+    over more items than should be held at once. At most concurrency results wait for the caller, the rest aren't
+    started until it takes them.
+
+    until, a time.monotonic() value, ends it then: nothing is started after it and the fetches still running are
+    left to finish on their own, their results dropped. The same goes when the caller stops early.
+    """
+    if per_host is None:
+        per_host = limiter.max_in_flight
+    source = iter(items)
+    queues: dict[str | None, deque[T]] = {}
+    hosts: deque[str | None] = deque()  # The hosts with items queued, in the order they get their next turn.
+    queued = 0
+    in_flight: dict[str | None, int] = defaultdict(int)
+
+    def pull():
+        nonlocal queued
+        for item in itertools.islice(source, lookahead - queued):
+            host = host_of(url_of(item))
+            if host not in queues:
+                queues[host] = deque()
+                hosts.append(host)
+            queues[host].append(item)
+            queued += 1
+
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    futures: dict[Future, tuple[str | None, T]] = {}
+
+    def fill():
+        nonlocal queued
+        if until is not None and monotonic() >= until:
+            return
+        waiting = 0
+        pull()
+        while hosts and waiting < len(hosts) and len(futures) < concurrency:
+            host = hosts.popleft()
+            if host is not None and in_flight[host] >= per_host:
+                hosts.append(host)
+                waiting += 1
+                continue
+            waiting = 0
+            item = queues[host].popleft()
+            if queues[host]:
+                hosts.append(host)
+            else:
+                del queues[host]
+            queued -= 1
+            in_flight[host] += 1
+            futures[pool.submit(fetch, item)] = (host, item)
+            pull()
+
+    try:
+        fill()
+        while futures:
+            timeout = None if until is None else until - monotonic()
+            if timeout is not None and timeout <= 0:
+                return
+            done, _ = wait(futures, timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                # Drop the future so its result is freed once the caller is done with it.
+                host, item = futures.pop(future)
+                in_flight[host] -= 1
+                yield item, future.result()
+            fill()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,153 @@
+# By Kyle Monson
+
+import bisect
+import contextlib
+import functools
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Callable, Iterator, TypeVar
+
+
+FETCH = "fetch"
+WAIT = "host-wait"  # Waiting for a turn at a busy host.
+MEMORY = "memory-wait"  # Waiting for room in an update's memory budget.
+PARSE = "parse"
+TEXT = "text-extract"
+DATE = "date-parse"
+DB = "db-write"
+PHASES = (WAIT, MEMORY, FETCH, PARSE, TEXT, DATE, DB)
+
+# Upper bounds in seconds of the per-feed histogram buckets, the last bucket takes everything slower.
+HISTOGRAM_BOUNDS = (0.01, 0.03, 0.1, 0.3, 1.0, 3.0)
+
+F = TypeVar("F", bound=Callable)
+
+
+@dataclass
+class PhaseStats:
+    total: float = 0.0
+    histogram: list[int] = field(default_factory=lambda: [0] * (len(HISTOGRAM_BOUNDS) + 1))
+
+    def add(self, seconds: float) -> None:
+        self.total += seconds
+        self.histogram[bisect.bisect_left(HISTOGRAM_BOUNDS, seconds)] += 1
+
+
+class Recorder:
+    """
+    Collects how long each phase takes. Phases nest and time is charged exclusively, so a date parse inside
+    feedparser's parse only counts towards the date phase. Time spent inside feed() is totalled per feed and added
+    to the histograms when the feed is done; outside any feed each outermost phase counts once.
+    Safe to use from several threads.
+    """
+    def __init__(self) -> None:
+        self.phases: dict[str, PhaseStats] = defaultdict(PhaseStats)
+        self.feeds: dict[str, dict[str, float]] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _add(self, times: dict[str, float]) -> None:
+        with self._lock:
+            for name, seconds in times.items():
+                self.phases[name].add(seconds)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        local = self._local
+        stack = getattr(local, "stack", None)
+        if stack is None:
+            stack = local.stack = []
+        outermost = getattr(local, "current", None) is None
+        if outermost:
+            local.current = defaultdict(float)
+        times = local.current
+        now = perf_counter()
+        if stack:
+            times[stack[-1]] += now - local.mark
+        stack.append(name)
+        local.mark = now
+        try:
+            yield
+        finally:
+            now = perf_counter()
+            times[stack.pop()] += now - local.mark
+            local.mark = now
+            if outermost:
+                local.current = None
+                self._add(times)
+
+    @contextlib.contextmanager
+    def feed(self, key: str) -> Iterator[None]:
+        local = self._local
+        local.current = times = defaultdict(float)
+        try:
+            yield
+        finally:
+            local.current = None
+            with self._lock:
+                # A feed can be timed in more than one go, say fetched on a worker and written on the main thread.
+                totals = self.feeds.setdefault(key, {})
+                for name, seconds in times.items():
+                    totals[name] = totals.get(name, 0.0) + seconds
+            self._add(times)
+
+    def report(self, slowest: int = 5) -> Iterator[str]:
+        """Yield the lines of a human readable breakdown."""
+        grand_total = sum(s.total for s in self.phases.values())
+        bounds = [f"<{b * 1000:g}ms" for b in HISTOGRAM_BOUNDS] + [f">={HISTOGRAM_BOUNDS[-1] * 1000:g}ms"]
+        yield f"{'phase':<14}{'total':>10}{'share':>8}  " + " ".join(f"{b:>8}" for b in bounds)
+        names = [p for p in PHASES if p in self.phases] + sorted(set(self.phases) - set(PHASES))
+        for name in names:
+            stats = self.phases[name]
+            share = stats.total / grand_total if grand_total else 0.0
+            yield (f"{name:<14}{stats.total:>9.3f}s{share:>8.1%}  " +
+                   " ".join(f"{count:>8}" for count in stats.histogram))
+        yield f"{'total':<14}{grand_total:>9.3f}s"
+
+        by_time = sorted(self.feeds.items(), key=lambda kv: sum(kv[1].values()), reverse=True)[:slowest]
+        if by_time:
+            yield "slowest feeds:"
+        for key, times in by_time:
+            phases = ", ".join(f"{n} {t:.3f}s" for n, t in sorted(times.items(), key=lambda kv: -kv[1]))
+            yield f"  {sum(times.values()):.3f}s {key} ({phases})"
+
+
+_recorder: Recorder | None = None
+_off = contextlib.nullcontext()
+
+
+def start() -> Recorder:
+    global _recorder
+    _recorder = Recorder()
+    return _recorder
+
+
+def stop() -> Recorder | None:
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+def phase(name: str) -> contextlib.AbstractContextManager:
+    """Time the enclosed block as phase name. Costs a global lookup when instrumentation is off."""
+    return _off if _recorder is None else _recorder.phase(name)
+
+
+def feed(key: str) -> contextlib.AbstractContextManager:
+    """Attribute phases timed in the enclosed block on this thread to the feed key."""
+    return _off if _recorder is None else _recorder.feed(key)
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Decorator that times each call as phase name."""
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            with _recorder.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,39 @@
+# By Kyle Monson
+
+import csv
+from typing import Any, TextIO
+
+from .db_interface import DBInterface, FeedItemHandle, ITEM_ROW_COLUMNS
+
+
+def export_ndjson(db: DBInterface, output: TextIO, **filters: Any) -> FeedItemHandle | None:
+    """
+    Write one JSON object per item matching filters, which are passed to DBInterface.iter_item_json.
+    Returns the ID of the last item written.
+    """
+    last_id = None
+    write = output.write
+    for last_id, line in db.iter_item_json(**filters):
+        write(line)
+        write("\n")
+    return last_id
+
+
+def export_csv(db: DBInterface, output: TextIO, **filters: Any) -> FeedItemHandle | None:
+    """
+    Write a header line followed by one line per item matching filters, which are passed to
+    DBInterface.iter_item_rows. Returns the ID of the last item written.
+    """
+    last_id = None
+    writer = csv.writer(output)
+    writer.writerow(ITEM_ROW_COLUMNS)
+    for row in db.iter_item_rows(**filters):
+        writer.writerow(row)
+        last_id = row[0]
+    return last_id
+
+
+EXPORTERS = {
+    "ndjson": export_ndjson,
+    "csv": export_csv,
+}
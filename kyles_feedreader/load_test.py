@@ -0,0 +1,125 @@
+# By Kyle Monson
+
+import pathlib
+import tempfile
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Callable
+
+from . import fetching, sharding, updater
+from .feed_parsing import parse_feed
+from .db_interface import DBInterface
+from .defaults import lean_parse, update_concurrency, update_memory
+from .feed_server import FeedProfile, FeedServer
+
+
+ADD_BATCH_SIZE = 1000
+
+
+@dataclass
+class PassResult:
+    number: int
+    seconds: float
+    report: updater.UpdateReport
+
+    @property
+    def feeds_per_second(self) -> float:
+        return self.report.fetched / self.seconds if self.seconds else 0.0
+
+    @property
+    def items_per_second(self) -> float:
+        return self.report.new_items / self.seconds if self.seconds else 0.0
+
+
+def _feed_urls(server: FeedServer, feeds: int, recorded: pathlib.Path | None) -> list[str]:
+    if recorded is None:
+        return [server.url(n) for n in range(feeds)]
+    names = sorted(p.name for p in recorded.iterdir() if p.is_file())
+    return [server.file_url(name) for name in names[:feeds]]
+
+
+def run_update_benchmark(feeds: int = 100, profile: FeedProfile | None = None, passes: int = 2,
+                         concurrency: int = update_concurrency, churn: bool = False,
+                         recorded: str | pathlib.Path | None = None, db_path: str | pathlib.Path | None = None,
+                         progress: Callable[[PassResult], None] | None = None, processes: int = 1,
+                         hosts: int = 1, memory: int = update_memory, lean: bool = lean_parse) -> list[PassResult]:
+    """
+    Time updating feeds served by a local FeedServer into a fresh database, the first pass empty and later ones
+    exercising ETags and 304s. churn gives every synthetic feed a new item before each later pass. recorded serves the
+    files in that directory instead of synthetic feeds. The db goes in a temporary directory unless db_path is given.
+    processes other than 1 updates through sharding.update_feeds_sharded, 0 meaning one per core, and hosts spreads
+    the synthetic feeds over that many loopback addresses for it to split them by. memory and lean are passed on to
+    the update. Nothing leaves the machine.
+    """
+    recorded = None if recorded is None else pathlib.Path(recorded)
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir, FeedServer(profile, recorded, hosts=hosts) as server:
+        db = DBInterface(db_path or pathlib.Path(temp_dir) / "bench.sqlite")
+        urls = _feed_urls(server, feeds, recorded)
+        for start in range(0, len(urls), ADD_BATCH_SIZE):
+            db.add_feeds({"name": url, "url": url, "home_page": url, "group_data": db.root_group}
+                         for url in urls[start:start + ADD_BATCH_SIZE])
+        # Every feed lives on the one local host, so the per host limits would turn this into a benchmark of them.
+        fetching.configure(max_in_flight=concurrency, min_interval=0)
+        try:
+            for number in range(1, passes + 1):
+                if churn and number > 1:
+                    server.generation += 1
+                started = perf_counter()
+                if processes == 1:
+                    report = updater.update_feeds(db, concurrency=concurrency, ignore_cache=True, memory=memory,
+                                                  lean=lean)
+                else:
+                    report = sharding.update_feeds_sharded(db, workers=processes or None, concurrency=concurrency,
+                                                           per_host=concurrency, interval=0, ignore_cache=True,
+                                                           memory=memory, lean=lean)
+                result = PassResult(number, perf_counter() - started, report)
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+        finally:
+            fetching.configure()
+            db.db.disconnect()
+    return results
+
+
+@dataclass
+class ParseResult:
+    lean: bool
+    feeds: int
+    seconds: float  # The best of the runs.
+
+    @property
+    def feeds_per_second(self) -> float:
+        return self.feeds / self.seconds if self.seconds else 0.0
+
+
+def run_parse_benchmark(feeds: int = 100, profile: FeedProfile | None = None,
+                        recorded: str | pathlib.Path | None = None, repeat: int = 3) -> list[ParseResult]:
+    """
+    Time parse_feed on the same feeds in its full mode and its lean one, best of repeat runs each. The feeds are
+    synthetic ones written out from a FeedServer's profile, or the files in recorded, parsed from disk so no
+    fetching is timed.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if recorded is None:
+            paths = []
+            with FeedServer(profile) as server:
+                for n in range(feeds):
+                    path = pathlib.Path(temp_dir) / f"{n}.xml"
+                    path.write_bytes(server.feed_document(n))
+                    paths.append(str(path))
+        else:
+            paths = sorted(str(p) for p in pathlib.Path(recorded).iterdir() if p.is_file())[:feeds]
+
+        results = []
+        for lean in (False, True):
+            best = None
+            for _ in range(repeat):
+                started = perf_counter()
+                for path in paths:
+                    parse_feed(path, lean=lean)
+                seconds = perf_counter() - started
+                best = seconds if best is None else min(best, seconds)
+            results.append(ParseResult(lean, len(paths), best))
+    return results
@@ -0,0 +1,183 @@
+# By Kyle Monson
+
+import datetime
+import sqlite3
+from dataclasses import dataclass
+from typing import Callable, Sequence
+
+from pony import orm
+
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    A versioned schema change.
+
+    upgrade runs in its own transaction before Pony maps the entities, so it can add the columns, tables and indexes
+    the current model expects to an existing database.
+
+    backfill, if given, is called with the ID of the last row it processed and a batch size and returns the last row
+    ID of the batch it handled, or None once nothing is left. Every batch commits on its own and the position is
+    recorded with it, so an interrupted backfill picks up where it stopped.
+    """
+    version: int
+    name: str
+    upgrade: Callable[[sqlite3.Connection], None]
+    backfill: Callable[[sqlite3.Connection, int, int], int | None] | None = None
+
+
+@dataclass
+class MigrationStatus:
+    version: int
+    name: str
+    applied_at: datetime.datetime | None
+    backfill_position: int | None  # None when there is no backfill left to run.
+
+    @property
+    def applied(self) -> bool:
+        return self.applied_at is not None
+
+
+def _create_query_indexes(connection: sqlite3.Connection) -> None:
+    # Names match the ones Pony gives the composite indexes in db_model so it sees them as existing.
+    connection.execute('CREATE INDEX IF NOT EXISTS "idx_feeditem__feed_read_timestamp" '
+                       'ON "FeedItem" ("feed", "read", "timestamp")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "idx_feeditem__feed_viewed" ON "FeedItem" ("feed", "viewed")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "idx_feed__group_name" ON "Feed" ("group", "name")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "idx_rootgroup__parent_name" ON "RootGroup" ("parent", "name")')
+
+
+def _create_fetch_stats(connection: sqlite3.Connection) -> None:
+    connection.execute('CREATE TABLE IF NOT EXISTS "FeedFetch" ('
+                       '"id" INTEGER PRIMARY KEY AUTOINCREMENT, '
+                       '"feed" INTEGER NOT NULL REFERENCES "Feed" ("id") ON DELETE CASCADE, '
+                       '"timestamp" DATETIME NOT NULL, '
+                       '"latency" REAL NOT NULL, '
+                       '"size" INTEGER NOT NULL, '
+                       '"status" INTEGER, '
+                       '"not_modified" BOOLEAN NOT NULL, '
+                       '"error" BOOLEAN NOT NULL, '
+                       '"new_items" INTEGER NOT NULL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS "idx_feedfetch__feed_id" ON "FeedFetch" ("feed", "id")')
+
+
+def _add_column(connection: sqlite3.Connection, table: str, column: str, definition: str) -> None:
+    # SQLite has no ADD COLUMN IF NOT EXISTS, and like the other upgrades this has to be safe to run twice.
+    columns = {row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')}
+    if column not in columns:
+        connection.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}')
+
+
+def _add_feed_failure_state(connection: sqlite3.Connection) -> None:
+    _add_column(connection, "Feed", "failures", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(connection, "Feed", "retry_at", "DATETIME")
+    _add_column(connection, "Feed", "disabled", "BOOLEAN NOT NULL DEFAULT 0")
+    _add_column(connection, "Feed", "last_error", "TEXT")
+
+
+def _add_feed_fresh_until(connection: sqlite3.Connection) -> None:
+    _add_column(connection, "Feed", "fresh_until", "DATETIME")
+
+
+def _add_feed_priority(connection: sqlite3.Connection) -> None:
+    _add_column(connection, "Feed", "priority", "INTEGER NOT NULL DEFAULT 0")
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "query indexes", _create_query_indexes),
+    Migration(2, "fetch statistics", _create_fetch_stats),
+    Migration(3, "feed failure state", _add_feed_failure_state),
+    Migration(4, "feed freshness", _add_feed_fresh_until),
+    Migration(5, "feed priority", _add_feed_priority),
+]
+
+
+def _ensure_migration_table(connection: sqlite3.Connection) -> None:
+    connection.execute('CREATE TABLE IF NOT EXISTS "SchemaMigration" ('
+                       '"version" INTEGER PRIMARY KEY, '
+                       '"name" TEXT NOT NULL, '
+                       '"applied_at" TEXT NOT NULL, '
+                       '"backfill_position" INTEGER)')
+
+
+def _is_new_database(connection: sqlite3.Connection) -> bool:
+    row = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Feed'").fetchone()
+    return row is None
+
+
+def _applied_versions(connection: sqlite3.Connection) -> dict[int, tuple[str, int | None]]:
+    rows = connection.execute('SELECT "version", "applied_at", "backfill_position" FROM "SchemaMigration"')
+    return {version: (applied_at, position) for version, applied_at, position in rows}
+
+
+def _record(connection: sqlite3.Connection, migration: Migration, backfill_position: int | None) -> None:
+    applied_at = datetime.datetime.utcnow().isoformat(" ")
+    connection.execute('INSERT INTO "SchemaMigration" ("version", "name", "applied_at", "backfill_position") '
+                       'VALUES (?, ?, ?, ?)', (migration.version, migration.name, applied_at, backfill_position))
+
+
+def apply_migrations(db: orm.Database, migrations: Sequence[Migration] = MIGRATIONS) -> list[Migration]:
+    """
+    Apply every migration not yet recorded in the database, oldest first, each in its own transaction.
+    Must be called after binding and before generate_mapping. Returns the migrations that were applied.
+    """
+    migrations = sorted(migrations, key=lambda m: m.version)
+    with orm.db_session:
+        connection = db.get_connection()
+        new_database = _is_new_database(connection)
+        _ensure_migration_table(connection)
+        applied = _applied_versions(connection)
+        if new_database:
+            # generate_mapping creates the current schema, so there is nothing to upgrade or backfill.
+            for migration in migrations:
+                if migration.version not in applied:
+                    _record(connection, migration, None)
+            return []
+
+    pending = [m for m in migrations if m.version not in applied]
+    for migration in pending:
+        with orm.db_session:
+            connection = db.get_connection()
+            migration.upgrade(connection)
+            _record(connection, migration, None if migration.backfill is None else 0)
+    return pending
+
+
+def run_backfills(db: orm.Database, migrations: Sequence[Migration] = MIGRATIONS,
+                  batch_size: int = BACKFILL_BATCH_SIZE,
+                  progress: Callable[[Migration, int | None], None] | None = None) -> None:
+    """Run outstanding backfills to completion one batch per transaction, calling progress after each batch."""
+    by_version = {m.version: m for m in migrations}
+    with orm.db_session:
+        applied = _applied_versions(db.get_connection())
+
+    for version, (_, position) in sorted(applied.items()):
+        migration = by_version.get(version)
+        if position is None or migration is None or migration.backfill is None:
+            continue
+        while position is not None:
+            with orm.db_session:
+                connection = db.get_connection()
+                position = migration.backfill(connection, position, batch_size)
+                connection.execute('UPDATE "SchemaMigration" SET "backfill_position" = ? WHERE "version" = ?',
+                                   (position, version))
+            if progress is not None:
+                progress(migration, position)
+
+
+def migration_status(db: orm.Database, migrations: Sequence[Migration] = MIGRATIONS) -> list[MigrationStatus]:
+    with orm.db_session:
+        connection = db.get_connection()
+        _ensure_migration_table(connection)
+        applied = _applied_versions(connection)
+
+    result = []
+    for migration in sorted(migrations, key=lambda m: m.version):
+        applied_at, position = applied.get(migration.version, (None, None))
+        if applied_at is not None:
+            applied_at = datetime.datetime.fromisoformat(applied_at)
+        result.append(MigrationStatus(migration.version, migration.name, applied_at, position))
+    return result
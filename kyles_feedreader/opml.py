@@ -0,0 +1,169 @@
+# By Kyle Monson
+
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+import email.utils
+from typing import Any, BinaryIO, Callable
+
+from lxml import etree
+
+from .db_interface import DBInterface, GroupData
+from .defaults import import_concurrency
+from .feed_parsing import parse_feed, describe_error, error_result, ResultType
+from . import fetching, instrumentation
+
+
+IMPORT_BATCH_SIZE = 50
+
+
+@dataclass
+class OutlineFeed:
+    url: str
+    name: str | None
+    path: tuple[str, ...]
+
+
+@dataclass
+class ImportReport:
+    groups: int = 0
+    added: list[str] = field(default_factory=list)
+    existing: list[str] = field(default_factory=list)
+    failed: list[tuple[str, str]] = field(default_factory=list)
+
+
+def read_outlines(file_path: str) -> tuple[list[tuple[str, ...]], list[OutlineFeed]]:
+    """Return the group paths and feeds of an OPML file in document order."""
+    groups = []
+    feeds = []
+
+    def walk(element, path: tuple[str, ...]):
+        for c in element.iterfind("outline"):
+            # text is required, but some exporters only write title.
+            name = c.attrib.get("text") or c.attrib.get("title")
+            url = c.attrib.get("xmlUrl")
+            if url:
+                feeds.append(OutlineFeed(url, name, path))
+            elif name:
+                new_path = path + (name,)
+                groups.append(new_path)
+                walk(c, new_path)
+            else:
+                # A group with no name to make can still hold feeds, they go in the one it's in.
+                walk(c, path)
+
+    root = etree.parse(file_path).getroot()
+    for body in root.iterfind("./body"):
+        walk(body, ())
+    return groups, feeds
+
+
+def _fetch(url: str):
+    with instrumentation.feed(url):
+        try:
+            return parse_feed(url)
+        except Exception as e:
+            # One bad feed fails on its own rather than taking the rest of the import with it.
+            return error_result(e)
+
+
+def import_opml(db: DBInterface, file_path: str, concurrency: int = import_concurrency,
+                batch_size: int = IMPORT_BATCH_SIZE,
+                progress: Callable[[int, int, OutlineFeed, str | None], None] | None = None) -> ImportReport:
+    """
+    Import the groups and feeds of an OPML file.
+
+    The group tree is created in one transaction. Feeds already in the db are skipped without touching the network,
+    the rest are fetched concurrency at a time, interleaving hosts, and written with their first items batch_size
+    feeds per transaction.
+    progress is called with the number of feeds done, the number to fetch, the feed and its error, if any.
+    """
+    report = ImportReport()
+    group_paths, outlines = read_outlines(file_path)
+    groups = db.add_find_group_paths(group_paths)
+    report.groups = len(group_paths)
+
+    existing = db.find_feed_urls(o.url for o in outlines)
+    seen = set()
+    to_fetch = []
+    for outline in outlines:
+        if outline.url in seen:
+            continue
+        seen.add(outline.url)
+        if outline.url in existing:
+            report.existing.append(outline.url)
+        else:
+            to_fetch.append(outline)
+
+    pending: list[dict[str, Any]] = []
+
+    def flush():
+        added = db.add_feeds(pending)
+        added_urls = {f.url for f in added}
+        report.added.extend(f.url for f in added)
+        report.existing.extend(f["url"] for f in pending if f["url"] not in added_urls)
+        pending.clear()
+
+    fetched = fetching.fetch_all(to_fetch, lambda o: o.url, lambda o: _fetch(o.url), concurrency)
+    for done, (outline, (r, f)) in enumerate(fetched, 1):
+        error = describe_error(r, f)
+        if error is not None:
+            report.failed.append((outline.url, error))
+        else:
+            pending.append({
+                "name": f["name"],
+                "url": f["new_url"] if ResultType.PERMANENT_REDIRECT in r else outline.url,
+                "home_page": f["home_page"],
+                "group_data": groups[outline.path],
+                "etag": f["etag"],
+                "last_modified": f["modified"],
+                "entries": f["entries"],
+            })
+            if len(pending) >= batch_size:
+                flush()
+        if progress is not None:
+            progress(done, len(to_fetch), outline, error)
+    flush()
+
+    return report
+
+
+def export_opml(db: DBInterface, output: BinaryIO, group_data: GroupData | None = None,
+                title: str = "Kyle's Feed Reader subscriptions") -> int:
+    """
+    Write the groups and feeds below group_data, the root group by default, to output as OPML.
+    Outlines are written as rows come off the tree query, so memory use does not grow with the number of feeds.
+    Returns the number of feeds written.
+    """
+    count = 0
+    with etree.xmlfile(output, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element("opml", version="2.0"):
+            with xf.element("head"):
+                xf.write(_text_element("title", title))
+                xf.write(_text_element("dateCreated", email.utils.formatdate(usegmt=True)))
+            with xf.element("body"), ExitStack() as stack:
+                # A stack per open group, each closed as the tree steps back out of it. Those still open when the
+                # rows run out, or a write fails, are closed by stack, innermost first.
+                open_groups: list[ExitStack] = []
+                for entry in db.iter_tree(group_data):
+                    while len(open_groups) >= entry.depth:
+                        open_groups.pop().close()
+                    if entry.url is None:
+                        group = stack.enter_context(ExitStack())
+                        group.enter_context(xf.element("outline", text=entry.name, title=entry.name))
+                        open_groups.append(group)
+                    else:
+                        attrib = {"type": "rss", "text": entry.name, "title": entry.name, "xmlUrl": entry.url}
+                        if entry.home_page:
+                            attrib["htmlUrl"] = entry.home_page
+                        if entry.description:
+                            attrib["description"] = entry.description
+                        xf.write(etree.Element("outline", attrib))
+                        count += 1
+    return count
+
+
+def _text_element(tag: str, text: str) -> etree._Element:
+    element = etree.Element(tag)
+    element.text = text
+    return element
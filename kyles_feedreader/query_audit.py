@@ -0,0 +1,108 @@
+# By Kyle Monson
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator
+
+from pony import orm
+
+from .db_interface import DBInterface, db_to_feed, db_to_group
+
+
+@dataclass
+class QueryPlan:
+    method: str
+    sql: str
+    steps: list[str] = field(default_factory=list)
+
+    @property
+    def full_scans(self) -> list[str]:
+        # "SCAN t USING INDEX i" walks an index in order, a bare "SCAN t" reads every row of the table.
+        return [s for s in self.steps if s.startswith("SCAN ") and " USING " not in s]
+
+    @property
+    def temp_btrees(self) -> list[str]:
+        return [s for s in self.steps if "USE TEMP B-TREE" in s]
+
+    @property
+    def flagged(self) -> bool:
+        return bool(self.full_scans or self.temp_btrees)
+
+
+@contextmanager
+def record_sql(db: orm.Database) -> Iterator[list[tuple[str, Any]]]:
+    """Capture every statement Pony sends to the database along with its arguments."""
+    statements = []
+    exec_sql = db._exec_sql
+
+    def recorder(sql, arguments=None, *args, **kwargs):
+        statements.append((sql, arguments))
+        return exec_sql(sql, arguments, *args, **kwargs)
+
+    db._exec_sql = recorder
+    try:
+        yield statements
+    finally:
+        del db._exec_sql
+
+
+def explain(db: orm.Database, sql: str, arguments: Any = None) -> list[str]:
+    connection = db.get_connection()
+    rows = connection.execute("EXPLAIN QUERY PLAN " + sql, arguments or ())
+    return [row[-1] for row in rows]
+
+
+def _audit_calls(dbi: DBInterface) -> list[tuple[str, Callable[[], Any]]]:
+    db = dbi.db
+    feed_obj = db.Feed.select().first()
+    if feed_obj is None:
+        raise ValueError("Database has no feeds to audit")
+    group_obj = db.Group.select().first()
+    item_obj = feed_obj.items.select().first()
+
+    feed = db_to_feed(feed_obj)
+    group = dbi.root_group if group_obj is None else db_to_group(group_obj)
+
+    calls = [
+        ("get_groups", lambda: dbi.get_groups(dbi.root_group)),
+        ("get_feeds", lambda: dbi.get_feeds()),
+        ("get_feeds(group)", lambda: dbi.get_feeds(group)),
+        ("get_feed", lambda: dbi.get_feed(feed.id)),
+        ("find_feed_from_url", lambda: dbi.find_feed_from_url(feed.url)),
+        ("get_all_feed_items", lambda: dbi.get_all_feed_items()),
+        ("get_group_feed_items", lambda: dbi.get_group_feed_items(group)),
+        ("get_feed_items", lambda: dbi.get_feed_items(feed)),
+        ("any_has_unviewed_feed_items", lambda: dbi.any_has_unviewed_feed_items()),
+        ("group_has_unviewed_feed_items", lambda: dbi.group_has_unviewed_feed_items(group)),
+        ("feed_has_unviewed_feed_items", lambda: dbi.feed_has_unviewed_feed_items(feed)),
+        ("mark_group_items_viewed", lambda: dbi.mark_group_items_viewed(group)),
+        ("mark_feed_items_viewed", lambda: dbi.mark_feed_items_viewed(feed)),
+        ("mark_group_items_read", lambda: dbi.mark_group_items_read(group)),
+        ("mark_feed_items_read", lambda: dbi.mark_feed_items_read(feed)),
+    ]
+    if item_obj is not None:
+        item = {"title": item_obj.title, "url": item_obj.url}
+        calls.append(("add_feed_items", lambda: dbi.add_feed_items(feed, [item])))
+    return calls
+
+
+def audit(dbi: DBInterface) -> list[QueryPlan]:
+    """
+    Run each DBInterface query against the bound database and collect the SQLite query plan for the SQL Pony
+    generates. Everything runs in a single session that is rolled back, so the database is left untouched.
+    """
+    db = dbi.db
+    plans = []
+    with orm.db_session:
+        for method, call in _audit_calls(dbi):
+            with record_sql(db) as statements:
+                call()
+                orm.flush()
+            seen = set()
+            for sql, arguments in statements:
+                if sql in seen:
+                    continue
+                seen.add(sql)
+                plans.append(QueryPlan(method, sql, explain(db, sql, arguments)))
+        orm.rollback()
+    return plans
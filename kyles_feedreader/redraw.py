@@ -0,0 +1,129 @@
+# By Kyle Monson
+
+import signal
+import sys
+import threading
+from typing import Callable
+
+import gevent
+from gevent.event import Event
+from asciimatics.exceptions import StopApplication
+from asciimatics.screen import Screen
+
+
+COALESCE_WINDOW = 0.05  # Seconds model changes are gathered for before the one redraw they share.
+RESIZE_SETTLE = 0.15  # Seconds the terminal has to keep its size before the screen is rebuilt for it.
+
+
+class RedrawLoop:
+    """
+    Runs the TUI, redrawing only when something happened: input on the terminal, a resize or a model change
+    reported through notify. In between it blocks in the gevent hub, so an idle session uses no CPU.
+
+    Model changes are coalesced: the first one starts a window of coalesce seconds and everything reported during
+    it is handled by a single refresh of the controller and a single redraw. Input cuts the window short.
+    Resizes are debounced the same way: the screen is rebuilt once the terminal has kept its size for settle
+    seconds, so dragging a window edge rebuilds it once rather than on every step.
+    open_screen and input_fd are there so tests can run the loop against a fake screen and a pipe.
+    """
+    def __init__(self, controller, open_screen: Callable[[], Screen] = Screen.open, input_fd: int | None = None,
+                 coalesce: float = COALESCE_WINDOW, settle: float = RESIZE_SETTLE) -> None:
+        self.controller = controller
+        self.open_screen = open_screen
+        self.input_fd = sys.stdin.fileno() if input_fd is None else input_fd
+        self.coalesce = coalesce
+        self.settle = settle
+        self.draws = 0  # Frames drawn, for tests and benchmarks.
+        self.refreshes = 0
+        self.rebuilds = 0
+        self._changed = False
+        self._resizing = False
+        self._stopped = False
+        self._wake = Event()
+        self._input = Event()
+        self._async = None
+
+    def notify(self) -> None:
+        """Report a model change. Safe to call from any greenlet or thread."""
+        self._changed = True
+        self._send()
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._send()
+
+    def _send(self):
+        if self._async is not None:
+            # Wakes the hub even from another thread, unlike setting the event.
+            self._async.send()
+
+    def _on_input(self):
+        self._input.set()
+        self._wake.set()
+
+    def _watch_resize(self, screen: Screen) -> Callable[[], None]:
+        # The screen's own handler does the curses work and raises has_resized, this one wakes the loop to look.
+        if not hasattr(signal, "SIGWINCH") or threading.current_thread() is not threading.main_thread():
+            return lambda: None
+        previous = signal.getsignal(signal.SIGWINCH)
+
+        def handler(signum, frame):
+            if callable(previous):
+                previous(signum, frame)
+            self._resizing = True
+            self._send()
+
+        signal.signal(signal.SIGWINCH, handler)
+        return lambda: signal.signal(signal.SIGWINCH, previous)
+
+    def _wait(self):
+        self._wake.wait()
+        self._wake.clear()
+        if self._changed and not self._input.is_set():
+            self._input.wait(self.coalesce)
+
+    def _settle_resize(self):
+        # Each further SIGWINCH during the wait starts it over.
+        self._resizing = True
+        while self._resizing and not self._stopped:
+            self._resizing = False
+            gevent.sleep(self.settle)
+
+    def run(self) -> None:
+        hub = gevent.get_hub()
+        io = hub.loop.io(self.input_fd, 1)
+        io.start(self._on_input)
+        self._async = hub.loop.async_()
+        self._async.start(self._wake.set)
+
+        screen = self.open_screen()
+        self.controller.build_ui(screen, None)
+        restore_resize = self._watch_resize(screen)
+        try:
+            while not self._stopped:
+                if screen.has_resized():
+                    self._settle_resize()
+                    restore_resize()
+                    screen.close(False)
+                    screen = self.open_screen()
+                    self.controller.build_ui(screen, None)
+                    self.rebuilds += 1
+                    restore_resize = self._watch_resize(screen)
+                if self._changed:
+                    self._changed = False
+                    self.controller.refresh()
+                    self.refreshes += 1
+                    screen.force_update()
+                self._input.clear()
+                try:
+                    screen.draw_next_frame()
+                except StopApplication:
+                    break
+                self.draws += 1
+                self._wait()
+        finally:
+            io.stop()
+            self._async.stop()
+            self._async = None
+            restore_resize()
+            screen.close(True)
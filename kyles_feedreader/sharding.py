@@ -0,0 +1,160 @@
+import bisect
+import datetime
+import hashlib
+import multiprocessing
+import os
+import queue
+import traceback
+from dataclasses import dataclass
+from time import monotonic, perf_counter
+from typing import Callable, Iterable
+
+from . import fetching, instrumentation
+from .db_interface import DBInterface, FeedData
+from .defaults import host_concurrency, host_interval, lean_parse, update_concurrency, update_memory
+from .updater import Log, UpdateReport, _quiet, apply_update, fetch_feed, prioritize, select_due
+
+
+RING_REPLICAS = 64  # Points each shard gets on the hash ring, which evens out how many hosts land on each.
+QUEUE_SIZE = 256  # Parsed feeds waiting for the writer before workers have to wait for it.
+WORKER_CHECK = 1.0  # Seconds the writer waits for a result before making sure the workers are still alive.
+
+
+def _hash(key: str) -> int:
+    # hash() differs between processes, this has to be the same everywhere.
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto shards numbered from 0. Changing the number of shards only moves the keys of the
+    shards added or removed, so a host keeps its worker from one update to the next whatever else changes.
+    """
+    def __init__(self, shards: int, replicas: int = RING_REPLICAS) -> None:
+        self.shards = shards
+        points = sorted((_hash(f"{shard}:{replica}"), shard) for shard in range(shards) for replica in range(replicas))
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard(self, key: str) -> int:
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._shards[i]
+
+
+def split_by_host(feeds: Iterable[FeedData], shards: int) -> list[list[FeedData]]:
+    """feeds in shards lists, all the feeds on one host in the same one so per host limits hold across workers."""
+    ring = HashRing(shards)
+    result = [[] for _ in range(shards)]
+    for feed in feeds:
+        result[ring.shard(fetching.host_of(feed.url) or "")].append(feed)
+    return result
+
+
+@dataclass
+class ShardStatus:
+    feeds: int
+    written: int = 0
+    blocked: float = 0.0  # Seconds the worker waited for room in the queue, which is the writer holding it back.
+    done: bool = False
+
+
+def _work(shard: int, feeds: list[FeedData], concurrency: int, per_host: int, interval: float, memory: int,
+          lean: bool, results: multiprocessing.Queue) -> None:
+    # Runs in a worker process: fetch and parse the shard's feeds and hand each one to the writer.
+    fetching.configure(per_host, interval)
+    budget = fetching.MemoryBudget(memory)
+    blocked = 0.0
+    try:
+        for feed, (r, f, fetch) in fetching.fetch_all(feeds, lambda f: f.url,
+                                                      lambda f: fetch_feed(f, budget=budget, lean=lean), concurrency):
+            started = perf_counter()
+            results.put(("result", shard, feed.id, r, f, fetch, blocked))
+            blocked += perf_counter() - started
+            # From here the queue, bounded at queue_size, is what holds the feed.
+            budget.release(fetch.reserved)
+        results.put(("done", shard, blocked))
+    except BaseException:
+        results.put(("error", shard, traceback.format_exc()))
+        raise
+
+
+def update_feeds_sharded(db: DBInterface, feeds: Iterable[FeedData] | None = None, workers: int | None = None,
+                         concurrency: int = update_concurrency, per_host: int = host_concurrency,
+                         interval: float = host_interval, ignore_cache: bool = False, log: Log = _quiet,
+                         queue_size: int = QUEUE_SIZE, memory: int = update_memory, lean: bool = lean_parse,
+                         progress: Callable[[list[ShardStatus]], None] | None = None,
+                         deadline: float | None = None) -> UpdateReport:
+    """
+    update_feeds spread over worker processes, one per core by default, for subscription lists too big for the
+    parsing one process can do. Feeds are split between workers by host with a HashRing and each worker fetches
+    and parses its share concurrency at a time, under its own per host limits. This process stays the only writer:
+    parsed feeds come back through a queue of queue_size and are written as they arrive. When the writer falls
+    behind the queue fills up and workers wait, the time they spent waiting shows up in the ShardStatus list passed
+    to progress after every write. memory is split evenly between the workers' MemoryBudgets and lean is passed
+    on to parse_feed. deadline works as it does for update_feeds, the workers are stopped when it passes.
+    """
+    report = UpdateReport()
+    now = datetime.datetime.utcnow()
+    if feeds is None:
+        feeds = db.iter_feeds()
+    due = select_due(feeds, now, report, ignore_cache)
+    until = None
+    if deadline is not None:
+        until = monotonic() + deadline
+        # split_by_host keeps the order, so every worker gets its share most valuable first.
+        due = prioritize(db, due, now)
+    workers = max(1, workers or os.cpu_count() or 1)
+    shards = split_by_host(due, workers)
+    by_id = {feed.id: feed for feed in due}
+    statuses = [ShardStatus(len(shard), done=not shard) for shard in shards]
+    written = set()
+
+    context = multiprocessing.get_context()
+    results = context.Queue(queue_size)
+    processes = {n: context.Process(target=_work, args=(n, shard, concurrency, per_host, interval,
+                                                        memory // workers, lean, results),
+                                    name=f"kfr-update-{n}", daemon=True)
+                 for n, shard in enumerate(shards) if shard}
+    for process in processes.values():
+        process.start()
+    try:
+        running = set(processes)
+        while running:
+            timeout = WORKER_CHECK if until is None else min(WORKER_CHECK, until - monotonic())
+            if timeout <= 0:
+                break
+            try:
+                message = results.get(timeout=timeout)
+            except queue.Empty:
+                dead = [n for n in running if not processes[n].is_alive()]
+                if dead:
+                    raise RuntimeError(f"Update worker {dead[0]} exited with {processes[dead[0]].exitcode}")
+                continue
+            kind, shard = message[:2]
+            status = statuses[shard]
+            if kind == "error":
+                raise RuntimeError(f"Update worker {shard} failed:\n{message[2]}")
+            if kind == "done":
+                status.blocked = message[2]
+                status.done = True
+                running.discard(shard)
+            else:
+                if until is not None and monotonic() >= until:
+                    break
+                _, _, feed_id, r, f, fetch, status.blocked = message
+                feed = by_id[feed_id]
+                with instrumentation.feed(feed.url):
+                    apply_update(db, feed, r, f, fetch, report, log)
+                written.add(feed_id)
+                status.written += 1
+            if progress is not None:
+                progress(statuses)
+    finally:
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        results.close()
+    if until is not None:
+        report.unfinished = [feed for feed in due if feed.id not in written]
+    return report
@@ -0,0 +1,126 @@
+import dataclasses
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable
+
+import gevent
+from gevent.event import Event
+
+from .db_interface import DBInterface, FeedHandle, FeedItemHandle, ItemSummary
+from .defaults import state_flush_interval
+
+
+IDLE_FLUSH = 0.5  # Seconds without a new mark after which the marks so far are written.
+
+
+@dataclass
+class StateJournal:
+    """
+    Read, viewed and starred marks made in the TUI, held in memory and written to the db together. Marks show up
+    in the UI straight away through apply, and worker writes them in a single transaction once no new mark has
+    come in for idle seconds or, while they keep coming, flush_interval after the first one, so skimming a list a
+    keypress per item doesn't commit on every keypress. A crash loses at most the marks of the last flush_interval.
+
+    Writes run on the hub's thread pool so a slow disk doesn't hold up the UI. The marks being written are kept
+    and applied until the write is done, so the UI doesn't show them undone in the meantime, and are put back to
+    go with the next write if it fails.
+    """
+    db: DBInterface
+    flush_interval: float = state_flush_interval
+    idle: float = IDLE_FLUSH
+    flushes: int = 0
+    last_error: Exception | None = None
+
+    def __post_init__(self):
+        self._pending: dict[FeedItemHandle, dict[str, bool]] = {}
+        self._stored: dict[FeedItemHandle, ItemSummary] = {}  # Items as the db has them, to tell what the marks change.
+        self._writing: dict[FeedItemHandle, dict[str, bool]] = {}  # The marks of the write under way.
+        self._writing_stored: dict[FeedItemHandle, ItemSummary] = {}
+        self._first = self._last = 0.0
+        self._marked = Event()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def apply(self, item: ItemSummary) -> ItemSummary:
+        """item with the marks not yet written."""
+        flags = self._pending.get(item.id)
+        writing = self._writing.get(item.id)
+        if writing is not None:
+            flags = writing if flags is None else {**writing, **flags}
+        return item if flags is None else dataclasses.replace(item, **flags)
+
+    def _stored_item(self, item: ItemSummary) -> ItemSummary:
+        # Once the write under way is done, the db has its marks.
+        writing = self._writing.get(item.id)
+        if writing is None:
+            return item
+        return dataclasses.replace(self._writing_stored[item.id], **writing)
+
+    def mark(self, item: ItemSummary, **flags: bool) -> ItemSummary:
+        """Set flags of item, returning it as it now stands."""
+        current = self.apply(item)
+        changed = {flag: value for flag, value in flags.items() if getattr(current, flag) != value}
+        if not changed:
+            return current
+        if item.id not in self._stored:
+            self._stored[item.id] = self._stored_item(item)
+        self._pending.setdefault(item.id, {}).update(changed)
+        now = time.monotonic()
+        if not self._marked.is_set():
+            self._first = now
+            self._marked.set()
+        self._last = now
+        return dataclasses.replace(current, **changed)
+
+    def unread_delta(self, feeds: Iterable[FeedHandle] | None = None) -> dict[FeedHandle, int]:
+        """How much the marks not yet written change the unread count of each feed, of all of them or just feeds."""
+        feeds = None if feeds is None else set(feeds)
+        delta = Counter()
+        for marks, stored_items in ((self._writing, self._writing_stored), (self._pending, self._stored)):
+            for item_id, flags in marks.items():
+                stored = stored_items[item_id]
+                if "read" in flags and (feeds is None or stored.feed in feeds):
+                    delta[stored.feed] += int(stored.read) - int(flags["read"])
+        return {feed: change for feed, change in delta.items() if change}
+
+    def flush(self) -> int:
+        """Write the marks made so far, returning how many items they were for."""
+        pending = self._pending
+        self._marked.clear()
+        if not pending:
+            return 0
+        self._writing, self._writing_stored = pending, self._stored
+        self._pending, self._stored = {}, {}
+        try:
+            gevent.get_hub().threadpool.apply(self.db.set_item_states, (pending,))
+        except BaseException:
+            # Marks made since go on top of the ones the write failed on, which go with the next one. A copy, as a
+            # write the greenlet was killed waiting on can still be going through them.
+            restored = dict(pending)
+            for item_id, flags in self._pending.items():
+                restored[item_id] = {**restored.get(item_id, {}), **flags}
+            self._stored = {**self._stored, **self._writing_stored}
+            self._pending = restored
+            self._marked.set()
+            raise
+        finally:
+            self._writing, self._writing_stored = {}, {}
+        self.flushes += 1
+        return len(pending)
+
+    def worker(self):
+        while True:
+            self._marked.wait()
+            while True:
+                wait = min(self._last + self.idle, self._first + self.flush_interval) - time.monotonic()
+                if wait <= 0:
+                    break
+                gevent.sleep(wait)
+            try:
+                self.flush()
+            except Exception as e:
+                # The TUI has nowhere to show a traceback, the next flush tries again.
+                self.last_error = e
+                gevent.sleep(self.flush_interval)
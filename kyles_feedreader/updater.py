@@ -0,0 +1,211 @@
+# By Kyle Monson
+
+import datetime
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Callable, Iterable, Iterator
+
+from . import backoff, fetching, instrumentation
+from .db_interface import DBInterface, FeedData
+from .defaults import lean_parse, update_concurrency, update_memory
+from .feed_parsing import parse_feed, describe_error, error_result, FetchInfo, ResultType
+
+
+Log = Callable[[str], None]
+
+NEVER_UPDATED = 10.0  # Update periods a feed that was never updated counts as behind by.
+PRIORITY_STEP = 2.0  # How many times more a feed is worth for each level of priority the user gives it.
+
+
+@dataclass
+class UpdateReport:
+    fetched: int = 0
+    fresh: int = 0  # Skipped because the server said they were still fresh.
+    suspended: int = 0  # Skipped because they are backing off or disabled.
+    failed: int = 0
+    not_modified: int = 0
+    new_items: int = 0
+    peak_memory: int = 0  # Most bytes set aside for fetched feeds at once, see fetching.MemoryBudget.
+    unfinished: list[FeedData] = field(default_factory=list)  # Due but not written when the deadline came.
+
+
+def _quiet(message: str) -> None:
+    pass
+
+
+def iter_due(feeds: Iterable[FeedData], now: datetime.datetime, report: UpdateReport,
+             ignore_cache: bool = False) -> Iterator[FeedData]:
+    """The feeds to fetch at now, as feeds is read, counting the ones skipped in report."""
+    for feed in feeds:
+        if not backoff.is_due(feed, now):
+            report.suspended += 1
+        elif not ignore_cache and feed.fresh_until is not None and feed.fresh_until > now:
+            report.fresh += 1
+        else:
+            yield feed
+
+
+def select_due(feeds: Iterable[FeedData], now: datetime.datetime, report: UpdateReport,
+               ignore_cache: bool = False) -> list[FeedData]:
+    """The feeds to fetch at now, counting the ones skipped in report."""
+    return list(iter_due(feeds, now, report, ignore_cache))
+
+
+def expected_value(feed: FeedData, now: datetime.datetime, history: tuple[int, int] | None = None) -> float:
+    """
+    What fetching feed at now is worth, to decide what to fetch first when there isn't time for everything. That is
+    how many update periods behind it is, times the new items its history, (fetches, new items) from
+    DBInterface.get_feed_yields, says a fetch finds, times PRIORITY_STEP to the power of the user's priority.
+    A fetch and an item are added to every history so feeds without one, or with nothing found yet, aren't left out.
+    """
+    if feed.last_update is None:
+        staleness = NEVER_UPDATED
+    else:
+        period = max(feed.update_rate, datetime.timedelta(seconds=1))
+        staleness = max((now - feed.last_update) / period, 0.0)
+    fetches, new_items = history or (0, 0)
+    return staleness * (new_items + 1) / (fetches + 1) * PRIORITY_STEP ** feed.priority
+
+
+def prioritize(db: DBInterface, feeds: Iterable[FeedData], now: datetime.datetime) -> list[FeedData]:
+    """feeds sorted by expected_value, the most worth fetching first."""
+    yields = db.get_feed_yields()
+    return sorted(feeds, key=lambda feed: expected_value(feed, now, yields.get(feed.id)), reverse=True)
+
+
+def fetch_feed(feed: FeedData, log: Log = _quiet, budget: fetching.MemoryBudget | None = None,
+               lean: bool = lean_parse, until: float | None = None) -> tuple[ResultType, dict, FetchInfo]:
+    """Fetch and parse feed without touching the db, so it can run on any thread. Errors come back as results."""
+    log(f"Getting {feed.name}")
+    fetch = FetchInfo()
+    with instrumentation.feed(feed.url):
+        try:
+            r, f = parse_feed(feed.url, etag=feed.etag, modified=feed.last_modified, fetch_info=fetch, budget=budget,
+                              lean=lean, until=until)
+        except Exception as e:
+            # Raised out of fetch_all it would end the whole update, as a failed feed it only counts against this one.
+            r, f = error_result(e)
+    return r, f, fetch
+
+
+def _record_failure(db: DBInterface, feed: FeedData, error: str, log: Log, status: int | None = None,
+                    retry_after: str | None = None) -> None:
+    now = datetime.datetime.utcnow()
+    updates = backoff.failure_updates(feed, error, now, status, backoff.parse_retry_after(retry_after, now))
+    db.update_feed(feed, **updates)
+    if feed.disabled:
+        log(f"Disabled {feed.name} after {feed.failures} failed updates in a row")
+    else:
+        log(f"Retrying {feed.name} after {feed.retry_at:%Y-%m-%d %H:%M} UTC")
+
+
+def apply_update(db: DBInterface, feed: FeedData, r: ResultType, f: dict, fetch: FetchInfo, report: UpdateReport,
+                 log: Log = _quiet) -> None:
+    """Write the result of fetch_feed to the db in a single transaction, so a feed is never left half written."""
+    with db.transaction():
+        _apply_update(db, feed, r, f, fetch, report, log)
+
+
+def _apply_update(db: DBInterface, feed: FeedData, r: ResultType, f: dict, fetch: FetchInfo, report: UpdateReport,
+                  log: Log) -> None:
+    url = feed.url
+    name = feed.name
+    report.fetched += 1
+
+    def record(**kwargs):
+        db.record_fetch(feed, fetch.latency, fetch.size, fetch.status, **kwargs)
+
+    error = describe_error(r, f)
+    if error is not None:
+        log(f"Error getting {url}: {error}")
+        report.failed += 1
+        record(error=True)
+        _record_failure(db, feed, error, log, fetch.status, f.get("retry_after"))
+        return
+
+    if ResultType.PERMANENT_REDIRECT in r:
+        new_url = f["new_url"]
+        log(f"Updating {name} to new URL: {new_url}")
+        try:
+            db.update_feed(feed, url=new_url)
+        except ValueError as e:
+            log(f"Updating {name} URL failed: {str(e)}")
+            report.failed += 1
+            record(error=True)
+            _record_failure(db, feed, str(e), log)
+            return
+
+    changes = backoff.success_updates(feed)
+    fresh_until = None if fetch.fresh_for is None else datetime.datetime.utcnow() + fetch.fresh_for
+    if fresh_until != feed.fresh_until:
+        changes["fresh_until"] = fresh_until
+    if changes:
+        db.update_feed(feed, **changes)
+
+    if ResultType.NOT_MODIFIED in r:
+        db.update_feed_last_update(feed)
+        report.not_modified += 1
+        record(not_modified=True)
+        return
+
+    db.update_feed(feed, etag=f["etag"], last_modified=f["modified"])
+    new_items = db.add_feed_items(feed, f["entries"])
+    report.new_items += len(new_items)
+    record(new_items=len(new_items))
+    if new_items:
+        log(f"Added {len(new_items)} items to {name}")
+
+
+def update_feeds(db: DBInterface, feeds: Iterable[FeedData] | None = None, concurrency: int = update_concurrency,
+                 ignore_cache: bool = False, log: Log = _quiet,
+                 on_new_items: Callable[[FeedData, int], None] | None = None,
+                 memory: int = update_memory, lean: bool = lean_parse, deadline: float | None = None) -> UpdateReport:
+    """
+    Update feeds, every feed in the db by default, skipping the ones that are suspended or still fresh.
+    Feeds are fetched concurrency at a time on worker threads through fetching.fetch_all and written on the calling
+    thread, so there is only ever one writer. on_new_items is called with each feed that got new items and how
+    many, as soon as they are written.
+
+    Every stage streams into the next: feeds are read from the db in batches as fetch_all gets to them, and parsed
+    feeds are held against a MemoryBudget of memory bytes until they are written, so fetches wait for the writer
+    rather than piling up results however many or big the feeds are. lean is passed on to parse_feed.
+
+    deadline, in seconds, puts the feeds in prioritize order and stops the update once it has passed. Fetches still
+    running then are dropped, each feed is written whole or not at all, and the feeds not written are listed in the
+    report's unfinished.
+    """
+    report = UpdateReport()
+    now = datetime.datetime.utcnow()
+    if feeds is None:
+        feeds = db.iter_feeds()
+    due = iter_due(feeds, now, report, ignore_cache)
+    until = None
+    if deadline is not None:
+        until = monotonic() + deadline
+        due = prioritize(db, due, now)
+    budget = fetching.MemoryBudget(memory)
+    written = set()
+
+    results = fetching.fetch_all(due, lambda f: f.url, lambda f: fetch_feed(f, log, budget, lean, until),
+                                 concurrency, until=until)
+    try:
+        for feed, (r, f, fetch) in results:
+            if until is not None and monotonic() >= until:
+                # Likely cut short by the deadline itself, which is no reason to count it against the feed.
+                break
+            new_items = report.new_items
+            try:
+                with instrumentation.feed(feed.url):
+                    apply_update(db, feed, r, f, fetch, report, log)
+            finally:
+                budget.release(fetch.reserved)
+            written.add(feed.id)
+            if on_new_items is not None and report.new_items > new_items:
+                on_new_items(feed, report.new_items - new_items)
+    finally:
+        results.close()
+        budget.close()
+    if until is not None:
+        report.unfinished = [feed for feed in due if feed.id not in written]
+    report.peak_memory = budget.peak
+    return report
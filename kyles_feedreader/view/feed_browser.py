@@ -1,5 +1,9 @@
+from typing import Any, Callable, Hashable
+
 from asciimatics.widgets import Frame, Layout, ListBox, Widget
 
+from .item_list import Fetch, PagedListBox, PagedWindow
+
 
 def calc_frame_dim(screen_width: int, item_view):
     width = max(min(screen_width // 6, 48), 16)
@@ -10,6 +14,13 @@ def calc_frame_dim(screen_width: int, item_view):
     return width, x
 
 
+def calc_item_split(screen_height: int):
+    """Heights of the item list and the detail pane below it."""
+    height = screen_height - 2
+    list_height = max(height // 2, min(height, 5))
+    return list_height, height - list_height
+
+
 class FeedListView(Frame):
     def __init__(self, screen, on_select=None):
         width, x = calc_frame_dim(screen.width, False)
@@ -29,36 +40,71 @@ class FeedListView(Frame):
         layout.add_widget(self.list_box)
         self.fix()
 
-    def update_feed_list(self, feed_dict):
-        options = []
-        no_group = feed_dict.pop(NO_GROUP_TUPLE, {"feeds": list(), "unreads": False})
-        options.append(("All", ("all",)))
-        options.append(("Starred", ("starred",)))
-        for (name, _id), feeds in feed_dict.items():
-            options.append(("-"+name, ("group", _id)))
-            options.extend(self.build_options(feeds, prefix=" "))
-        options.extend(self.build_options(no_group))
+    def update_feed_list(self, entries, counts=None):
+        """Show entries from DBInterface.iter_tree, with the unread counts keyed like the option values."""
+        self.labels = {("all",): "All", ("starred",): "Starred"}
+        for entry in entries:
+            prefix = " " * (entry.depth - 1)
+            if entry.url is None:
+                self.labels[("group", entry.id)] = prefix + "-" + entry.name
+            else:
+                self.labels[("feed", entry.id)] = prefix + entry.name
+        self.counts = dict(counts or {})
+        self.index = {value: i for i, value in enumerate(self.labels)}
+        self.list_box.options = [(self._label(value), value) for value in self.labels]
 
+    def update_counts(self, counts):
+        """Relabel just the options whose count is in counts."""
+        self.counts.update(counts)
+        options = self.list_box.options
+        for value in counts:
+            i = self.index.get(value)
+            if i is not None:
+                options[i] = (self._label(value), value)
         self.list_box.options = options
 
-    @staticmethod
-    def build_options(feeds, prefix=""):
-        options = []
-        for item in feeds["feeds"]:
-            options.append((prefix+item["name"], ("feed", item["id"])))
-        return options
+    def _label(self, value):
+        count = self.counts.get(value)
+        return f"{self.labels[value]} ({count})" if count else self.labels[value]
+
+
+def format_item(item, width: int) -> str:
+    star = "*" if item.starred else " "
+    date = "" if item.timestamp is None else f" {item.timestamp:%Y-%m-%d}"
+    title = item.title
+    space = width - len(date) - 1
+    if len(title) > space:
+        title = title[:max(space - 3, 0)] + "..."
+    return f"{star}{title:<{space}}{date}"
 
 
 class FeedItemView(Frame):
-    def __init__(self, screen, on_select=None):
-        width, x = calc_frame_dim(screen.width, False)
+    def __init__(self, screen, fetch: Fetch, key: Callable[[Any], Hashable], title="Items", on_change=None,
+                 on_select=None, window: PagedWindow | None = None, on_move=None):
+        width, x = calc_frame_dim(screen.width, True)
         super().__init__(screen,
-                         screen.height - 2,
+                         calc_item_split(screen.height)[0],
                          width,
                          x=x,
                          reduce_cpu=True,
-                         title="Feeds")
+                         title=title)
 
         layout = Layout([100], fill_frame=True)
         self.add_layout(layout)
+        self.list_box = PagedListBox(Widget.FILL_FRAME,
+                                     fetch,
+                                     key,
+                                     format_item,
+                                     bold=lambda item: not item.read,
+                                     name="items",
+                                     on_change=on_change,
+                                     on_select=on_select,
+                                     window=window,
+                                     on_move=on_move)
+        layout.add_widget(self.list_box)
         self.fix()
+
+    def refresh(self, title: str | None = None):
+        if title is not None:
+            self.title = title
+        self.list_box.refresh()
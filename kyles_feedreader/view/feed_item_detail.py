@@ -1,4 +1,118 @@
+import textwrap
+from collections import OrderedDict
+from typing import Callable, Hashable
 
+from asciimatics.widgets import Frame, Layout, Widget
 
-class FeedItemDetailView:
-    pass
\ No newline at end of file
+from .feed_browser import calc_frame_dim, calc_item_split
+
+
+RENDER_CACHE_SIZE = 256  # Wrapped items kept, each at one width.
+
+# render(width) returns the lines to show when the pane is width columns wide.
+Render = Callable[[int], list[str]]
+
+
+def wrap_text(text: str | None, width: int) -> list[str]:
+    """text wrapped to width, keeping its line breaks and a blank line between paragraphs."""
+    lines = []
+    for paragraph in (text or "").splitlines():
+        lines.extend(textwrap.wrap(paragraph, max(width, 1)) or [""])
+    # Runs of blank lines come out of the HTML a lot, one is enough.
+    return [line for i, line in enumerate(lines) if line or (i > 0 and lines[i - 1])]
+
+
+class RenderCache:
+    """Lines made by render for a key, keeping the size most recently used."""
+    def __init__(self, size: int = RENDER_CACHE_SIZE) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._lines: OrderedDict[Hashable, list[str]] = OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._lines
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def get(self, key: Hashable, render: Callable[[], list[str]]) -> list[str]:
+        lines = self._lines.get(key)
+        if lines is not None:
+            self._lines.move_to_end(key)
+            self.hits += 1
+            return lines
+        self.misses += 1
+        lines = self._lines[key] = render()
+        if len(self._lines) > self.size:
+            self._lines.popitem(last=False)
+        return lines
+
+
+class LinesBox(Widget):
+    """Lines of text from render, asked for again at each draw so they always fit the widget's width."""
+
+    __slots__ = ["_render", "_required_height"]
+
+    def __init__(self, height: int, name: str | None = None) -> None:
+        super().__init__(name, tab_stop=False)
+        self._render: Render = lambda width: []
+        self._required_height = height
+
+    @property
+    def text_width(self) -> int:
+        return max(self._w - self._offset, 1)
+
+    def show(self, render: Render) -> None:
+        self._render = render
+
+    def update(self, frame_no):
+        self._draw_label()
+        width = self.text_width
+        lines = self._render(width)
+        colour, attr, background = self._pick_colours("field")
+        for i in range(self._h):
+            text = lines[i] if i < len(lines) else ""
+            self._frame.canvas.print_at(text + " " * (width - self.string_len(text)), self._x + self._offset,
+                                        self._y + i, colour, attr, background)
+
+    def process_event(self, event):
+        return event
+
+    def reset(self):
+        pass
+
+    def required_height(self, offset, width):
+        return self._required_height
+
+    @property
+    def value(self):
+        return None
+
+    @value.setter
+    def value(self, new_value):
+        pass
+
+
+class FeedItemDetailView(Frame):
+    def __init__(self, screen, title="Item"):
+        width, x = calc_frame_dim(screen.width, True)
+        list_height, height = calc_item_split(screen.height)
+        super().__init__(screen,
+                         height,
+                         width,
+                         x=x,
+                         y=list_height,
+                         reduce_cpu=True,
+                         can_scroll=False,
+                         title=title)
+
+        layout = Layout([100], fill_frame=True)
+        self.add_layout(layout)
+        self.lines_box = LinesBox(Widget.FILL_FRAME, name="detail")
+        layout.add_widget(self.lines_box)
+        self.fix()
+
+    def show(self, render: Render, title: str = "Item") -> None:
+        self.title = title
+        self.lines_box.show(render)
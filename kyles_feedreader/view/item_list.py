@@ -0,0 +1,277 @@
+from typing import Any, Callable, Hashable
+
+from asciimatics.event import KeyboardEvent, MouseEvent
+from asciimatics.screen import Screen
+from asciimatics.widgets import Widget
+
+
+PREFETCH_MARGIN = 20  # Rows kept loaded above and below the visible ones.
+LIST_END = object()  # Passed to fetch as before to get the last rows of the list.
+
+# fetch(after, before, limit) returns up to limit rows in list order: those right after the row with key after,
+# those right before the row with key before or before LIST_END, or the first rows if both are None.
+Fetch = Callable[[Hashable | None, Any, int], list]
+
+
+class PagedWindow:
+    """
+    The part of a long list around its visible rows. Rows are fetched a page at a time relative to the keys of the
+    rows already loaded, keeping margin rows ready on either side, and rows scrolled well out of view are dropped,
+    so the memory and work involved depend on the height of the list, not its length.
+    """
+    def __init__(self, fetch: Fetch, key: Callable[[Any], Hashable], height: int = 1,
+                 margin: int = PREFETCH_MARGIN) -> None:
+        self.fetch = fetch
+        self.key = key
+        self.height = max(height, 1)
+        self.margin = margin
+        self.rows: list = []
+        self.top = 0  # Index in rows of the first visible row.
+        self.line = 0  # Index in rows of the selected row.
+        self.at_start = True  # Whether rows starts at the start of the list.
+        self.at_end = True
+        self.loaded = False
+
+    @property
+    def selected(self) -> Any | None:
+        return self.rows[self.line] if self.rows else None
+
+    @property
+    def visible(self) -> list:
+        return self.rows[self.top:self.top + self.height]
+
+    @property
+    def _page_size(self) -> int:
+        return self.height + self.margin
+
+    @property
+    def capacity(self) -> int:
+        """The most rows ever kept loaded."""
+        return self.height + 2 * (self.margin + self._page_size)
+
+    def resize(self, height: int) -> None:
+        height = max(height, 1)
+        if height != self.height:
+            self.height = height
+            self._settle()
+
+    def home(self) -> None:
+        self.rows = self.fetch(None, None, self._page_size)
+        self.at_start = True
+        self.at_end = len(self.rows) < self._page_size
+        self.top = self.line = 0
+        self.loaded = True
+        self._settle()
+
+    def end(self) -> None:
+        self.rows = self.fetch(None, LIST_END, self._page_size)
+        self.at_start = len(self.rows) < self._page_size
+        self.at_end = True
+        self.line = max(len(self.rows) - 1, 0)
+        self.top = max(self.line - self.height + 1, 0)
+        self.loaded = True
+        self._settle()
+
+    def move(self, delta: int) -> None:
+        """Move the selection delta rows down, or up if negative, stopping at either end of the list."""
+        if not self.rows:
+            return
+        target = self.line + delta
+        if target >= len(self.rows) and not self.at_end:
+            self._extend(target - len(self.rows) + 1 + self.margin)
+        if target < 0 and not self.at_start:
+            target += self._prepend(self.margin - target)
+        self.line = min(max(target, 0), len(self.rows) - 1)
+        self._settle()
+
+    def reload(self, key: Hashable | None = None) -> None:
+        """
+        Fetch the rows again after the list changed, keeping the row with key, the selected one by default, where
+        it was on screen. If that row is gone the one that took its place is selected.
+        """
+        if key is None:
+            key = None if self.selected is None else self.key(self.selected)
+        offset = self.line - self.top
+        before = []
+        if key is not None:
+            wanted = offset + self.margin
+            before = self.fetch(None, key, wanted)
+            self.at_start = len(before) < wanted
+        else:
+            self.at_start = True
+        wanted = self.height + self.margin
+        after = self.fetch(self.key(before[-1]) if before else None, None, wanted)
+        self.at_end = len(after) < wanted
+        self.rows = before + after
+        self.line = len(before)
+        if self.line == len(self.rows):
+            self.line = max(self.line - 1, 0)
+        self.top = max(self.line - offset, 0)
+        self.loaded = True
+        self._settle()
+
+    def _extend(self, count: int) -> None:
+        count = max(count, self._page_size)
+        rows = self.fetch(self.key(self.rows[-1]), None, count) if self.rows else self.fetch(None, None, count)
+        self.rows.extend(rows)
+        self.at_end = len(rows) < count
+
+    def _prepend(self, count: int) -> int:
+        count = max(count, self._page_size)
+        rows = self.fetch(None, self.key(self.rows[0]), count)
+        self.rows[:0] = rows
+        self.line += len(rows)
+        self.top += len(rows)
+        self.at_start = len(rows) < count
+        return len(rows)
+
+    def _settle(self) -> None:
+        # Bring the selection into view, load the margins and drop whatever is beyond them.
+        self.top = min(self.top, self.line)
+        self.top = max(self.top, self.line - self.height + 1, 0)
+        if self.top < self.margin and not self.at_start:
+            self._prepend(self.margin - self.top)
+        if len(self.rows) - self.top - self.height < self.margin and not self.at_end:
+            self._extend(self.margin - (len(self.rows) - self.top - self.height))
+
+        # Up to a page more than the margin is kept on either side, so scrolling back and forth doesn't refetch.
+        cut = self.top - self.margin - self._page_size
+        if cut > 0:
+            del self.rows[:cut]
+            self.top -= cut
+            self.line -= cut
+            self.at_start = False
+        keep = self.top + self.height + self.margin + self._page_size
+        if len(self.rows) > keep:
+            del self.rows[keep:]
+            self.at_end = False
+
+
+class PagedListBox(Widget):
+    """
+    A list box over a list too long to hold in memory, such as every item in the db. Only a PagedWindow of rows
+    around the visible ones is loaded, and only the visible ones are drawn. render turns a row into its line of
+    text for a given width. The value is the selected row. Passing the window of an earlier list box carries its
+    rows and selection over, as when the screen is rebuilt after a resize. on_change is called whenever the selected
+    row changes, on_move only when the user moved it, just before on_change.
+    """
+
+    __slots__ = ["_window", "_render", "_required_height", "_on_change", "_on_move", "_on_select", "_bold"]
+
+    def __init__(self, height: int, fetch: Fetch, key: Callable[[Any], Hashable],
+                 render: Callable[[Any, int], str], bold: Callable[[Any], bool] | None = None,
+                 name: str | None = None, margin: int = PREFETCH_MARGIN, on_change: Callable[[], None] | None = None,
+                 on_select: Callable[[], None] | None = None, window: PagedWindow | None = None,
+                 on_move: Callable[[], None] | None = None) -> None:
+        super().__init__(name)
+        self._window = PagedWindow(fetch, key, margin=margin) if window is None else window
+        self._render = render
+        self._bold = bold
+        self._required_height = height
+        self._on_change = on_change
+        self._on_move = on_move
+        self._on_select = on_select
+
+    @property
+    def window(self) -> PagedWindow:
+        return self._window
+
+    def _changed(self, old: Any | None, moved: bool = False) -> None:
+        new = self._window.selected
+        key = self._window.key
+        if (None if old is None else key(old)) == (None if new is None else key(new)):
+            return
+        if moved and self._on_move is not None:
+            self._on_move()
+        if self._on_change is not None:
+            self._on_change()
+
+    def _load(self) -> None:
+        self._window.resize(self._h)
+        if not self._window.loaded:
+            self._window.home()
+            self._changed(None)
+
+    def refresh(self) -> None:
+        """Fetch the rows again, for when the list has changed underneath."""
+        old = self._window.selected
+        self._window.reload()
+        self._changed(old)
+
+    def update(self, frame_no):
+        self._draw_label()
+        self._load()
+        window = self._window
+        canvas = self._frame.canvas
+        width = self._w - self._offset
+        rows = window.visible
+        for i in range(self._h):
+            colour, attr, background = self._pick_colours("field", i == window.line - window.top)
+            text = ""
+            if i < len(rows):
+                text = self._render(rows[i], width)
+                if self._bold is not None and self._bold(rows[i]):
+                    attr |= Screen.A_BOLD
+            text = text[:width]
+            canvas.print_at(text + " " * (width - self.string_len(text)), self._x + self._offset, self._y + i,
+                            colour, attr, background)
+
+    def _move(self, action: Callable[[], None]) -> None:
+        old = self._window.selected
+        action()
+        self._changed(old, moved=True)
+
+    def process_event(self, event):
+        window = self._window
+        if isinstance(event, KeyboardEvent):
+            self._load()
+            if event.key_code == Screen.KEY_UP:
+                self._move(lambda: window.move(-1))
+            elif event.key_code == Screen.KEY_DOWN:
+                self._move(lambda: window.move(1))
+            elif event.key_code == Screen.KEY_PAGE_UP:
+                self._move(lambda: window.move(-self._h))
+            elif event.key_code == Screen.KEY_PAGE_DOWN:
+                self._move(lambda: window.move(self._h))
+            elif event.key_code == Screen.KEY_HOME:
+                self._move(window.home)
+            elif event.key_code == Screen.KEY_END:
+                self._move(window.end)
+            elif event.key_code in [Screen.ctrl("m"), Screen.ctrl("j")]:
+                if self._on_select is not None:
+                    self._on_select()
+            else:
+                return event
+        elif isinstance(event, MouseEvent):
+            if event.buttons != 0 and self.is_mouse_over(event, include_label=False):
+                self._load()
+                row = event.y - self._y
+                if row < len(window.visible):
+                    self._move(lambda: window.move(window.top + row - window.line))
+                    if event.buttons & MouseEvent.DOUBLE_CLICK != 0 and self._on_select is not None:
+                        self._on_select()
+                return None
+            return event
+        else:
+            return event
+        return None
+
+    def reset(self):
+        pass
+
+    def required_height(self, offset, width):
+        return self._required_height
+
+    @property
+    def value(self):
+        return self._window.selected
+
+    @value.setter
+    def value(self, new_value):
+        # Frame.data restores the selection through this, the rows around it are fetched again.
+        old = self._window.selected
+        if new_value is None:
+            self._window.home()
+        else:
+            self._window.reload(self._window.key(new_value))
+        self._changed(old)
@@ -15,7 +15,7 @@ setup(
         "gevent",
         "lxml",
         "asciimatics",
-        "feedparser",
+        "feedparser~=6.0.0",  # See requirements.txt.
         "click",
         "requests",
         "grequests",
@@ -0,0 +1,18 @@
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption("--timing", action="store_true", help="Also run the tests that hold code to wall clock budgets.")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "timing: checks a wall clock budget, only run with --timing")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--timing"):
+        return
+    skip = pytest.mark.skip(reason="wall clock budget, run with --timing")
+    for item in items:
+        if "timing" in item.keywords:
+            item.add_marker(skip)
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from kyles_feedreader import backoff
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader.defaults import backoff_base, backoff_max
+
+
+NOW = datetime(2024, 5, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def session():
+    yield dbi.DBInterface(":memory:")
+
+
+def test_parse_retry_after():
+    assert backoff.parse_retry_after("120", NOW) == timedelta(seconds=120)
+    assert backoff.parse_retry_after("Wed, 01 May 2024 13:00:00 GMT", NOW) == timedelta(hours=1)
+    assert backoff.parse_retry_after("Wed, 01 May 2024 11:00:00 GMT", NOW) == timedelta()
+    assert backoff.parse_retry_after("soon", NOW) is None
+    assert backoff.parse_retry_after(None, NOW) is None
+
+
+def test_backoff_delay():
+    for failures in range(1, 6):
+        delay = backoff.backoff_delay(failures)
+        expected = backoff_base * 2 ** (failures - 1)
+        assert expected / 2 <= delay <= expected
+    assert backoff.backoff_delay(100) <= backoff_max
+
+
+def test_failures_disable(session):
+    feed = session.add_feed("Foo", "url", "homepage", session.root_group)
+    assert backoff.is_due(feed, NOW)
+
+    for n in range(1, 4):
+        session.update_feed(feed, **backoff.failure_updates(feed, "Not Found", NOW, 404, limit=3))
+        assert feed.failures == n
+        assert feed.retry_at > NOW
+        assert not backoff.is_due(feed, NOW)
+    assert feed.disabled
+    assert [f.url for f in session.get_suspended_feeds(NOW)] == ["url"]
+
+    # Disabled feeds stay suspended once their retry time has passed.
+    assert not backoff.is_due(feed, NOW + backoff_max * 2)
+
+    session.update_feed(feed, **backoff.reset_updates())
+    feed = session.find_feed_from_url("url")
+    assert backoff.is_due(feed, NOW)
+    assert feed.failures == 0
+    assert feed.last_error is None
+    assert session.get_suspended_feeds(NOW) == []
+
+
+def test_throttling(session):
+    feed = session.add_feed("Foo", "url", "homepage", session.root_group)
+    for _ in range(5):
+        session.update_feed(feed, **backoff.failure_updates(feed, "Too Many Requests", NOW, 429,
+                                                            timedelta(minutes=5), limit=3))
+    assert feed.failures == 5
+    assert not feed.disabled
+    assert feed.retry_at == NOW + timedelta(minutes=5)
+
+    session.update_feed(feed, **backoff.success_updates(feed))
+    assert feed.failures == 0
+    assert backoff.is_due(feed, NOW)
+    assert backoff.success_updates(feed) == {}
@@ -0,0 +1,67 @@
+import gzip
+import json
+import sqlite3
+
+import pytest
+
+from kyles_feedreader import backup
+from kyles_feedreader import db_interface as dbi
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "db.sqlite"
+    session = dbi.DBInterface(str(path))
+    f = session.add_feed("Foo", "url", "homepage", session.root_group)
+    session.update_feed(f, user_name="user", password="secret")
+    session.add_feed_items(f, [{"title": f"Foo{n}", "url": f"Foo{n}URL"} for n in range(50)])
+    session.db.disconnect()
+    yield path
+
+
+def count_items(path):
+    con = sqlite3.connect(path)
+    try:
+        return con.execute('SELECT count(*) FROM "FeedItem"').fetchone()[0]
+    finally:
+        con.close()
+
+
+def test_backup(db_path, tmp_path):
+    steps = []
+    target = backup.backup(db_path, tmp_path / "out" / "backup.sqlite", pages=1,
+                           progress=lambda status, remaining, total: steps.append(remaining))
+    assert target == tmp_path / "out" / "backup.sqlite"
+    assert count_items(target) == 50
+    assert len(steps) > 1
+    assert not list(target.parent.glob("*.part*"))
+
+
+def test_backup_waits_between_steps(db_path, tmp_path, monkeypatch):
+    steps = []
+    waits = []
+    monkeypatch.setattr(backup.time, "sleep", waits.append)
+    backup.backup(db_path, tmp_path / "backup.sqlite", pages=1, sleep=0.5,
+                  progress=lambda status, remaining, total: steps.append(remaining))
+    # After every step but the last, which has nothing left to copy.
+    assert steps[-1] == 0
+    assert waits == [0.5] * (len(steps) - 1)
+
+
+def test_compressed_snapshot(db_path, tmp_path):
+    target = backup.backup(db_path, tmp_path / "snap.sqlite", compress=True, snapshot=True)
+    assert target.name == "snap.sqlite.gz"
+
+    restored = tmp_path / "restored.sqlite"
+    with gzip.open(target, "rb") as f:
+        restored.write_bytes(f.read())
+    assert count_items(restored) == 50
+
+    con = sqlite3.connect(restored)
+    assert con.execute('SELECT "user_name", "password" FROM "Feed"').fetchall() == [(None, None)]
+    con.close()
+
+    manifest = json.loads((tmp_path / "snap.sqlite.gz.json").read_text())
+    assert manifest["tables"]["FeedItem"] == 50
+    assert manifest["schema_version"] >= 1
+    assert len(manifest["sha256"]) == 64
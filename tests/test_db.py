@@ -79,6 +79,15 @@ def test_delete_feed(session):
     assert not f_list
 
 
+def test_iter_feeds(session):
+    session.add_feeds({"name": f"Feed {n}", "url": f"url{n}", "home_page": "homepage", "group_data": session.root_group}
+                      for n in range(7))
+    session.delete_feed(session.find_feed_from_url("url3"))
+    feeds = list(session.iter_feeds(batch_size=3))
+    assert [f.url for f in feeds] == [f"url{n}" for n in range(7) if n != 3]
+    assert list(session.iter_feeds(batch_size=6)) == feeds
+
+
 def test_update_feed(session):
     f = session.add_feed("Foo", "url", "homepage", session.root_group)
 
@@ -262,3 +271,47 @@ def test_unread_interface(session):
     # assert not session.get_group_feed_items(session.root_group, unread_only=True)
 
 
+
+
+def test_item_pages(session):
+    from datetime import datetime
+
+    g = session.add_find_group("Foo", session.root_group)
+    sub = session.add_find_group("Bar", g)
+    f0 = session.add_feed("Foo0", "url0", "homepage", g)
+    f1 = session.add_feed("Foo1", "url1", "homepage", sub)
+    # Two items share each timestamp and two have none, which sort last.
+    session.add_feed_items(f0, [{"title": f"A{n}", "url": f"A{n}", "timestamp": datetime(2020, 1, 1 + n // 2)}
+                                for n in range(10)])
+    session.add_feed_items(f1, [{"title": f"B{n}", "url": f"B{n}", "timestamp": datetime(2020, 2, 1 + n)}
+                                for n in range(3)] + [{"title": f"C{n}", "url": f"C{n}"} for n in range(2)])
+    expected = sorted(session.get_all_feed_items(unread_only=False),
+                      key=lambda i: (i.timestamp is not None, i.timestamp or datetime.min, i.id), reverse=True)
+    expected = [i.id for i in expected]
+
+    # Walking forwards and backwards a few rows at a time visits every item once, in order.
+    walked = []
+    page = session.get_item_page(unread_only=False, limit=4)
+    while page:
+        walked += [i.id for i in page]
+        page = session.get_item_page(unread_only=False, after=page[-1].cursor, limit=4)
+    assert walked == expected
+
+    walked = []
+    page = session.get_item_page(unread_only=False, before=dbi.ITEM_LIST_END, limit=3)
+    while page:
+        walked = [i.id for i in page] + walked
+        page = session.get_item_page(unread_only=False, before=page[0].cursor, limit=3)
+    assert walked == expected
+
+    group_items = session.get_item_page(group=g, unread_only=False, limit=100)
+    assert len(group_items) == 15
+    assert group_items[0].feed_name == "Foo1"
+    assert [i.title for i in session.get_item_page(feed=f0, limit=2)] == ["A9", "A8"]
+    assert session.count_items(group=sub, unread_only=False) == 5
+
+    first = session.get_item_page(feed=f0, limit=1)[0]
+    session.mark_feed_item_read(first)
+    assert session.count_items(feed=f0) == 9
+    assert first.id not in [i.id for i in session.get_item_page(feed=f0, limit=100)]
+    assert session.get_item_page(starred_only=True, unread_only=False) == []
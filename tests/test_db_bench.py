@@ -0,0 +1,84 @@
+import pytest
+
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader import dataset, db_bench
+
+
+SPEC = dataset.DatasetSpec(depth=3, fanout=2, feeds=20, items=1000, text_size=50)
+
+
+@pytest.fixture(scope="module")
+def session():
+    session = dbi.DBInterface(":memory:")
+    dataset.generate(session, SPEC)
+    yield session
+
+
+def test_generate(session):
+    feeds = session.get_feeds()
+    assert len(feeds) == SPEC.feeds
+    items = session.get_all_feed_items(unread_only=False)
+    assert len(items) == SPEC.items
+    assert len({i.url for i in items}) == SPEC.items
+
+    # A deep tree, and a few feeds holding most of the items.
+    depth = max(e.depth for e in session.iter_tree() if e.url is None)
+    assert depth == SPEC.depth
+    counts = sorted((len(session.get_feed_items(f, unread_only=False)) for f in feeds), reverse=True)
+    assert sum(counts[:4]) > SPEC.items / 2
+
+    # Read items are the oldest of their feed and always viewed.
+    for feed in feeds:
+        feed_items = sorted(session.get_feed_items(feed, unread_only=False), key=lambda i: i.timestamp)
+        reads = [i.read for i in feed_items]
+        assert reads == sorted(reads, reverse=True)
+        assert all(i.viewed for i in feed_items if i.read)
+    assert 0 < len(session.get_all_feed_items()) < SPEC.items
+
+
+def test_generate_is_deterministic():
+    first, second = dbi.DBInterface(":memory:"), dbi.DBInterface(":memory:")
+    dataset.generate(first, SPEC)
+    dataset.generate(second, SPEC)
+    assert list(first.iter_item_rows()) == list(second.iter_item_rows())
+    with pytest.raises(ValueError, match="empty"):
+        dataset.generate(first, SPEC)
+
+
+def test_open_dataset(tmp_path):
+    spec = dataset.DatasetSpec(depth=1, feeds=3, items=30)
+    session = dataset.open_dataset(tmp_path, "tiny", spec)
+    assert len(session.get_feeds()) == 3
+    session.db.disconnect()
+    assert [p.name for p in tmp_path.iterdir()] == [f"tiny-{spec.key}.sqlite"]
+    # The cached copy is reused.
+    assert len(dataset.open_dataset(tmp_path, "tiny", spec).get_feeds()) == 3
+
+
+def test_run_leaves_data_alone(session):
+    unread = len(session.get_all_feed_items())
+    timings = db_bench.run(session, repeat=2)
+    names = [t.case for t in timings]
+    assert {"add_feed_items", "get_feeds", "mark_all_items_read", "any_has_unviewed_feed_items"} <= set(names)
+    assert all(len(t.runs) == 2 and t.best > 0 for t in timings)
+    assert len(session.get_all_feed_items()) == unread
+    assert len(session.get_all_feed_items(unread_only=False)) == SPEC.items
+
+    assert [t.case for t in db_bench.run(session, repeat=1, select="mark_*_items_read")] == [
+        "mark_feed_items_read", "mark_group_items_read", "mark_all_items_read"]
+
+
+def test_baselines(tmp_path):
+    path = tmp_path / "baselines.json"
+    assert db_bench.load_baselines(path, "small") == {}
+    db_bench.save_baselines(path, "small", [db_bench.Timing("a", [0.1, 0.2]), db_bench.Timing("b", [0.01])])
+    db_bench.save_baselines(path, "large", [db_bench.Timing("a", [1.0])])
+    db_bench.save_baselines(path, "small", [db_bench.Timing("b", [0.02])])
+    assert db_bench.load_baselines(path, "small") == {"a": 0.1, "b": 0.02}
+
+    timings = [db_bench.Timing("a", [0.2]), db_bench.Timing("b", [0.021]), db_bench.Timing("c", [1.0]),
+               db_bench.Timing("d", [0.003])]
+    comparisons = db_bench.compare(timings, {"a": 0.1, "b": 0.02, "d": 0.0015})
+    assert [c.regressed for c in comparisons] == [True, False, False, False]
+    assert comparisons[0].change == pytest.approx(1.0)
+    assert comparisons[2].change is None
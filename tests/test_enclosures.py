@@ -0,0 +1,157 @@
+import threading
+from datetime import datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader import enclosures, fetching
+
+
+CONTENT = bytes(range(256)) * 1024
+
+
+class EnclosureHandler(BaseHTTPRequestHandler):
+    ranges = True
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("Range")))
+        if self.path.startswith("/missing"):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and self.ranges:
+            start = int(range_header.split("=")[1].rstrip("-"))
+            if start >= len(CONTENT):
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{len(CONTENT)}")
+                self.end_headers()
+                return
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}")
+        else:
+            self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Length", str(len(CONTENT) - start))
+        self.end_headers()
+        self.wfile.write(CONTENT[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    EnclosureHandler.ranges = True
+    EnclosureHandler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), EnclosureHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    fetching.configure(min_interval=0)
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    fetching.configure()
+    httpd.shutdown()
+
+
+@pytest.fixture
+def session(server):
+    session = dbi.DBInterface(":memory:")
+    f = session.add_feed("Podcast", "url0", "homepage", session.root_group)
+    session.add_feed_items(f, [{"title": f"Episode {n}", "url": f"item{n}", "timestamp": datetime(2020, 1, n + 1),
+                                "enclosure_url": f"{server}/{'missing' if n == 3 else 'episode'}{n}.mp3"}
+                               for n in range(4)])
+    yield session
+
+
+def test_fetch(session, tmp_path):
+    items = session.get_pending_enclosures()
+    assert [i.title for i in items] == [f"Episode {n}" for n in range(4)]
+
+    report = enclosures.fetch_enclosures(session, items, tmp_path, concurrency=2)
+    assert len(report.downloaded) == 3
+    assert [d.error for d in report.failed] == ["404 Not Found"]
+    assert report.size == 3 * len(CONTENT)
+    for d in report.downloaded:
+        assert d.path.read_bytes() == CONTENT
+        assert d.path.name == f"{d.item.id}.mp3"
+
+    assert [i.title for i in session.get_pending_enclosures()] == ["Episode 3"]
+    status = enclosures.status(session, tmp_path)
+    assert (status.items, status.downloaded, status.size) == (4, 3, 3 * len(CONTENT))
+
+
+def test_resume(session, tmp_path):
+    item = session.get_pending_enclosures(limit=1)[0]
+    path = enclosures.enclosure_path(item, tmp_path)
+    path.parent.mkdir(parents=True)
+    part = path.with_name(path.name + enclosures.PART_SUFFIX)
+    part.write_bytes(CONTENT[:1000])
+
+    result = enclosures.download(item, tmp_path)
+    assert result.error is None
+    assert result.resumed_from == 1000
+    assert path.read_bytes() == CONTENT
+    assert not part.exists()
+    assert EnclosureHandler.requests[-1][1] == "bytes=1000-"
+
+    # A complete part file that never got renamed.
+    path.rename(part)
+    result = enclosures.download(item, tmp_path)
+    assert result.error is None
+    assert path.read_bytes() == CONTENT
+
+
+def test_server_without_ranges(session, tmp_path):
+    EnclosureHandler.ranges = False
+    item = session.get_pending_enclosures(limit=1)[0]
+    path = enclosures.enclosure_path(item, tmp_path)
+    path.parent.mkdir(parents=True)
+    path.with_name(path.name + enclosures.PART_SUFFIX).write_bytes(b"x" * 1000)
+
+    result = enclosures.download(item, tmp_path)
+    assert result.resumed_from == 0
+    assert path.read_bytes() == CONTENT
+
+
+def test_cleanup(session, tmp_path):
+    enclosures.fetch_enclosures(session, session.get_pending_enclosures(), tmp_path)
+    stale = tmp_path / "99" / "1234.mp3"
+    stale.parent.mkdir()
+    stale.write_bytes(b"x")
+    abandoned = tmp_path / "99" / "1235.mp3.part"
+    abandoned.write_bytes(b"x")
+
+    report = enclosures.cleanup(session, tmp_path, quota=10 * len(CONTENT))
+    assert report.removed == 2
+    assert report.evicted == []
+    assert not stale.exists() and not abandoned.exists()
+
+    # Over quota only read items lose their enclosures, oldest first.
+    feed = session.find_feed_from_url("url0")
+    items = sorted(session.get_feed_items(feed, unread_only=False), key=lambda i: i.timestamp)
+    session.mark_feed_item_read(items[1])
+    session.mark_feed_item_read(items[0])
+    report = enclosures.cleanup(session, tmp_path, quota=len(CONTENT))
+    assert report.evicted == [items[0].id, items[1].id]
+    assert report.size == len(CONTENT)
+    assert not enclosures.enclosure_path(items[0], tmp_path).exists()
+    assert enclosures.enclosure_path(items[2], tmp_path).exists()
+    assert {i.id for i in session.get_pending_enclosures(unread_only=False)} == {items[0].id, items[1].id, items[3].id}
+
+
+def test_cleanup_leaves_other_files(session, tmp_path):
+    # Pointing --directory at a directory with other things in it mustn't lose them.
+    foreign = [tmp_path / "notes.txt", tmp_path / "99" / "holiday.jpg", tmp_path / "photos" / "1234.jpg",
+               tmp_path / "99" / "nested" / "1236.mp3"]
+    for path in foreign:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x")
+    stale = tmp_path / "99" / "1234.mp3"
+    stale.write_bytes(b"x")
+
+    report = enclosures.cleanup(session, tmp_path)
+    assert report.removed == 1
+    assert not stale.exists()
+    assert all(path.exists() for path in foreign)
@@ -0,0 +1,96 @@
+import datetime
+
+import gevent
+import pytest
+
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader import fetching
+from kyles_feedreader.controllers.feed_list import FeedListController
+from kyles_feedreader.feed_model import FeedManager, MIN_WAIT, due_feeds, next_check
+from kyles_feedreader.feed_server import FeedProfile, FeedServer
+
+
+@pytest.fixture(autouse=True)
+def no_host_limits():
+    fetching.configure(max_in_flight=8, min_interval=0)
+    yield
+    fetching.configure()
+
+
+def test_due_and_next_check():
+    session = dbi.DBInterface(":memory:")
+    now = datetime.datetime(2024, 1, 1)
+    hour = datetime.timedelta(hours=1)
+    new, recent, old, waiting, off = session.add_feeds(
+        {"name": name, "url": name, "home_page": name, "group_data": session.root_group}
+        for name in ["new", "recent", "old", "waiting", "off"])
+    new.last_update = None
+    recent.last_update = now - hour / 2
+    old.last_update = now - 2 * hour
+    waiting.last_update = now - 2 * hour
+    waiting.retry_at = now + hour / 4
+    off.disabled = True
+    for f in (new, recent, old, waiting, off):
+        f.update_rate = hour
+
+    assert {f.name for f in due_feeds([new, recent, old, waiting, off], now)} == {"new", "old", "waiting"}
+    assert next_check([recent, waiting, off], now, longest=3600) == 15 * 60
+    assert next_check([recent, off], now, longest=3600) == 30 * 60
+    assert next_check([recent], now, longest=60) == 60
+    assert next_check([old], now) == MIN_WAIT
+    assert next_check([], now, longest=60) == 60
+
+
+def test_worker_announces_new_items(tmp_path):
+    with FeedServer(FeedProfile(items=2, item_size=20)) as server:
+        # A file, the rounds run on another thread where an in-memory db would be a different, empty one.
+        session = dbi.DBInterface(tmp_path / "feeds.sqlite")
+        urls = [server.url(n) for n in range(6)]
+        # Due again as soon as they are updated, the worker comes back round every MIN_WAIT.
+        feeds = session.add_feeds({"name": url, "url": url, "home_page": url, "group_data": session.root_group,
+                                   "rate": datetime.timedelta(0)} for url in urls)
+        announced = []
+        manager = FeedManager(session, on_change=lambda: announced.append(1), concurrency=3, check_interval=60)
+        worker = gevent.spawn(manager.worker)
+        try:
+            with gevent.Timeout(10):
+                while manager.rounds == 0:
+                    gevent.sleep(0.01)
+                # Announced on the hub, a moment after the round wrote the items.
+                assert manager.new_feed_item_event.wait()
+            assert announced
+            assert manager.take_changes() == {f.id: 2 for f in feeds}
+            assert not manager.new_feed_item_event.is_set()
+            assert manager.take_changes() == {}
+
+            # The next round only finds the one item each feed has gained since.
+            server.generation += 1
+            manager.check_now()
+            with gevent.Timeout(10):
+                while manager.rounds < 2:
+                    gevent.sleep(0.01)
+                assert manager.new_feed_item_event.wait()
+            assert manager.take_changes() == {f.id: 1 for f in feeds}
+            assert manager.last_error is None
+        finally:
+            worker.kill()
+
+
+def test_feed_list_counts():
+    session = dbi.DBInterface(":memory:")
+    groups = session.add_find_group_paths([("a", "b")])
+    a, b = session.add_feeds({"name": name, "url": name, "home_page": name, "group_data": group,
+                              "entries": [{"title": f"{name}{i}", "url": f"{name}{i}"} for i in range(n)]}
+                             for name, group, n in [("a", groups[("a",)], 2), ("b", groups[("a", "b")], 3)])
+    controller = FeedListController(session)
+    a_id, b_id = groups[("a",)].id, groups[("a", "b")].id
+    assert controller.counts == {("all",): 5, ("feed", a.id): 2, ("feed", b.id): 3, ("group", a_id): 5,
+                                 ("group", b_id): 3}
+    assert controller.in_source(b.id, ("group", a_id))
+    assert not controller.in_source(a.id, ("group", b_id))
+
+    session.add_feed_items(session.get_feed(b.id), [{"title": "b3", "url": "b3"}])
+    controller.update_counts([b.id])
+    assert controller.counts[("group", a_id)] == 6
+    assert controller.counts[("feed", b.id)] == 4
+    assert controller.counts[("feed", a.id)] == 2
@@ -218,3 +218,113 @@ def test_not_modified(mock_fp_parse):
     t, r = feed_parsing.parse_feed('http://cdn.sheldoncomics.com/rss.xml', '"a740a10f5d95c83b973395fc75c97714"')
     assert t == feed_parsing.ResultType.NOT_MODIFIED
     assert not r
+
+
+def test_fetch_info():
+    fetch = feed_parsing.FetchInfo()
+    t, r = feed_parsing.parse_feed(feed_data, fetch_info=fetch)
+    assert r["name"] == "Sample Feed"
+    # Nothing came over HTTP, so only the time is filled in.
+    assert fetch.latency > 0
+    assert fetch.size == 0
+    assert fetch.status is None
+
+
+rss_data = """<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel>
+<title>Markup &amp; Dates</title>
+<link>http://example.com/</link>
+<description>&lt;p&gt;A feed &lt;b&gt;about&lt;/b&gt; things&lt;/p&gt;</description>
+<item>
+<title>Scripts</title>
+<link>http://example.com/1</link>
+<pubDate>Tue, 10 Jun 2003 09:41:01 +0200</pubDate>
+<description><![CDATA[<p>Kept <script>alert("dropped")</script>text<style>p { color: red }</style> &amp; more
+<a href="/relative">link</a><!-- a comment --> &lt;not a tag&gt;</p><applet>gone</applet><p>Second  paragraph</p>]]></description>
+<enclosure url="http://example.com/1.mp3" length="1" type="audio/mpeg"/>
+</item>
+<item>
+<title>Plain</title>
+<link>http://example.com/2</link>
+<pubDate>9 de mayo de 2021</pubDate>
+<description>  Just text, with an ampersand &amp;amp; in it.  </description>
+</item>
+<item>
+<title>Undated</title>
+<link>http://example.com/3</link>
+<description>&lt;ul&gt;&lt;li&gt;One&lt;li&gt;Two&lt;/ul&gt;Unclosed &lt;b&gt;bold</description>
+</item>
+</channel></rss>"""
+
+rdf_data = """<?xml version="1.0"?>
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns="http://purl.org/rss/1.0/"
+xmlns:dc="http://purl.org/dc/elements/1.1/">
+<channel rdf:about="http://example.net/"><title>RDF</title><link>http://example.net/</link>
+<description>An RSS 1.0 feed</description></channel>
+<item rdf:about="http://example.net/a"><title>A</title><link>http://example.net/a</link>
+<dc:date>2021-03-04T05:06:07-05:00</dc:date><description>&lt;em&gt;Emphasis&lt;/em&gt; here</description></item>
+</rdf:RDF>"""
+
+
+html_titles_data = """<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+<title type="html">Markup &lt;em&gt;in&lt;/em&gt;&lt;style&gt;em { color: red }&lt;/style&gt; titles</title>
+<link rel="alternate" href="http://example.org/"/>
+<entry>
+<title type="html">A &lt;b&gt;bold&lt;/b&gt;&lt;script&gt;alert(1)&lt;/script&gt; title</title>
+<link rel="alternate" href="http://example.org/1"/>
+<summary>Text</summary>
+</entry>
+<entry>
+<title type="xhtml"><div xmlns="http://www.w3.org/1999/xhtml">An <i>XHTML</i><applet>x</applet> title</div></title>
+<link rel="alternate" href="http://example.org/2"/>
+</entry>
+</feed>"""
+
+
+def _synthetic_feed():
+    from kyles_feedreader.feed_server import FeedProfile, FeedServer
+    with FeedServer(FeedProfile(items=10, item_size=300, html_rate=0.5)) as server:
+        return server.feed_document(0).decode()
+
+
+def _whitespace_normalized(results):
+    results = dict(results)
+    results["description"] = " ".join(results["description"].split())
+    results["entries"] = [{**e, "text": " ".join(e["text"].split())} if "text" in e else e
+                          for e in results["entries"]]
+    return results
+
+
+@pytest.mark.parametrize("document", [feed_data, rss_data, rdf_data, html_titles_data, _synthetic_feed()],
+                         ids=["atom", "rss", "rdf", "html titles", "synthetic"])
+def test_lean_parity(document):
+    full_type, full = feed_parsing.parse_feed(document)
+    lean_type, lean = feed_parsing.parse_feed(document, lean=True)
+    assert lean_type == full_type == feed_parsing.ResultType.NONE
+    assert _whitespace_normalized(lean) == _whitespace_normalized(full)
+
+
+def test_lean_text():
+    t, r = feed_parsing.parse_feed(rss_data, lean=True)
+    assert r["name"] == "Markup & Dates"
+    assert r["description"] == "A feed about things"
+    scripts, plain, undated = r["entries"]
+    assert scripts["text"] == "Kept text & more\nlink <not a tag>Second  paragraph"
+    assert scripts["enclosure_url"] == "http://example.com/1.mp3"
+    assert plain["text"] == "Just text, with an ampersand & in it."
+    assert undated["text"] == "OneTwoUnclosed bold"
+
+    t, r = feed_parsing.parse_feed(html_titles_data, lean=True)
+    assert r["name"] == "Markup <em>in</em> titles"
+    assert [e["title"] for e in r["entries"]] == ["A <b>bold</b> title", "An <i>XHTML</i> title"]
+
+
+def test_dates():
+    t, r = feed_parsing.parse_feed(rss_data)
+    scripts, plain, undated = r["entries"]
+    # dateparser goes first and keeps the time as written, without converting it to UTC.
+    assert feedparser.datetimes._date_handlers[0] is feed_parsing.handler
+    assert scripts["timestamp"] == datetime(2003, 6, 10, 9, 41, 1)
+    assert plain["timestamp"] == datetime(2021, 5, 9)
+    assert undated["timestamp"] is None
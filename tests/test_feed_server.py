@@ -0,0 +1,252 @@
+import datetime
+import time
+from http import HTTPStatus
+
+import pytest
+
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader import fetching, load_test, updater
+from kyles_feedreader.feed_parsing import parse_feed, FetchInfo, ResultType
+from kyles_feedreader.feed_server import FeedProfile, FeedServer
+
+
+@pytest.fixture(autouse=True)
+def no_host_limits():
+    fetching.configure(max_in_flight=8, min_interval=0)
+    yield
+    fetching.configure()
+
+
+def find(server, predicate, count=1):
+    found = [n for n in range(200) if predicate(server.traits(n))]
+    assert len(found) >= count
+    return found[:count]
+
+
+def test_etag_and_churn():
+    with FeedServer(FeedProfile(items=3, item_size=40)) as server:
+        r, f = parse_feed(server.url(0))
+        assert r == ResultType.NONE
+        assert f["name"] == "Feed 0"
+        assert [e["title"] for e in f["entries"]] == ["Item 2 of feed 0", "Item 1 of feed 0", "Item 0 of feed 0"]
+
+        fetch = FetchInfo()
+        r, _ = parse_feed(server.url(0), etag=f["etag"], fetch_info=fetch)
+        assert r == ResultType.NOT_MODIFIED
+        assert fetch.status == HTTPStatus.NOT_MODIFIED
+
+        server.generation += 1
+        r, f = parse_feed(server.url(0), etag=f["etag"])
+        assert f["entries"][0]["title"] == "Item 3 of feed 0"
+
+
+def test_failures():
+    profile = FeedProfile(items=1, redirect_rate=0.3, auth_rate=0.3)
+    with FeedServer(profile) as server:
+        moved, = find(server, lambda t: t.redirect and not t.auth)
+        r, f = parse_feed(server.url(moved))
+        assert ResultType.PERMANENT_REDIRECT in r
+        assert f["new_url"] == f"{server.base_url}/moved/{moved}"
+
+        locked, = find(server, lambda t: t.auth)
+        r, f = parse_feed(server.url(locked))
+        assert r == ResultType.AUTH_ERROR
+
+        server.profile.error_rate = 1.0
+        r, f = parse_feed(server.url(0))
+        assert r == ResultType.HTTP_ERROR
+        assert f["status"] == HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+def test_recorded(tmp_path):
+    with FeedServer(FeedProfile(items=2)) as server:
+        (tmp_path / "recorded.xml").write_bytes(server.feed_document(7))
+    with FeedServer(directory=tmp_path) as server:
+        r, f = parse_feed(server.file_url("recorded.xml"))
+        assert f["name"] == "Feed 7"
+        r, f = parse_feed(server.file_url("recorded.xml"), etag=f["etag"])
+        assert r == ResultType.NOT_MODIFIED
+        assert server.statuses[HTTPStatus.NOT_MODIFIED] == 1
+
+
+def test_update_feeds():
+    with FeedServer(FeedProfile(items=2, item_size=20, etag_rate=0.5, auth_rate=0.2)) as server:
+        session = dbi.DBInterface(":memory:")
+        urls = [server.url(n) for n in range(10)]
+        session.add_feeds({"name": url, "url": url, "home_page": url, "group_data": session.root_group}
+                          for url in urls)
+        locked = sum(server.traits(n).auth for n in range(10))
+        with_etag = sum(server.traits(n).etag and not server.traits(n).auth for n in range(10))
+
+        report = updater.update_feeds(session, concurrency=4)
+        assert report.fetched == 10
+        assert report.failed == locked
+        assert report.new_items == 2 * (10 - locked)
+
+        report = updater.update_feeds(session, concurrency=4)
+        assert report.suspended == locked
+        assert report.not_modified == with_etag
+        assert report.new_items == 0
+
+
+def test_update_skips_fresh_feeds(tmp_path):
+    with FeedServer(FeedProfile(items=2, max_age=600)) as server:
+        session = dbi.DBInterface(tmp_path / "feeds.sqlite")
+        urls = [server.url(n) for n in range(3)]
+        feeds = session.add_feeds({"name": url, "url": url, "home_page": url, "group_data": session.root_group}
+                                  for url in urls)
+
+        report = updater.update_feeds(session)
+        assert (report.fetched, report.fresh) == (3, 0)
+        now = datetime.datetime.utcnow()
+        for feed in feeds:
+            fresh_until = session.get_feed(feed.id).fresh_until
+            assert now < fresh_until <= now + datetime.timedelta(seconds=600)
+
+        # The server said not to ask again for ten minutes.
+        requests = sum(server.statuses.values())
+        report = updater.update_feeds(session)
+        assert (report.fetched, report.fresh) == (0, 3)
+        assert sum(server.statuses.values()) == requests
+
+        report = updater.update_feeds(session, ignore_cache=True)
+        assert (report.fetched, report.fresh) == (3, 0)
+        assert sum(server.statuses.values()) == requests + 3
+
+
+malformed_feed = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Malformed</title><link>http://example.com/</link>
+<item><link>http://example.com/untitled</link><description>No title</description></item>
+<item><title>No link</title></item>
+<item><title>Whole</title><link>http://example.com/whole</link><enclosure type="audio/mpeg"/></item>
+</channel></rss>"""
+
+
+def test_update_survives_bad_feeds(tmp_path, monkeypatch):
+    with FeedServer(FeedProfile(items=2)) as server:
+        for n in range(3):
+            (tmp_path / f"good{n}.xml").write_bytes(server.feed_document(n))
+    (tmp_path / "malformed.xml").write_bytes(malformed_feed)
+    with FeedServer(directory=tmp_path) as server:
+        session = dbi.DBInterface(tmp_path / "feeds.sqlite")
+        urls = [server.file_url(f"good{n}.xml") for n in range(3)] + [server.file_url("malformed.xml")]
+        feeds = session.add_feeds({"name": url, "url": url, "home_page": url, "group_data": session.root_group}
+                                  for url in urls)
+
+        # Items missing a title or link don't stop the rest of the feed being read.
+        report = updater.update_feeds(session, concurrency=2)
+        assert (report.fetched, report.failed, report.new_items) == (4, 0, 8)
+        assert sorted((i.title, i.url) for i in session.get_feed_items(feeds[-1])) == [
+            ("Whole", "http://example.com/whole"), ("http://example.com/untitled", "http://example.com/untitled")]
+
+        # Nor does a feed parse_feed raises on stop the others being written.
+        def parse_or_raise(url, **kwargs):
+            if url == urls[0]:
+                raise AttributeError("object has no attribute 'title'")
+            return parse_feed(url, **kwargs)
+
+        monkeypatch.setattr(updater, "parse_feed", parse_or_raise)
+        report = updater.update_feeds(session, concurrency=2, ignore_cache=True)
+        assert (report.fetched, report.failed) == (4, 1)
+        assert session.get_feed(feeds[0].id).last_error == "AttributeError: object has no attribute 'title'"
+
+
+def test_size_limit():
+    with FeedServer(FeedProfile(items=20, item_size=200)) as server:
+        fetching.configure(max_in_flight=8, min_interval=0, max_response=1000)
+        fetch = FetchInfo()
+        r, f = parse_feed(server.url(0), fetch_info=fetch)
+        assert r == ResultType.ERROR
+        assert "over 1000 bytes" in f["error"]
+        assert fetch.reserved == 0
+
+
+def test_update_within_memory_budget(tmp_path):
+    with FeedServer(FeedProfile(items=5, item_size=200)) as server:
+        session = dbi.DBInterface(tmp_path / "feeds.sqlite")
+        urls = [server.url(n) for n in range(12)]
+        session.add_feeds({"name": url, "url": url, "home_page": url, "group_data": session.root_group}
+                          for url in urls)
+        fetch = FetchInfo()
+        parse_feed(urls[0], fetch_info=fetch, budget=fetching.MemoryBudget())
+        one_feed = fetch.reserved
+        assert one_feed == fetching.parsed_size(fetch.size) > 0
+
+        # Room for two feeds, so the fetches have to wait for the writer.
+        report = updater.update_feeds(session, concurrency=4, memory=2 * one_feed + 1)
+        assert report.fetched == 12
+        assert report.new_items == 60
+        assert 0 < report.peak_memory <= 2 * one_feed + 1
+
+
+def test_run_update_benchmark():
+    results = load_test.run_update_benchmark(5, FeedProfile(items=2, item_size=20), passes=2, concurrency=2,
+                                             churn=True)
+    assert [r.report.fetched for r in results] == [5, 5]
+    assert [r.report.new_items for r in results] == [10, 5]
+    assert all(r.feeds_per_second > 0 for r in results)
+
+
+def test_run_parse_benchmark():
+    full, lean = load_test.run_parse_benchmark(3, FeedProfile(items=2, item_size=50, html_rate=0.5), repeat=1)
+    assert (full.lean, lean.lean) == (False, True)
+    assert full.feeds == lean.feeds == 3
+    assert lean.feeds_per_second > 0
+
+
+def test_prioritize(tmp_path):
+    session = dbi.DBInterface(tmp_path / "feeds.sqlite")
+    session.add_feeds({"name": name, "url": name, "home_page": name, "group_data": session.root_group}
+                      for name in ("stale", "fresh", "prolific", "favourite"))
+    feeds = {f.name: f for f in session.get_feeds()}
+    now = datetime.datetime.utcnow()
+    hour = datetime.timedelta(hours=1)
+    for name, behind in (("stale", 3), ("fresh", 1), ("prolific", 1), ("favourite", 1)):
+        session.update_feed(feeds[name], last_update=now - behind * hour, update_rate=hour)
+    for _ in range(3):
+        session.record_fetch(feeds["prolific"], 0.1, 100, 200, new_items=5)
+    session.update_feed(feeds["favourite"], priority=1)
+
+    assert updater.expected_value(feeds["fresh"], now) == pytest.approx(1.0)
+    assert updater.expected_value(feeds["stale"], now, (3, 0)) == pytest.approx(0.75)
+    assert updater.expected_value(feeds["favourite"], now) == pytest.approx(2.0)
+    ordered = updater.prioritize(session, session.get_feeds(), now)
+    assert [f.name for f in ordered] == ["prolific", "stale", "favourite", "fresh"]
+
+
+def test_update_is_written_whole(tmp_path, monkeypatch):
+    with FeedServer(FeedProfile(items=3, item_size=20)) as server:
+        session = dbi.DBInterface(tmp_path / "feeds.sqlite")
+        session.add_feed("Feed", server.url(0), "homepage", session.root_group)
+
+        def broken_record_fetch(*args, **kwargs):
+            raise RuntimeError("disk full")
+
+        monkeypatch.setattr(session, "record_fetch", broken_record_fetch)
+        with pytest.raises(RuntimeError):
+            updater.update_feeds(session)
+        feed = session.find_feed_from_url(server.url(0))
+        assert not feed.etag
+        assert session.get_feed_items(feed) == []
+
+
+def test_update_deadline(tmp_path):
+    with FeedServer(FeedProfile(items=2, item_size=20, latency=0.2)) as server:
+        session = dbi.DBInterface(tmp_path / "feeds.sqlite")
+        urls = [server.url(n) for n in range(20)]
+        session.add_feeds({"name": url, "url": url, "home_page": url, "group_data": session.root_group}
+                          for url in urls)
+        started = time.monotonic()
+        report = updater.update_feeds(session, concurrency=2, deadline=0.5)
+        assert time.monotonic() - started < 0.8
+        assert 0 < report.fetched < 20
+        assert report.fetched + len(report.unfinished) == 20
+        unfinished = {f.url for f in report.unfinished}
+        for url in urls:
+            feed = session.find_feed_from_url(url)
+            items = session.get_feed_items(feed)
+            # Every feed was written with all its items or not at all.
+            if url in unfinished:
+                assert (feed.etag, items) == (None, [])
+            else:
+                assert len(items) == 2
@@ -0,0 +1,73 @@
+import pytest
+
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader import fetch_stats
+
+
+@pytest.fixture
+def session():
+    session = dbi.DBInterface(":memory:")
+    slow = session.add_feed("Slow", "url0", "homepage", session.root_group)
+    broken = session.add_feed("Broken", "url1", "homepage", session.root_group)
+    for n in range(4):
+        session.record_fetch(slow, 2.0, 50_000, 200, new_items=n % 2)
+    session.record_fetch(slow, 0.1, 0, 304, not_modified=True)
+    session.record_fetch(broken, 0.5, 10, 503, error=True)
+    session.record_fetch(broken, 0.5, 1000, 200, new_items=3)
+    yield session
+
+
+def test_get_fetch_stats(session):
+    by_name = {s.name: s for s in session.get_fetch_stats()}
+    slow = by_name["Slow"]
+    assert slow.fetches == 5
+    assert slow.latency == pytest.approx(8.1)
+    assert slow.size == 200_000
+    assert slow.not_modified == 1
+    assert slow.wasted == 2
+    assert slow.new_items == 2
+    assert slow.last_status == 304
+    assert slow.error_rate == 0
+
+    broken = by_name["Broken"]
+    assert broken.error_rate == 0.5
+    assert broken.wasted == 0
+    assert broken.last_status == 200
+
+
+def test_get_feed_yields(session):
+    slow = session.find_feed_from_url("url0")
+    broken = session.find_feed_from_url("url1")
+    # Failed refreshes found nothing because they didn't get through, they don't count.
+    assert session.get_feed_yields() == {slow.id: (5, 2), broken.id: (1, 3)}
+
+
+def test_history_is_bounded(session):
+    feed = session.find_feed_from_url("url1")
+    for _ in range(5):
+        session.record_fetch(feed, 0.1, 100, 200, history=3)
+    broken = next(s for s in session.get_fetch_stats() if s.name == "Broken")
+    assert broken.fetches == 3
+    assert broken.errors == 0
+
+
+def test_deleting_feed_drops_stats(session):
+    session.delete_feed(session.find_feed_from_url("url1"))
+    assert [s.name for s in session.get_fetch_stats()] == ["Slow"]
+
+
+def test_rank(session):
+    stats = session.get_fetch_stats()
+    assert [s.name for s in fetch_stats.rank(stats, "time")] == ["Slow", "Broken"]
+    assert [s.name for s in fetch_stats.rank(stats, "errors")] == ["Broken", "Slow"]
+    assert [s.name for s in fetch_stats.rank(stats, "wasted")] == ["Slow", "Broken"]
+
+
+def test_write_prometheus(session, tmp_path):
+    path = tmp_path / "kfr.prom"
+    fetch_stats.write_prometheus(session.get_fetch_stats(), path)
+    lines = path.read_text().splitlines()
+    assert "# TYPE kfr_feed_fetch_bytes gauge" in lines
+    assert 'kfr_feed_fetch_bytes{feed="Slow",url="url0"} 200000' in lines
+    assert 'kfr_feed_fetch_errors{feed="Broken",url="url1"} 1' in lines
+    assert not (tmp_path / "kfr.prom.tmp").exists()
@@ -0,0 +1,145 @@
+import socket
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from kyles_feedreader import fetching
+
+
+def test_host_of():
+    assert fetching.host_of("https://Example.com:8080/feed") == "example.com"
+    assert fetching.host_of("/home/kyle/feed.xml") is None
+    assert fetching.host_of("<rss></rss>") is None
+
+
+def test_freshness_lifetime():
+    assert fetching.freshness_lifetime({"cache-control": "public, max-age=600"}) == timedelta(minutes=10)
+    assert fetching.freshness_lifetime({"cache-control": "max-age=600", "age": "60"}) == timedelta(minutes=9)
+    assert fetching.freshness_lifetime({"cache-control": "max-age=600, no-cache"}) is None
+    assert fetching.freshness_lifetime({"cache-control": "max-age=0"}) is None
+    # max-age wins over Expires.
+    assert fetching.freshness_lifetime({"cache-control": "max-age=60", "date": "Wed, 01 May 2024 12:00:00 GMT",
+                                        "expires": "Wed, 01 May 2024 13:00:00 GMT"}) == timedelta(minutes=1)
+    assert fetching.freshness_lifetime({"date": "Wed, 01 May 2024 12:00:00 GMT",
+                                        "expires": "Wed, 01 May 2024 13:00:00 GMT"}) == timedelta(hours=1)
+    assert fetching.freshness_lifetime({"expires": "0"}) is None
+    assert fetching.freshness_lifetime({}) is None
+    assert fetching.freshness_lifetime({"cache-control": "max-age=31536000"}, timedelta(days=1)) == timedelta(days=1)
+
+
+def test_dns_cache(monkeypatch):
+    calls = Counter()
+    getaddrinfo = socket.getaddrinfo
+
+    def counting_getaddrinfo(host, port, *args, **kwargs):
+        calls[host] += 1
+        return getaddrinfo("127.0.0.1", port, *args, **kwargs)
+
+    monkeypatch.setattr(socket, "getaddrinfo", counting_getaddrinfo)
+    cache = fetching.DNSCache(ttl=60)
+    assert cache.resolve("example.com", 80) == cache.resolve("example.com", 80)
+    cache.resolve("example.org", 80)
+    assert calls == {"example.com": 1, "example.org": 1}
+
+    cache.ttl = 0
+    cache.resolve("example.net", 80)
+    cache.resolve("example.net", 80)
+    assert calls["example.net"] == 2
+
+
+def test_host_limiter():
+    limiter = fetching.HostLimiter(max_in_flight=2, min_interval=0.05)
+    lock = threading.Lock()
+    in_flight = Counter()
+    peak = Counter()
+    starts = []
+
+    def request(host):
+        with limiter.slot(host):
+            with lock:
+                in_flight[host] += 1
+                peak[host] = max(peak[host], in_flight[host])
+                if host == "a":
+                    starts.append(time.monotonic())
+            time.sleep(0.02)
+            with lock:
+                in_flight[host] -= 1
+
+    threads = [threading.Thread(target=request, args=(h,)) for h in ["a"] * 4 + ["b"] * 2 + [None] * 4]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert peak["a"] <= 2
+    assert peak[None] == 4
+    starts.sort()
+    assert all(later - earlier >= 0.045 for earlier, later in zip(starts, starts[1:]))
+
+
+def test_fetch_all_interleaves_hosts():
+    urls = [f"http://big.example/{n}" for n in range(8)] + [f"http://small{n}.example/" for n in range(4)]
+    lock = threading.Lock()
+    in_flight = Counter()
+    peak = Counter()
+    order = []
+
+    def fetch(url):
+        host = fetching.host_of(url)
+        with lock:
+            in_flight[host] += 1
+            peak[host] = max(peak[host], in_flight[host])
+            order.append(host)
+        time.sleep(0.01)
+        with lock:
+            in_flight[host] -= 1
+        return url.upper()
+
+    results = list(fetching.fetch_all(urls, lambda u: u, fetch, concurrency=4, per_host=2))
+    assert sorted(results) == sorted((u, u.upper()) for u in urls)
+    assert peak["big.example"] == 2
+    # The small hosts get started before the big one's queue is worked through.
+    assert set(order[:4]) >= {"small0.example", "small1.example"}
+
+
+def test_fetch_all_reads_items_as_it_goes():
+    read = 0
+    ahead = []
+
+    def items():
+        nonlocal read
+        for n in range(50):
+            read += 1
+            yield f"http://host{n % 5}.example/{n}"
+
+    done = 0
+    for _ in fetching.fetch_all(items(), lambda u: u, lambda u: u, concurrency=2, per_host=1, lookahead=4):
+        done += 1
+        ahead.append(read - done)
+    assert done == 50
+    # Never more than the lookahead queued and concurrency started ahead of what was handed back.
+    assert max(ahead) <= 4 + 2
+
+
+def test_memory_budget():
+    budget = fetching.MemoryBudget(100)
+    budget.acquire(60)
+    acquired = threading.Event()
+
+    def acquire():
+        budget.acquire(60)
+        acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    assert not acquired.wait(0.05)
+    budget.release(60)
+    assert acquired.wait(1)
+    thread.join()
+    assert (budget.used, budget.peak, budget.waits) == (60, 60, 1)
+
+    # Anything fits when nothing is held.
+    budget.release(60)
+    budget.acquire(500)
+    assert budget.peak == 500
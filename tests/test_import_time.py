@@ -0,0 +1,61 @@
+import os
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+
+# Cumulative import time allowed for each entry point module, in microseconds. Machines vary too much for this to
+# hold everywhere, so it is only checked with --timing.
+IMPORT_BUDGET_US = 200_000
+
+HEAVY_MODULES = ("feedparser", "dateparser", "bs4", "lxml", "asciimatics", "gevent")
+# What "kfr-cli --help" must get by without, the slowest of them to import.
+HELP_UNUSED = ("dateparser", "gevent", "asciimatics")
+
+package_root = pathlib.Path(__file__).parent.parent
+
+
+def _run(*args: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(package_root), env.get("PYTHONPATH")]))
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, env=env, check=True)
+
+
+def import_times(module: str) -> dict[str, int]:
+    result = _run("-X", "importtime", "-c", f"import {module}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("module", ["kyles_feedreader.cli", "kyles_feedreader.__main__"])
+def test_entry_point_imports(module):
+    times = import_times(module)
+    heavy = [m for m in times if m.split(".")[0] in HEAVY_MODULES]
+    assert not heavy
+
+
+def test_cli_help_imports():
+    # Everything the command line imports to print its help, subcommands included.
+    result = _run("-c", "import sys\n"
+                        "from kyles_feedreader.cli import cli\n"
+                        "try:\n"
+                        "    cli(['--help'])\n"
+                        "except SystemExit:\n"
+                        "    pass\n"
+                        "print(' '.join(sys.modules))")
+    loaded = {name.split(".")[0] for name in result.stdout.splitlines()[-1].split()}
+    assert "Usage:" in result.stdout
+    assert not loaded & set(HELP_UNUSED)
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("module", ["kyles_feedreader.cli", "kyles_feedreader.__main__"])
+def test_entry_point_import_time(module):
+    assert import_times(module)[module] < IMPORT_BUDGET_US
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from kyles_feedreader import instrumentation
+
+
+@pytest.fixture
+def recorder():
+    recorder = instrumentation.start()
+    yield recorder
+    instrumentation.stop()
+
+
+def test_off_is_free():
+    assert instrumentation.stop() is None
+    with instrumentation.feed("url"), instrumentation.phase(instrumentation.FETCH):
+        pass
+
+    @instrumentation.timed(instrumentation.DB)
+    def write(x):
+        return x + 1
+
+    assert write(1) == 2
+
+
+def test_nested_phases_are_exclusive(recorder, monkeypatch):
+    # A clock the test moves on, so the totals are exact rather than whatever the sleeps came to.
+    clock = [100.0]
+    monkeypatch.setattr(instrumentation, "perf_counter", lambda: clock[0])
+    with instrumentation.phase(instrumentation.PARSE):
+        clock[0] += 0.02
+        with instrumentation.phase(instrumentation.DATE):
+            clock[0] += 0.05
+        clock[0] += 0.01
+
+    parse = recorder.phases[instrumentation.PARSE]
+    date = recorder.phases[instrumentation.DATE]
+    assert parse.total == pytest.approx(0.03)
+    assert date.total == pytest.approx(0.05)
+    assert sum(parse.histogram) == sum(date.histogram) == 1
+
+
+def test_per_feed(recorder):
+    @instrumentation.timed(instrumentation.DB)
+    def write():
+        time.sleep(0.001)
+
+    for url in ["url0", "url1"]:
+        with instrumentation.feed(url):
+            with instrumentation.phase(instrumentation.FETCH):
+                time.sleep(0.001)
+            write()
+            write()
+
+    assert set(recorder.feeds) == {"url0", "url1"}
+    assert set(recorder.feeds["url0"]) == {instrumentation.FETCH, instrumentation.DB}
+    # Both writes of a feed land in one histogram entry.
+    assert sum(recorder.phases[instrumentation.DB].histogram) == 2
+
+    lines = list(recorder.report())
+    assert lines[0].startswith("phase")
+    assert any(line.startswith(instrumentation.DB) for line in lines)
+    assert "slowest feeds:" in lines
@@ -0,0 +1,49 @@
+import gevent
+
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader.controllers.feed_item_detail import FeedItemDetailController, LOADING
+from kyles_feedreader.view.feed_item_detail import RenderCache, wrap_text
+
+
+def test_wrap_text():
+    text = "one two three four\n\n\n\nfive"
+    assert wrap_text(text, 9) == ["one two", "three", "four", "", "five"]
+    assert wrap_text(text, 100) == ["one two three four", "", "five"]
+    assert wrap_text(None, 10) == []
+
+
+def test_render_cache_evicts_least_recently_used():
+    cache = RenderCache(size=2)
+    assert cache.get((1, 80), lambda: ["a"]) == ["a"]
+    cache.get((2, 80), lambda: ["b"])
+    assert cache.get((1, 80), lambda: ["not again"]) == ["a"]
+    cache.get((3, 80), lambda: ["c"])
+    assert (1, 80) in cache and (3, 80) in cache
+    assert (2, 80) not in cache
+    assert (cache.hits, cache.misses, len(cache)) == (1, 3, 2)
+
+
+def test_prefetch(tmp_path):
+    # A file, the texts are loaded on another thread where an in-memory db would be a different, empty one.
+    session = dbi.DBInterface(tmp_path / "feeds.sqlite")
+    session.add_feeds([{"name": "f", "url": "f", "home_page": "f", "group_data": session.root_group,
+                        "entries": [{"title": f"item {i}", "url": f"i{i}", "text": f"text of item {i}"}
+                                    for i in range(20)]}])
+    items = session.get_item_page(limit=20)
+    assert session.get_item_texts([items[0].id, -1]) == {items[0].id: f"text of {items[0].title}"}
+
+    changes = []
+    controller = FeedItemDetailController(session, prefetch=2, on_change=lambda: changes.append(1))
+    controller.show(items[5], items[6:8] + items[3:5])
+    assert controller.lines(items[5].id, 40) == LOADING
+    gevent.sleep(0.5)
+    assert changes == [1]
+    assert controller.lines(items[5].id, 40) == [f"text of {items[5].title}"]
+    assert set(controller.texts) == {i.id for i in items[3:8]}
+
+    # Moving on only loads what wasn't loaded already.
+    controller.show(items[6], items[7:9] + items[4:6])
+    assert controller.lines(items[6].id, 40) == [f"text of {items[6].title}"]
+    assert changes == [1]
+    gevent.sleep(0.5)
+    assert set(controller.texts) == {i.id for i in items[3:9]}
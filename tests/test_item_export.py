@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader import item_export
+
+
+@pytest.fixture
+def session():
+    session = dbi.DBInterface(":memory:")
+    g = session.add_find_group("Test_Group", session.root_group)
+    sub = session.add_find_group("Sub_Group", g)
+    f0 = session.add_feed("Foo0", "url0", "homepage", session.root_group)
+    f1 = session.add_feed("Foo1", "url1", "homepage", sub)
+    for i, f in enumerate([f0, f1]):
+        session.add_feed_items(f, [{"title": f"Foo{i}{n}", "url": f"Foo{i}{n}URL", "timestamp": datetime(2020, 1, n + 1)}
+                                   for n in range(3)])
+    yield session
+
+
+def test_filters(session):
+    g = session.find_group_by_name("Test_Group", session.root_group)
+    f1 = session.find_feed_from_url("url1")
+
+    rows = list(session.iter_item_rows())
+    assert [r[0] for r in rows] == sorted(r[0] for r in rows)
+    assert len(rows) == 6
+
+    assert {r[2] for r in session.iter_item_rows(group=g)} == {"Foo1"}
+    assert {r[4] for r in session.iter_item_rows(feed=f1)} == {"Foo10", "Foo11", "Foo12"}
+    assert {r[4] for r in session.iter_item_rows(since=datetime(2020, 1, 3))} == {"Foo02", "Foo12"}
+    assert [r[0] for r in session.iter_item_rows(after_id=rows[3][0])] == [rows[4][0], rows[5][0]]
+
+    session.mark_feed_items_read(f1)
+    assert {r[2] for r in session.iter_item_rows(read=True)} == {"Foo1"}
+    assert {r[2] for r in session.iter_item_rows(read=False)} == {"Foo0"}
+
+
+def test_ndjson(session):
+    out = io.StringIO()
+    last_id = item_export.export_ndjson(session, out)
+    items = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(items) == 6
+    assert items[-1]["id"] == last_id
+    assert items[0]["feed_url"] == "url0"
+    assert items[0]["read"] is False
+    assert items[0]["timestamp"] == "2020-01-01 00:00:00.000000"
+    assert items[0]["enclosure_url"] is None
+
+    g = session.find_group_by_name("Test_Group", session.root_group)
+    out = io.StringIO()
+    item_export.export_ndjson(session, out, group=g, since=datetime(2020, 1, 2))
+    assert [json.loads(line)["title"] for line in out.getvalue().splitlines()] == ["Foo11", "Foo12"]
+
+
+def test_csv(session):
+    out = io.StringIO()
+    item_export.export_csv(session, out)
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert len(rows) == 6
+    assert rows[0]["title"] == "Foo00"
+
+
+def test_empty_export():
+    session = dbi.DBInterface(":memory:")
+    assert item_export.export_ndjson(session, io.StringIO()) is None
+    assert item_export.export_csv(session, io.StringIO()) is None
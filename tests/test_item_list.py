@@ -0,0 +1,147 @@
+import bisect
+
+from asciimatics.event import KeyboardEvent
+from asciimatics.screen import Screen
+
+from kyles_feedreader.view.item_list import LIST_END, PagedListBox, PagedWindow
+
+
+class Source:
+    """A sorted list of numbers paged by key the way the db pages items, counting the rows handed out."""
+    def __init__(self, length):
+        self.rows = list(range(length))
+        self.fetched = 0
+
+    def fetch(self, after, before, limit):
+        if before is LIST_END:
+            rows = self.rows[-limit:]
+        elif before is not None:
+            end = bisect.bisect_left(self.rows, before)
+            rows = self.rows[max(end - limit, 0):end]
+        else:
+            start = 0 if after is None else bisect.bisect_right(self.rows, after)
+            rows = self.rows[start:start + limit]
+        self.fetched += len(rows)
+        return rows
+
+
+def window(source, height=10, margin=5):
+    w = PagedWindow(source.fetch, lambda row: row, height, margin)
+    w.home()
+    return w
+
+
+def test_scrolling_keeps_a_bounded_window():
+    source = Source(100000)
+    w = window(source)
+    assert w.visible == list(range(10))
+    assert w.selected == 0
+
+    for _ in range(5000):
+        w.move(1)
+        assert len(w.rows) <= w.capacity
+    assert w.selected == 5000
+    assert w.visible == list(range(4991, 5001))
+    # Each row is fetched about once on the way down.
+    assert source.fetched < 5000 + 4 * (w.height + w.margin)
+
+    w.move(-10)
+    assert w.selected == 4990
+    assert w.visible[0] == 4990
+    w.move(-100000)
+    assert w.selected == 0 and w.at_start
+
+
+def test_pages_and_ends():
+    source = Source(1000)
+    w = window(source)
+    w.move(10)
+    assert w.visible == list(range(1, 11))
+    w.move(10000)
+    assert w.selected == 999 and w.at_end
+    assert w.visible == list(range(990, 1000))
+
+    w.home()
+    assert w.selected == 0
+    w.end()
+    assert w.selected == 999
+    assert w.visible == list(range(990, 1000))
+    w.move(-15)
+    assert w.selected == 984
+
+
+def test_reload_keeps_selection_in_place():
+    source = Source(1000)
+    w = window(source)
+    w.move(500)
+    w.move(-3)
+    offset = w.line - w.top
+    selected = w.selected
+
+    source.rows.remove(selected - 1)
+    source.rows.insert(0, -1)
+    w.reload()
+    assert w.selected == selected
+    assert w.line - w.top == offset
+    assert selected - 1 not in w.rows
+
+    # The selected row went away, the next one takes its place.
+    source.rows.remove(selected)
+    w.reload()
+    assert w.selected == selected + 1
+    assert w.line - w.top == offset
+
+
+def test_short_lists_and_resize():
+    source = Source(3)
+    w = window(source)
+    assert w.visible == [0, 1, 2]
+    w.move(5)
+    assert w.selected == 2
+    w.resize(1)
+    assert w.visible == [2]
+
+    empty = window(Source(0))
+    empty.move(1)
+    empty.end()
+    assert empty.selected is None and empty.visible == []
+
+
+def test_list_box_takes_over_a_window():
+    source = Source(1000)
+    w = window(source)
+    w.move(300)
+    fetched = source.fetched
+    box = PagedListBox(10, source.fetch, lambda row: row, str, window=w)
+    assert box.window is w
+    assert box.value == 300
+    assert source.fetched == fetched
+
+    # Laid out a few rows taller, only the rows newly on screen are needed.
+    w.resize(14)
+    assert box.value == 300
+    assert source.fetched - fetched <= w.height + w.margin
+
+
+def test_list_box_tells_user_moves_apart():
+    source = Source(100)
+    calls = []
+    box = PagedListBox(10, source.fetch, lambda row: row, str, on_change=lambda: calls.append("change"),
+                       on_move=lambda: calls.append("move"))
+    box.set_layout(0, 0, 0, 20, 10)
+
+    # Loading the list selects its first row, which the user didn't move to.
+    assert box.process_event(KeyboardEvent(ord("x"))) is not None
+    assert calls == ["change"]
+    box.process_event(KeyboardEvent(Screen.KEY_DOWN))
+    assert calls == ["change", "move", "change"]
+    box.process_event(KeyboardEvent(Screen.KEY_UP))
+    box.process_event(KeyboardEvent(Screen.KEY_UP))
+    assert calls == ["change", "move", "change", "move", "change"]
+
+    # Nor did they when the list goes back to the top for another source, or is fetched again.
+    calls.clear()
+    box.process_event(KeyboardEvent(Screen.KEY_END))
+    box.value = None
+    box.refresh()
+    assert calls == ["move", "change", "change"]
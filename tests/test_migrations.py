@@ -0,0 +1,102 @@
+import sqlite3
+
+import pytest
+from pony import orm
+
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader import migrations
+
+
+def test_new_database_is_stamped():
+    session = dbi.DBInterface(":memory:")
+    status = migrations.migration_status(session.db)
+    assert [s.version for s in status] == [m.version for m in migrations.MIGRATIONS]
+    assert all(s.applied and s.backfill_position is None for s in status)
+
+
+def test_existing_database_is_upgraded(tmp_path):
+    path = str(tmp_path / "db.sqlite")
+    session = dbi.DBInterface(path)
+    session.db.disconnect()
+
+    # Make it look like a database from before migrations existed.
+    con = sqlite3.connect(path)
+    con.execute('DROP TABLE "SchemaMigration"')
+    con.execute('DROP INDEX "idx_feeditem__feed_viewed"')
+    con.commit()
+    con.close()
+
+    session = dbi.DBInterface(path)
+    assert all(s.applied for s in migrations.migration_status(session.db))
+    with orm.db_session:
+        rows = session.db.get_connection().execute(
+            "SELECT name FROM sqlite_master WHERE name = 'idx_feeditem__feed_viewed'").fetchall()
+    assert rows
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    db = orm.Database()
+    db.bind(provider="sqlite", filename=str(tmp_path / "legacy.sqlite"), create_db=True)
+    with orm.db_session:
+        con = db.get_connection()
+        con.execute('CREATE TABLE "Feed" ("id" INTEGER PRIMARY KEY, "name" TEXT)')
+        con.executemany('INSERT INTO "Feed" ("name") VALUES (?)', [(f"feed{i}",) for i in range(10)])
+    yield db
+
+
+def add_column(connection):
+    connection.execute('ALTER TABLE "Feed" ADD COLUMN "upper_name" TEXT')
+
+
+def test_backfill_resumes(legacy_db):
+    fail_after = [2]
+
+    def backfill(connection, after_id, batch_size):
+        if fail_after[0] == 0:
+            raise RuntimeError("interrupted")
+        fail_after[0] -= 1
+        rows = connection.execute('SELECT "id", "name" FROM "Feed" WHERE "id" > ? ORDER BY "id" LIMIT ?',
+                                  (after_id, batch_size)).fetchall()
+        if not rows:
+            return None
+        connection.executemany('UPDATE "Feed" SET "upper_name" = ? WHERE "id" = ?',
+                               [(name.upper(), i) for i, name in rows])
+        return rows[-1][0]
+
+    mlist = [migrations.Migration(1, "upper name", add_column, backfill)]
+    assert migrations.apply_migrations(legacy_db, mlist) == mlist
+    assert migrations.apply_migrations(legacy_db, mlist) == []
+
+    with pytest.raises(RuntimeError):
+        migrations.run_backfills(legacy_db, mlist, batch_size=3)
+    assert migrations.migration_status(legacy_db, mlist)[0].backfill_position == 6
+
+    fail_after[0] = 100
+    positions = []
+    migrations.run_backfills(legacy_db, mlist, batch_size=3, progress=lambda m, p: positions.append(p))
+    assert positions == [9, 10, None]
+    assert migrations.migration_status(legacy_db, mlist)[0].backfill_position is None
+
+    with orm.db_session:
+        rows = legacy_db.get_connection().execute('SELECT "upper_name" FROM "Feed"').fetchall()
+    assert all(r[0] is not None and r[0].startswith("FEED") for r in rows)
+
+
+def test_added_columns(tmp_path):
+    path = str(tmp_path / "db.sqlite")
+    session = dbi.DBInterface(path)
+    session.add_feed("Foo", "url", "homepage", session.root_group)
+    session.db.disconnect()
+
+    con = sqlite3.connect(path)
+    con.execute('ALTER TABLE "Feed" DROP COLUMN "last_error"')
+    con.execute('ALTER TABLE "Feed" DROP COLUMN "failures"')
+    con.execute('DELETE FROM "SchemaMigration" WHERE "version" = 3')
+    con.commit()
+    con.close()
+
+    session = dbi.DBInterface(path)
+    feed = session.find_feed_from_url("url")
+    assert feed.failures == 0
+    assert feed.last_error is None
@@ -0,0 +1,167 @@
+from datetime import datetime
+from http import HTTPStatus
+
+import pytest
+
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader import opml
+from kyles_feedreader.feed_parsing import ResultType
+
+
+opml_data = """<?xml version="1.0" encoding="utf-8"?>
+<opml version="1.0">
+<head><title>Subscriptions</title></head>
+<body>
+<outline text="Comics">
+  <outline text="Foo" type="rss" xmlUrl="http://foo.example.com/rss"/>
+  <outline text="Daily">
+    <outline text="Bar" type="rss" xmlUrl="http://bar.example.com/rss"/>
+  </outline>
+</outline>
+<outline text="Broken" type="rss" xmlUrl="http://broken.example.com/rss"/>
+<outline text="Existing" type="rss" xmlUrl="http://existing.example.com/rss"/>
+<outline text="Foo again" type="rss" xmlUrl="http://foo.example.com/rss"/>
+</body>
+</opml>
+"""
+
+
+@pytest.fixture
+def session():
+    yield dbi.DBInterface(":memory:")
+
+
+@pytest.fixture
+def opml_file(tmp_path):
+    path = tmp_path / "feeds.opml"
+    path.write_text(opml_data)
+    yield str(path)
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    fetched = []
+
+    def parse_mock(url, etag=None, modified=None):
+        fetched.append(url)
+        if "raises" in url:
+            raise AttributeError("object has no attribute 'title'")
+        if "broken" in url:
+            return ResultType.HTTP_ERROR, {"status": HTTPStatus.NOT_FOUND}
+        name = url.split("//")[1].split(".")[0]
+        return ResultType.NONE, {
+            "name": name,
+            "home_page": f"http://{name}.example.com/",
+            "etag": "etag",
+            "modified": "",
+            "entries": [{"title": f"{name}{n}", "url": f"{url}/{n}", "timestamp": datetime(2020, 1, n + 1)}
+                        for n in range(2)],
+        }
+
+    monkeypatch.setattr(opml, "parse_feed", parse_mock)
+    yield fetched
+
+
+def test_read_outlines(opml_file):
+    groups, feeds = opml.read_outlines(opml_file)
+    assert groups == [("Comics",), ("Comics", "Daily")]
+    assert [(f.name, f.path) for f in feeds] == [
+        ("Foo", ("Comics",)),
+        ("Bar", ("Comics", "Daily")),
+        ("Broken", ()),
+        ("Existing", ()),
+        ("Foo again", ()),
+    ]
+
+
+def test_read_outlines_without_text(tmp_path):
+    path = tmp_path / "feeds.opml"
+    path.write_text("""<?xml version="1.0" encoding="utf-8"?>
+<opml version="2.0"><body>
+<outline title="Comics">
+  <outline title="Foo" type="rss" xmlUrl="http://foo.example.com/rss"/>
+  <outline>
+    <outline text="Bar" type="rss" xmlUrl="http://bar.example.com/rss"/>
+    <outline text="Daily"><outline text="Baz" type="rss" xmlUrl="http://baz.example.com/rss"/></outline>
+  </outline>
+</outline>
+</body></opml>""")
+    groups, feeds = opml.read_outlines(str(path))
+    assert groups == [("Comics",), ("Comics", "Daily")]
+    assert [(f.name, f.path) for f in feeds] == [
+        ("Foo", ("Comics",)),
+        ("Bar", ("Comics",)),
+        ("Baz", ("Comics", "Daily")),
+    ]
+
+
+def test_import(session, opml_file, fetched):
+    session.add_feed("Existing", "http://existing.example.com/rss", "homepage", session.root_group)
+
+    calls = []
+    report = opml.import_opml(session, opml_file, concurrency=2, batch_size=1,
+                              progress=lambda done, total, outline, error: calls.append((done, total, error)))
+
+    assert sorted(fetched) == ["http://bar.example.com/rss", "http://broken.example.com/rss",
+                               "http://foo.example.com/rss"]
+    assert [c[0] for c in calls] == [1, 2, 3]
+    assert report.groups == 2
+    assert sorted(report.added) == ["http://bar.example.com/rss", "http://foo.example.com/rss"]
+    assert report.existing == ["http://existing.example.com/rss"]
+    assert report.failed == [("http://broken.example.com/rss", "Not Found, Nothing matches the given URI")]
+
+    comics = session.find_group_by_name("Comics", session.root_group)
+    daily = session.find_group_by_name("Daily", comics)
+    assert [f.name for f in session.get_feeds(comics)] == ["foo"]
+    bar = session.get_feeds(daily)[0]
+    assert bar.etag == "etag"
+    assert bar.last_update is not None
+    assert [i.title for i in session.get_feed_items(bar)] == ["bar1", "bar0"]
+
+
+def test_import_survives_exceptions(session, opml_file, fetched, tmp_path):
+    path = tmp_path / "raises.opml"
+    path.write_text(opml_data.replace("http://broken.example.com/rss", "http://raises.example.com/rss"))
+    report = opml.import_opml(session, str(path))
+    assert report.failed == [("http://raises.example.com/rss", "AttributeError: object has no attribute 'title'")]
+    assert sorted(report.added) == ["http://bar.example.com/rss", "http://existing.example.com/rss",
+                                    "http://foo.example.com/rss"]
+
+
+def test_reimport_skips_network(session, opml_file, fetched):
+    opml.import_opml(session, opml_file)
+    fetched.clear()
+    report = opml.import_opml(session, opml_file)
+    assert fetched == ["http://broken.example.com/rss"]
+    assert not report.added
+    assert len(session.get_groups(session.root_group)) == 1
+
+
+def test_export_round_trip(session, opml_file, fetched, tmp_path):
+    opml.import_opml(session, opml_file)
+    session.add_find_group_paths([("Comics", "Empty"), ("Alpha",)])
+
+    out = tmp_path / "out.opml"
+    with open(out, "wb") as f:
+        assert opml.export_opml(session, f) == 3
+
+    groups, feeds = opml.read_outlines(str(out))
+    assert groups == [("Alpha",), ("Comics",), ("Comics", "Daily"), ("Comics", "Empty")]
+    assert [(f.name, f.url, f.path) for f in feeds] == [
+        ("bar", "http://bar.example.com/rss", ("Comics", "Daily")),
+        ("foo", "http://foo.example.com/rss", ("Comics",)),
+        ("existing", "http://existing.example.com/rss", ()),
+    ]
+
+
+def test_export_subtree(session, opml_file, fetched, tmp_path):
+    opml.import_opml(session, opml_file)
+    comics = session.find_group_by_name("Comics", session.root_group)
+
+    out = tmp_path / "out.opml"
+    with open(out, "wb") as f:
+        opml.export_opml(session, f, comics)
+
+    groups, feeds = opml.read_outlines(str(out))
+    assert groups == [("Daily",)]
+    assert [(f.name, f.path) for f in feeds] == [("bar", ("Daily",)), ("foo", ())]
@@ -0,0 +1,46 @@
+import pytest
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader import query_audit
+
+
+@pytest.fixture
+def session():
+    session = dbi.DBInterface(":memory:")
+    g = session.add_find_group("Test_Group", session.root_group)
+    for i in range(3):
+        f = session.add_feed(f"Foo{i}", f"url{i}", "homepage", g)
+        session.add_feed_items(f, [{"title": f"Foo{i}{n}", "url": f"Foo{i}{n}URL"} for n in range(3)])
+    yield session
+
+
+def plans_for(plans, method):
+    return [p for p in plans if p.method == method]
+
+
+def test_audit_empty_db():
+    with pytest.raises(ValueError, match="no feeds"):
+        query_audit.audit(dbi.DBInterface(":memory:"))
+
+
+def test_audit_uses_composite_indexes(session):
+    plans = query_audit.audit(session)
+
+    feed_item_plans = plans_for(plans, "get_feed_items")
+    assert any("feed_read_timestamp" in s for p in feed_item_plans for s in p.steps)
+    assert not any(p.flagged for p in feed_item_plans)
+
+    assert not any(p.temp_btrees for p in plans_for(plans, "get_feeds(group)"))
+    assert not any(p.flagged for p in plans_for(plans, "feed_has_unviewed_feed_items"))
+
+
+def test_audit_rolls_back(session):
+    query_audit.audit(session)
+    assert len(session.get_all_feed_items(unread_only=True)) == 9
+    assert session.any_has_unviewed_feed_items()
+
+
+def test_plan_flags():
+    plan = query_audit.QueryPlan("m", "sql", ["SCAN FeedItem", "SCAN f USING INDEX idx", "USE TEMP B-TREE FOR ORDER BY"])
+    assert plan.full_scans == ["SCAN FeedItem"]
+    assert plan.temp_btrees == ["USE TEMP B-TREE FOR ORDER BY"]
+    assert plan.flagged
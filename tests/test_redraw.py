@@ -0,0 +1,161 @@
+import os
+import signal
+import threading
+import time
+
+import gevent
+import pytest
+from asciimatics.exceptions import StopApplication
+
+from kyles_feedreader.redraw import RedrawLoop
+
+
+
+class FakeScreen:
+    """Stands in for asciimatics' Screen, reading key presses from a pipe."""
+    def __init__(self, input_fd):
+        self.input_fd = input_fd
+        self.keys = []
+        self.frames = 0
+        self.forced = 0
+        self.resized = False
+        self.closed = None
+        self.checks = 0  # The loop looks for a resize each time it wakes up.
+
+    def has_resized(self):
+        self.checks += 1
+        resized, self.resized = self.resized, False
+        return resized
+
+    def force_update(self, full_refresh=False):
+        self.forced += 1
+
+    def draw_next_frame(self, repeat=True):
+        try:
+            data = os.read(self.input_fd, 1024)
+        except BlockingIOError:
+            data = b""
+        self.keys.extend(data)
+        self.frames += 1
+        if b"q" in data:
+            raise StopApplication("Quit")
+
+    def close(self, restore=True):
+        self.closed = restore
+
+
+class FakeController:
+    def __init__(self):
+        self.builds = 0
+        self.refreshes = 0
+
+    def build_ui(self, screen, current_scene):
+        self.builds += 1
+
+    def refresh(self):
+        self.refreshes += 1
+
+
+@pytest.fixture
+def harness():
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    screens = []
+
+    def open_screen():
+        screens.append(FakeScreen(read_fd))
+        return screens[-1]
+
+    controller = FakeController()
+    loop = RedrawLoop(controller, open_screen=open_screen, input_fd=read_fd, coalesce=0.05, settle=0.05)
+    greenlet = gevent.spawn(loop.run)
+    gevent.sleep(0.01)
+    yield loop, controller, screens, write_fd
+    loop.stop()
+    greenlet.join(timeout=1)
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+def test_idle(harness):
+    # Counted rather than timed: CPU time takes in every thread of the test process, and an idle session is one
+    # whose loop never wakes up.
+    loop, controller, screens, _ = harness
+    checks = screens[0].checks
+    gevent.sleep(1)
+    assert screens[0].checks == checks == 1
+    assert screens[0].frames == loop.draws == 1
+    assert controller.refreshes == 0
+
+
+def test_input_wakes(harness):
+    loop, _, screens, write_fd = harness
+    os.write(write_fd, b"ab")
+    gevent.sleep(0.01)
+    assert screens[0].keys == [ord("a"), ord("b")]
+    assert loop.draws == 2
+
+    os.write(write_fd, b"q")
+    gevent.sleep(0.01)
+    assert screens[0].closed is True
+
+
+def test_changes_are_coalesced(harness):
+    loop, controller, screens, _ = harness
+    for _ in range(100):
+        loop.notify()
+        gevent.sleep(0)
+    gevent.sleep(0.1)
+    assert controller.refreshes == 1
+    assert loop.draws == 2
+    assert screens[0].forced == 1
+
+    # From another thread as well.
+    thread = threading.Thread(target=loop.notify)
+    thread.start()
+    thread.join()
+    gevent.sleep(0.1)
+    assert controller.refreshes == 2
+
+    # A steady stream of changes is redrawn at most once a window.
+    started = time.monotonic()
+    while time.monotonic() - started < 0.3:
+        loop.notify()
+        gevent.sleep(0.001)
+    gevent.sleep(0.1)
+    assert controller.refreshes <= 2 + 0.3 / loop.coalesce + 1
+
+
+def test_input_cuts_the_window_short(harness):
+    loop, controller, screens, write_fd = harness
+    loop.notify()
+    gevent.sleep(0.001)
+    os.write(write_fd, b"x")
+    gevent.sleep(0.01)
+    assert controller.refreshes == 1
+    assert screens[0].keys == [ord("x")]
+
+
+def test_resize_rebuilds(harness):
+    loop, controller, screens, _ = harness
+    screens[0].resized = True
+    loop.notify()
+    gevent.sleep(0.3)
+    assert len(screens) == 2
+    assert screens[0].closed is False
+    assert controller.builds == 2
+
+
+def test_resizes_are_debounced(harness):
+    loop, controller, screens, _ = harness
+    screens[0].resized = True
+    loop.notify()
+    # A drag: the terminal keeps changing size for longer than settle, a step at a time.
+    for _ in range(10):
+        gevent.sleep(0.02)
+        os.kill(os.getpid(), signal.SIGWINCH)
+    assert len(screens) == 1
+    gevent.sleep(0.3)
+    assert len(screens) == 2
+    assert controller.builds == 2
+    assert loop.rebuilds == 1
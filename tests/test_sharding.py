@@ -0,0 +1,83 @@
+from collections import Counter
+
+import pytest
+
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader import fetching
+from kyles_feedreader.feed_server import FeedProfile, FeedServer
+from kyles_feedreader.sharding import HashRing, split_by_host, update_feeds_sharded
+
+
+@pytest.fixture(autouse=True)
+def no_host_limits():
+    fetching.configure(max_in_flight=8, min_interval=0)
+    yield
+    fetching.configure()
+
+
+def test_hash_ring():
+    hosts = [f"feeds{n}.example.com" for n in range(2000)]
+    ring = HashRing(4)
+    assert [ring.shard(h) for h in hosts] == [HashRing(4).shard(h) for h in hosts]
+    counts = Counter(ring.shard(h) for h in hosts)
+    assert set(counts) == {0, 1, 2, 3}
+    assert max(counts.values()) < 1.5 * len(hosts) / 4
+
+    # A fifth shard only takes hosts over, it doesn't shuffle the others around.
+    bigger = HashRing(5)
+    moved = [h for h in hosts if bigger.shard(h) != ring.shard(h)]
+    assert all(bigger.shard(h) == 4 for h in moved)
+    assert len(moved) < 2 * len(hosts) / 5
+
+
+def test_split_by_host():
+    session = dbi.DBInterface(":memory:")
+    urls = [f"https://feeds{n % 7}.example.com/{n}" for n in range(70)]
+    feeds = session.add_feeds({"name": url, "url": url, "home_page": url, "group_data": session.root_group}
+                              for url in urls)
+    shards = split_by_host(feeds, 3)
+    assert sorted(f.id for shard in shards for f in shard) == sorted(f.id for f in feeds)
+    for shard in shards:
+        for other in shards:
+            if other is not shard:
+                assert not {fetching.host_of(f.url) for f in shard} & {fetching.host_of(f.url) for f in other}
+
+
+def test_update_feeds_sharded(tmp_path):
+    with FeedServer(FeedProfile(items=2, item_size=20, auth_rate=0.1), hosts=4) as server:
+        session = dbi.DBInterface(tmp_path / "feeds.sqlite")
+        urls = [server.url(n) for n in range(20)]
+        assert len({fetching.host_of(url) for url in urls}) == 4
+        session.add_feeds({"name": url, "url": url, "home_page": url, "group_data": session.root_group}
+                          for url in urls)
+        locked = sum(server.traits(n).auth for n in range(20))
+        seen = []
+
+        # A queue of one has every worker waiting on the writer most of the time.
+        report = update_feeds_sharded(session, workers=3, concurrency=2, per_host=2, interval=0,
+                                      queue_size=1, progress=lambda statuses: seen.append(statuses))
+        assert report.fetched == 20
+        assert report.failed == locked
+        assert report.new_items == 2 * (20 - locked)
+        assert session.count_items() == 2 * (20 - locked)
+
+        statuses = seen[-1]
+        assert all(s.done for s in statuses)
+        assert sum(s.written for s in statuses) == sum(s.feeds for s in statuses) == 20
+
+        # Nothing has changed on the server, so the next update is all 304s.
+        report = update_feeds_sharded(session, workers=3, ignore_cache=True)
+        assert report.not_modified == 20 - locked
+        assert report.new_items == 0
+
+
+def test_update_feeds_sharded_deadline(tmp_path):
+    with FeedServer(FeedProfile(items=2, item_size=20, latency=0.3), hosts=2) as server:
+        session = dbi.DBInterface(tmp_path / "feeds.sqlite")
+        urls = [server.url(n) for n in range(30)]
+        session.add_feeds({"name": url, "url": url, "home_page": url, "group_data": session.root_group}
+                          for url in urls)
+        report = update_feeds_sharded(session, workers=2, concurrency=1, per_host=1, interval=0, deadline=1.5)
+        assert 0 < report.fetched < 30
+        assert report.fetched + len(report.unfinished) == 30
+        assert session.count_items() == 2 * report.fetched
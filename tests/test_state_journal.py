@@ -0,0 +1,146 @@
+import time
+
+import gevent
+import pytest
+
+from kyles_feedreader import db_interface as dbi
+from kyles_feedreader.controllers.feed_list import FeedListController
+from kyles_feedreader.state_journal import StateJournal
+
+
+@pytest.fixture
+def session(tmp_path):
+    # Writes go through the thread pool, which an in-memory db, one per thread, can't be shared with.
+    session = dbi.DBInterface(str(tmp_path / "db.sqlite"))
+    session.add_feeds({"name": name, "url": name, "home_page": name, "group_data": session.root_group,
+                       "entries": [{"title": f"{name}{i}", "url": f"{name}{i}"} for i in range(5)]}
+                      for name in "ab")
+    return session
+
+
+def test_marks_are_applied_then_written_together(session):
+    journal = StateJournal(session)
+    items = session.get_item_page(limit=10)
+    marked = journal.mark(items[0], read=True, viewed=True)
+    assert marked.read and marked.viewed
+    assert journal.mark(marked, read=True) == marked
+    journal.mark(items[1], starred=True)
+    journal.mark(items[2], read=True)
+    journal.mark(items[2], read=False)
+    assert journal.apply(items[0]) == marked
+    assert journal.unread_delta() == {items[0].feed: -1}
+    assert journal.unread_delta([items[0].feed + 100]) == {}
+    assert session.count_items() == 10
+
+    assert journal.flush() == 3
+    assert journal.flush() == 0
+    assert journal.apply(items[0]) == items[0]
+    assert journal.unread_delta() == {}
+    rows = {i.id: i for i in session.get_item_page(unread_only=False, limit=10)}
+    assert rows[items[0].id].read and rows[items[0].id].viewed
+    assert rows[items[1].id].starred and not rows[items[1].id].read
+    assert not rows[items[2].id].read
+    assert session.count_items() == 9
+
+
+def test_marks_being_written_still_apply(session, monkeypatch):
+    journal = StateJournal(session)
+    items = session.get_item_page(limit=10)
+    journal.mark(items[0], read=True)
+    journal.mark(items[1], read=True)
+    write = session.set_item_states
+    seen = []
+
+    def slow_write(states):
+        seen.append((journal.apply(items[0]).read, journal.unread_delta()))
+        time.sleep(0.1)
+        write(states)
+
+    monkeypatch.setattr(session, "set_item_states", slow_write)
+    flush = gevent.spawn(journal.flush)
+    gevent.sleep(0.05)
+    # The hub is free while the marks are written, and they still show.
+    assert not flush.ready()
+    assert journal.apply(items[0]).read
+    journal.mark(items[0], read=False)
+    journal.mark(items[2], read=True)
+    assert journal.unread_delta() == {items[0].feed: -2}
+    assert flush.get() == 2
+    assert seen == [(True, {items[0].feed: -2})]
+    # The marks made meanwhile are for the next write, over what the db now has.
+    assert journal.unread_delta() == {}
+    assert not journal.apply(items[0]).read and journal.apply(items[2]).read
+    monkeypatch.undo()
+    assert journal.flush() == 2
+    assert session.count_items() == 8
+
+
+def test_failed_write_is_retried(session, monkeypatch):
+    journal = StateJournal(session)
+    items = session.get_item_page(limit=10)
+    journal.mark(items[0], read=True, starred=True)
+
+    def failing_write(states):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(session, "set_item_states", failing_write)
+    with pytest.raises(OSError):
+        journal.flush()
+    assert journal.flushes == 0
+    assert journal.apply(items[0]).read and journal.apply(items[0]).starred
+    assert journal.unread_delta() == {items[0].feed: -1}
+
+    monkeypatch.undo()
+    journal.mark(items[0], starred=False)
+    assert journal.flush() == 1
+    row = session.get_item_page(unread_only=False, limit=1)[0]
+    assert row.read and not row.starred
+    assert session.count_items() == 9
+
+
+def test_bad_flag(session):
+    with pytest.raises(ValueError):
+        session.set_item_states({1: {"title": True}})
+
+
+def test_worker_flushes_when_idle_or_on_time(session):
+    journal = StateJournal(session, flush_interval=0.3, idle=0.1)
+    worker = gevent.spawn(journal.worker)
+    try:
+        items = session.get_item_page(limit=10)
+        journal.mark(items[0], read=True)
+        gevent.sleep(0.05)
+        assert journal.flushes == 0
+        gevent.sleep(0.1)
+        assert journal.flushes == 1
+        assert session.count_items() == 9
+
+        # A keypress every 50ms never leaves it idle, the marks are written flush_interval after the first.
+        started = time.monotonic()
+        for item in items[1:9]:
+            journal.mark(item, read=True)
+            gevent.sleep(0.05)
+        assert time.monotonic() - started >= 0.3
+        assert journal.flushes == 2
+        assert 0 < len(journal) < 8
+    finally:
+        worker.kill()
+    journal.flush()
+    assert session.count_items() == 1
+
+
+def test_feed_counts_include_pending_marks(session):
+    journal = StateJournal(session)
+    controller = FeedListController(session, journal=journal)
+    item = session.get_item_page(limit=1)[0]
+    journal.mark(item, read=True)
+    controller.add_unread({item.feed: -1})
+    assert controller.counts[("all",)] == 9
+
+    # Counted again from the db before the mark is written, it still counts.
+    controller.update_counts([item.feed])
+    assert controller.counts[("feed", item.feed)] == 4
+    journal.flush()
+    controller.update_counts([item.feed])
+    assert controller.counts[("feed", item.feed)] == 4
+    assert FeedListController(session).counts[("all",)] == 9